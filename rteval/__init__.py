@@ -76,8 +76,11 @@ class RtEval(rtevalReport):
         self.__logger.log(Log.DEBUG, f"Adding {pypath} to search path")
 
         # Initialise the report module
+        simulated = None
+        if self.__rtevcfg.simulate:
+            simulated = (float(self.__rtevcfg.simulate), float(self.__rtevcfg.simulated_duration))
         rtevalReport.__init__(self, self.__version,
-                              self.__rtevcfg.installdir, self.__rtevcfg.annotate)
+                              self.__rtevcfg.installdir, self.__rtevcfg.annotate, simulated)
 
     @staticmethod
     def __show_remaining_time(remaining):
@@ -119,6 +122,9 @@ class RtEval(rtevalReport):
                   'memsize':self._sysinfo.mem_get_size(),
                   'numanodes':self._sysinfo.mem_get_numa_nodes(),
                   'duration': float(self.__rtevcfg.duration),
+                  # seconds of the load and measurement tools per second,
+                  # the stand-ins of a simulation run faster
+                  'timescale': float(self.__rtevcfg.simulate) if self.__rtevcfg.simulate else 1.0,
                   'usingCpupower': self.__rtevcfg.usingCpupower
                   }
 
@@ -128,6 +134,47 @@ class RtEval(rtevalReport):
 
         self.__logger.log(Log.INFO, "Preparing measurement modules")
         self._measuremods.Setup(params)
+        if self._measuremods.Calibrating() and self._loadmods and \
+           self._loadmods._cfg.GetSection("loads").schedule:
+            raise RuntimeError("--measurement-calibrate and --loads-schedule can't be used together")
+
+
+    def __PhaseSwitch(self):
+        """ start the next load phase, or calibration step, when it is due
+        and tell the measurement modules about it """
+        now = time.time()
+        if self._measuremods.Calibrating():
+            phase = self._measuremods.CalibrationSwitch(now)
+            start = self._measuremods.CalibrationStart
+        elif self._loadmods:
+            phase = self._loadmods.PhaseSwitch(now)
+            start = self._loadmods.PhaseStart
+        else:
+            return
+        if phase is not None:
+            # the histograms are rotated before the loads or the
+            # collector of the new phase run
+            self._measuremods.PhaseChange(phase, now)
+            start()
+
+
+    def __NextPhaseSwitch(self):
+        """ return the time of the next phase switch, None if there is none """
+        if self._measuremods.Calibrating():
+            return self._measuremods.NextCalibrationSwitch()
+        if self._loadmods:
+            return self._loadmods.NextPhaseSwitch()
+        return None
+
+
+    def __WaitForStart(self):
+        """ wait for the --start-at time, to start together with other hosts """
+        delay = float(self.__rtevcfg.start_at) - time.time()
+        if delay < 0:
+            self.__logger.log(Log.WARN, f"start time passed {-delay:.1f}s ago, starting now")
+            return
+        self.__logger.log(Log.INFO, f"waiting {delay:.1f}s for the start time")
+        time.sleep(delay)
 
 
     def __RunMeasurement(self):
@@ -163,9 +210,14 @@ class RtEval(rtevalReport):
             print(f"Run duration: {str(self.__rtevcfg.duration)} seconds")
 
             self._measuremods.Start()
+            # the builds are done, start together with the other hosts
+            if self.__rtevcfg.start_at:
+                self.__WaitForStart()
 
             # Unleash the loads and measurement threads
             report_interval = int(self.__rtevcfg.report_interval)
+            # loads not in the first phase are frozen before they start
+            self.__PhaseSwitch()
             if self._loadmods:
                 self._loadmods.Unleash()
                 nthreads = threading.active_count()
@@ -183,7 +235,12 @@ class RtEval(rtevalReport):
             rpttime = currtime + report_interval
             load_avg_checked = 5
             while (currtime <= stoptime) and not stopsig.is_set():
-                stopsig.wait(min(stoptime - currtime, 60.0))
+                timeout = min(stoptime - currtime, 60.0)
+                if self.__NextPhaseSwitch() is not None:
+                    timeout = max(min(timeout, self.__NextPhaseSwitch() - currtime), 0)
+                stopsig.wait(timeout)
+                if time.time() < stoptime:
+                    self.__PhaseSwitch()
                 if not self._measuremods.isAlive():
                     stoptime = currtime
                     earlystop = True
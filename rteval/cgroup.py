@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Module to contain and account load modules in cgroup v2 groups
+
+Every load gets a group below rteval-<pid> in the cgroup v2 hierarchy,
+with cpuset.cpus/cpuset.mems set from the load cpus and optional
+memory.max, io.max and pids.max limits.  The cpu, memory and pressure
+(PSI) accounting files of the group are read back for the report.
+"""
+
+import os
+import time
+import signal
+import libxml2
+from rteval.Log import Log
+
+# controllers enabled for the load groups, when available
+CONTROLLERS = ('cpuset', 'cpu', 'memory', 'io', 'pids')
+
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+
+
+def cgroup2_mount():
+    """ return the mount point of the cgroup v2 hierarchy, or None """
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'cgroup2':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def read_pressure(path):
+    """ parse a PSI file (/proc/pressure/* or <cgroup>/*.pressure)
+    :return: dict keyed by 'some' and 'full', each a dict of
+             avg10, avg60, avg300 (%) and total (us), or None if unavailable
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    result = {}
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        values = {}
+        for field in fields[1:]:
+            key, _, val = field.partition('=')
+            values[key] = int(val) if key == 'total' else float(val)
+        result[fields[0]] = values
+    return result
+
+
+def read_keyed(path):
+    """ parse a flat keyed cgroup file like cpu.stat into a dict of ints """
+    result = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2:
+                    result[fields[0]] = int(fields[1])
+    except (OSError, ValueError):
+        pass
+    return result
+
+
+class Cgroup:
+    """ class handling one cgroup v2 directory """
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def read(self, name, default=None):
+        """ return the stripped contents of a cgroup file """
+        try:
+            with open(self._file(name), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return default
+
+    def write(self, name, value):
+        """ write a value to a cgroup file """
+        with open(self._file(name), 'w', encoding='utf-8') as f:
+            f.write(str(value))
+
+    def create(self):
+        """ create the cgroup directory """
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+
+    def controllers(self):
+        """ return the list of controllers available in this group """
+        return (self.read('cgroup.controllers') or "").split()
+
+    def enable_controllers(self, wanted):
+        """ enable the wanted controllers for the children of this group """
+        enabled = [c for c in wanted if c in self.controllers()]
+        if enabled:
+            self.write('cgroup.subtree_control', " ".join(f"+{c}" for c in enabled))
+        return enabled
+
+    def pids(self):
+        """ return the list of processes in this group """
+        return [int(p) for p in (self.read('cgroup.procs') or "").split()]
+
+    def freeze(self, frozen=True):
+        """ freeze or thaw all processes in the group """
+        self.write('cgroup.freeze', int(frozen))
+
+    def kill(self, timeout=5.0):
+        """ kill all processes in the group and wait for them to leave """
+        if os.path.exists(self._file('cgroup.kill')):
+            self.write('cgroup.kill', 1)
+        else:
+            for pid in self.pids():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        end = time.time() + timeout
+        while self.pids() and time.time() < end:
+            time.sleep(0.1)
+
+    def remove(self):
+        """ remove the (empty) cgroup directory """
+        if os.path.isdir(self.path):
+            os.rmdir(self.path)
+
+
+class LoadCgroup(Cgroup):
+    """ cgroup containing one load module, with its accounting """
+    def __init__(self, path, name):
+        Cgroup.__init__(self, path)
+        self.name = name
+        self.cpus = ""
+        self.mems = ""
+        self.limits = {}
+        self.__created = None
+        self.__elapsed = None
+        self.__stats = None
+        # [start, end] of every interval the group was frozen, end is
+        # None while it is
+        self.__frozen = []
+
+    def setup(self, cpus, mems, limits):
+        """ create the group and apply the cpuset and limits
+        :param cpus: cpulist string for cpuset.cpus
+        :param mems: node list string for cpuset.mems
+        :param limits: dict of cgroup file names (memory.max, io.max, pids.max) to values
+        """
+        self.create()
+        self.cpus = cpus
+        self.mems = mems
+        if cpus:
+            self.write('cpuset.cpus', cpus)
+        if mems:
+            self.write('cpuset.mems', mems)
+        for name, value in limits.items():
+            # io.max takes one line per device
+            for line in str(value).split(';'):
+                self.write(name, line.strip())
+            self.limits[name] = value
+        self.__created = time.time()
+
+    def freeze(self, frozen=True):
+        Cgroup.freeze(self, frozen)
+        now = time.time()
+        if frozen and not (self.__frozen and self.__frozen[-1][1] is None):
+            self.__frozen.append([now, None])
+        elif not frozen and self.__frozen and self.__frozen[-1][1] is None:
+            self.__frozen[-1][1] = now
+
+    def frozen_time(self, start, end):
+        """ return the seconds the group was frozen between start and end """
+        total = 0.0
+        for fstart, fend in self.__frozen:
+            fend = end if fend is None else fend
+            total += max(min(fend, end) - max(fstart, start), 0.0)
+        return total
+
+    def collect(self):
+        """ save the accounting values of the group """
+        self.__elapsed = time.time() - self.__created if self.__created else 0
+        stats = {'cpu': read_keyed(self._file('cpu.stat')),
+                 'memory_events': read_keyed(self._file('memory.events')),
+                 'pressure': {}}
+        for key in ('memory.peak', 'memory.current', 'memory.swap.current'):
+            value = self.read(key)
+            if value is not None and value.isdigit():
+                stats[key] = int(value)
+        for res in PRESSURE_RESOURCES:
+            psi = read_pressure(self._file(f'{res}.pressure'))
+            if psi:
+                stats['pressure'][res] = psi
+        self.__stats = stats
+        return stats
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('cgroup')
+        rep_n.newProp('load', self.name)
+        rep_n.newProp('path', self.path)
+        rep_n.newProp('cpus', self.cpus)
+        rep_n.newProp('mems', self.mems)
+        for name, value in self.limits.items():
+            lim_n = rep_n.newChild(None, 'limit', str(value))
+            lim_n.newProp('name', name)
+        if self.__stats is None:
+            return rep_n
+
+        cpu = self.__stats['cpu']
+        if cpu:
+            cpu_n = rep_n.newChild(None, 'cpu', None)
+            for key in ('usage_usec', 'user_usec', 'system_usec'):
+                if key in cpu:
+                    cpu_n.newProp(key.replace('_usec', ''), str(cpu[key]))
+            cpu_n.newProp('unit', 'us')
+            if 'nr_periods' in cpu:
+                thr_n = rep_n.newChild(None, 'throttling', None)
+                thr_n.newProp('periods', str(cpu['nr_periods']))
+                thr_n.newProp('throttled', str(cpu.get('nr_throttled', 0)))
+                thr_n.newProp('throttled_time', str(cpu.get('throttled_usec', 0)))
+                thr_n.newProp('unit', 'us')
+
+        if 'memory.current' in self.__stats:
+            mem_n = rep_n.newChild(None, 'memory', None)
+            for key in ('memory.peak', 'memory.current', 'memory.swap.current'):
+                if key in self.__stats:
+                    mem_n.newProp(key.split('.', 1)[1].replace('.', '_'), str(self.__stats[key]))
+            for key in ('high', 'max', 'oom', 'oom_kill'):
+                if key in self.__stats['memory_events']:
+                    mem_n.newProp(f'events_{key}', str(self.__stats['memory_events'][key]))
+            mem_n.newProp('unit', 'bytes')
+
+        # stall totals of a new group cover its whole lifetime
+        window_us = int(self.__elapsed * 1000000)
+        for res, psi in self.__stats['pressure'].items():
+            for kind, values in psi.items():
+                psi_n = rep_n.newChild(None, 'pressure', None)
+                psi_n.newProp('resource', res)
+                psi_n.newProp('type', kind)
+                psi_n.newProp('total', str(values.get('total', 0)))
+                psi_n.newProp('avg60', f"{values.get('avg60', 0.0):.2f}")
+                if window_us > 0:
+                    psi_n.newProp('percent', f"{100.0 * values.get('total', 0) / window_us:.2f}")
+        return rep_n
+
+
+class LoadCgroups:
+    """ class creating and removing the cgroups of all load modules """
+    def __init__(self, logger=None, root=None):
+        self.__logger = logger
+        mount = root or cgroup2_mount()
+        if mount is None:
+            raise OSError("no cgroup v2 hierarchy mounted")
+        self.__parent = Cgroup(os.path.join(mount, f'rteval-{os.getpid()}'))
+        self.__groups = {}
+        self.__controllers = None
+
+    def _log(self, logtype, msg):
+        if self.__logger:
+            self.__logger.log(logtype, f"[cgroup] {msg}")
+
+    def create(self, name, cpus, mems, limits):
+        """ create the group for load name, returning the LoadCgroup """
+        if self.__controllers is None:
+            # controllers must be enabled top down to reach our groups
+            try:
+                Cgroup(os.path.dirname(self.__parent.path)).enable_controllers(CONTROLLERS)
+            except OSError as err:
+                self._log(Log.WARN, f"enabling controllers failed: {err}")
+            self.__parent.create()
+            self.__controllers = self.__parent.enable_controllers(CONTROLLERS)
+            self._log(Log.DEBUG, f"created {self.__parent} (controllers: {' '.join(self.__controllers)})")
+        group = LoadCgroup(os.path.join(self.__parent.path, name), name)
+        group.setup(cpus if 'cpuset' in self.__controllers else "",
+                    mems if 'cpuset' in self.__controllers else "",
+                    limits)
+        self.__groups[name] = group
+        return group
+
+    def controllers(self):
+        """ return the controllers enabled for the load groups """
+        return self.__controllers or []
+
+    def freeze(self, running, thaw=True):
+        """ thaw the groups of the loads in running and freeze all others.
+        With thaw=False the groups in running are left as they are """
+        for name, group in self.__groups.items():
+            if name not in running or thaw:
+                group.freeze(name not in running)
+
+    def thaw(self):
+        """ let the processes of all groups run """
+        self.freeze(list(self.__groups))
+
+    def collect(self):
+        """ save the accounting of all groups """
+        for group in self.__groups.values():
+            group.collect()
+
+    def cleanup(self):
+        """ kill left over processes and remove all groups """
+        for group in self.__groups.values():
+            group.kill()
+            try:
+                group.remove()
+            except OSError as err:
+                self._log(Log.WARN, f"failed removing {group}: {err}")
+        try:
+            self.__parent.remove()
+        except OSError:
+            pass
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('cgroups')
+        rep_n.newProp('controllers', " ".join(self.controllers()))
+        for group in self.__groups.values():
+            rep_n.addChild(group.MakeReport())
+        return rep_n
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/cgroup.py """
+    import tempfile
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            psi = os.path.join(tmp, 'cpu.pressure')
+            with open(psi, 'w', encoding='utf-8') as f:
+                f.write("some avg10=1.50 avg60=0.25 avg300=0.00 total=12345\n"
+                        "full avg10=0.00 avg60=0.00 avg300=0.00 total=42\n")
+            p = read_pressure(psi)
+            print(f"pressure: {p}")
+            assert p['some']['avg10'] == 1.5 and p['some']['total'] == 12345
+            assert p['full']['total'] == 42
+
+            stat = os.path.join(tmp, 'cpu.stat')
+            with open(stat, 'w', encoding='utf-8') as f:
+                f.write("usage_usec 1000\nuser_usec 600\nsystem_usec 400\n"
+                        "nr_periods 10\nnr_throttled 2\nthrottled_usec 50\n")
+            s = read_keyed(stat)
+            print(f"cpu.stat: {s}")
+            assert s['usage_usec'] == 1000 and s['nr_throttled'] == 2
+            assert read_pressure(os.path.join(tmp, 'missing')) is None
+
+            # frozen intervals, cgroup.freeze is a plain file here
+            group = LoadCgroup(tmp, 'test')
+            start = time.time()
+            group.freeze(True)
+            time.sleep(0.2)
+            group.freeze(True)
+            group.freeze(False)
+            end = time.time()
+            frozen = group.frozen_time(start, end)
+            print(f"frozen {frozen:.3f}s of {end - start:.3f}s")
+            assert 0.2 <= frozen <= end - start
+            assert group.frozen_time(end, end + 10) == 0.0
+            group.freeze(True)
+            assert group.frozen_time(end, time.time() + 1) >= 1.0
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
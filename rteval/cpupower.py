@@ -1,35 +1,82 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 # Copyright 2024    Anubhav Shelat <ashelat@redhat.com>
-""" Object to execute cpupower tool """
+""" Object to control cpu idle states and frequency through sysfs """
 
 import subprocess
 import os
 import shutil
 import sys
 from rteval.Log import Log
-from rteval.systopology import SysTopology as SysTop
+from rteval.systopology import get_systopology
 from rteval import cpulist_utils
 
 PATH = '/sys/devices/system/cpu/'
 
-class Cpupower:
-    """ class to store data for executing cpupower and restoring idle state configuration """
-    def __init__(self, cpulist, idlestate, logger=None):
-        if not self.cpupower_present():
-            print('cpupower not found')
-            sys.exit(1)
 
-        self.__idle_state = int(idlestate)
-        self.__states = os.listdir(PATH + 'cpu0/cpuidle/')
+def _read(file, default=None):
+    """ read a single line sysfs value, returning default if unavailable """
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            return f.readline().strip()
+    except OSError:
+        return default
+
+
+def _write(file, value):
+    """ write a single sysfs value """
+    with open(file, 'w', encoding='utf-8') as f:
+        f.write(value)
+
+
+def idle_states(cpu):
+    """ return the sorted list of cpuidle state directory names of a cpu """
+    try:
+        states = os.listdir(os.path.join(PATH, f'cpu{cpu}', 'cpuidle'))
+    except OSError:
+        return []
+    states = [s for s in states if s.startswith('state')]
+    return sorted(states, key=lambda s: int(s[5:]))
+
+
+def read_idle_stats(cpu):
+    """ return a dict of idle states for cpu, each holding the state name,
+    number of entries (usage) and total residency in us (time)
+    """
+    stats = {}
+    for state in idle_states(cpu):
+        path = os.path.join(PATH, f'cpu{cpu}', 'cpuidle', state)
+        stats[state] = {'name': _read(os.path.join(path, 'name'), state),
+                        'usage': int(_read(os.path.join(path, 'usage'), 0)),
+                        'time': int(_read(os.path.join(path, 'time'), 0))}
+    return stats
+
+
+def read_cpufreq(cpu):
+    """ return the current frequency of cpu in kHz, or None without cpufreq """
+    freq = _read(os.path.join(PATH, f'cpu{cpu}', 'cpufreq', 'scaling_cur_freq'))
+    return int(freq) if freq else None
+
+
+class Cpupower:
+    """ class to store data for setting idle states and frequency governors
+    through sysfs and restoring the previous configuration """
+    def __init__(self, cpulist, idlestate, logger=None, governor=None):
+        self.__idle_state = int(idlestate) if idlestate is not None else None
+        self.__states = idle_states(0)
         # self.__idle_states is a dict with cpus as keys,
         # and another dict as the value. The value dict
         # has idle states as keys and a boolean as the
         # value indicating if the state is disabled.
         self.__idle_states = {}
+        # self.__governors holds the original scaling governor per cpu
+        self.__governors = {}
+        self.__governor = governor
         self.__name = "cpupower"
-        self.__online_cpus = SysTop().online_cpus()
+        self.__online_cpus = get_systopology().online_cpus()
         self.__cpulist = cpulist
+        self.__cpus = [c for c in cpulist_utils.expand_cpulist(cpulist)
+                       if c in self.__online_cpus]
         self.__logger = logger
 
 
@@ -40,7 +87,7 @@ class Cpupower:
 
 
     def enable_idle_state(self):
-        """ Use cpupower to set the idle state """
+        """ Set the idle state depth by writing the cpuidle disable files """
         self.get_idle_states()
 
         # ensure that idle state is in range of available idle states
@@ -49,17 +96,50 @@ class Cpupower:
             sys.exit(1)
 
         # enable all idle states to a certain depth, and disable any deeper idle states
-        with open(os.devnull, 'wb') as buffer:
-            for state in self.__states:
-                s = state.strip("state")
-                if int(s) > self.__idle_state:
-                    self.run_cpupower(['cpupower', '-c', self.__cpulist,'idle-set', '-d', s], buffer)
-                else:
-                    self.run_cpupower(['cpupower', '-c', self.__cpulist,'idle-set', '-e', s], buffer)
+        try:
+            for cpu in self.__cpus:
+                for state in self.__states:
+                    disable = '1' if int(state[5:]) > self.__idle_state else '0'
+                    fp = os.path.join(PATH, 'cpu' + str(cpu) + '/cpuidle/' + state + '/disable')
+                    if self.__idle_states[cpu][state] != disable:
+                        self.write_idle_state(fp, disable)
+        except OSError as err:
+            print(f'setting idle states failed: {err}')
+            self.restore_idle_states()
+            sys.exit(1)
 
         self._log(Log.DEBUG, f'Idle state depth {self.__idle_state} enabled on CPUs {self.__cpulist}')
 
 
+    def set_governor(self):
+        """ Set the cpufreq scaling governor on the cpus, saving the old one """
+        if not self.__governor:
+            return
+        for cpu in self.__cpus:
+            fp = os.path.join(PATH, f'cpu{cpu}', 'cpufreq', 'scaling_governor')
+            current = _read(fp)
+            if current is None:
+                self._log(Log.WARN, f'cpu{cpu} has no cpufreq support, governor not set')
+                continue
+            self.__governors[cpu] = current
+            try:
+                _write(fp, self.__governor)
+            except OSError as err:
+                print(f'setting governor {self.__governor} on cpu{cpu} failed: {err}')
+                self.restore_governors()
+                sys.exit(1)
+        self._log(Log.DEBUG, f'Governor {self.__governor} set on CPUs {self.__cpulist}')
+
+
+    def restore_governors(self):
+        """ restore the original cpufreq governors """
+        for cpu, governor in self.__governors.items():
+            fp = os.path.join(PATH, f'cpu{cpu}', 'cpufreq', 'scaling_governor')
+            _write(fp, governor)
+        self.__governors = {}
+        self._log(Log.DEBUG, 'Governor settings restored')
+
+
     def run_cpupower(self, args, output_buffer=None):
         """ execute cpupower """
         try:
@@ -83,7 +163,8 @@ class Cpupower:
         for cpu, states in self.__idle_states.items():
             for state, disabled in states.items():
                 fp = os.path.join(PATH, 'cpu' + str(cpu) + '/cpuidle/' + state + '/disable')
-                self.write_idle_state(fp, disabled)
+                if self.read_idle_state(fp) != disabled:
+                    self.write_idle_state(fp, disabled)
         self._log(Log.DEBUG, 'Idle state settings restored')
 
 
@@ -95,12 +176,14 @@ class Cpupower:
 
     def write_idle_state(self, file, state):
         """ write the disable value for and idle state """
-        with open(file, 'w', encoding='utf-8') as f:
-            f.write(state)
+        _write(file, state)
 
 
     def get_idle_info(self):
         """ execute cpupower idle-info """
+        if not self.cpupower_present():
+            print('cpupower not found')
+            return
         self.run_cpupower(['cpupower', 'idle-info'])
 
 
@@ -113,10 +196,13 @@ if __name__ == '__main__':
     l = Log()
     l.SetLogVerbosity(Log.DEBUG)
 
-    online_cpus = cpulist_utils.collapse_cpulist(SysTop().online_cpus())
+    online_cpus = cpulist_utils.collapse_cpulist(get_systopology().online_cpus())
     idlestate = '1'
     info = True
 
+    for c in get_systopology().online_cpus():
+        print(f'cpu{c}: freq={read_cpufreq(c)} kHz idle={read_idle_stats(c)}')
+
     cpupower = Cpupower(online_cpus, idlestate, logger=l)
     if idlestate:
         cpupower.enable_idle_state()
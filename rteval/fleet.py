@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Runs of rteval on a fleet of hosts
+
+With --fleet=HOSTS rteval becomes a coordinator: it runs rteval with the
+rest of its command line on every host, over ssh or, to try a fleet
+setup on one machine, as local processes.  All hosts are given the same
+--start-at time, so their measurements begin together whatever their
+build times are.  The output of every host is streamed to HOST/rteval.out
+in the fleet directory and the coordinator prints a snapshot of the
+fleet each time the state of a host changes.  When a host is done its
+report is fetched, while the others still run.
+
+The cyclictest and timerlat histograms of all hosts, read with
+histfile.read_report(), are then merged into fleet.xml, with the
+statistics of every host.  Hosts whose maximum or 99th percentile
+latency is more than OUTLIER_MADS median absolute deviations above the
+fleet median are marked as outliers.
+"""
+
+import os
+import re
+import sys
+import time
+import shlex
+import signal
+import tarfile
+import posixpath
+import threading
+import statistics
+import subprocess
+from datetime import datetime
+import libxml2
+import lxml.etree
+from rteval.Log import Log
+from rteval import histfile
+
+TRANSPORTS = ('ssh', 'local')
+DEFAULT_START_DELAY = 120
+DEFAULT_REMOTE_WORKDIR = '/var/tmp/rteval-fleet'
+# median absolute deviations above the fleet median making a host an outlier
+OUTLIER_MADS = 3.0
+# the metrics hosts are compared on
+OUTLIER_METRICS = ('max', 'p99')
+
+# coordinator options not passed on to the hosts, all taking a value
+_LOCAL_OPTIONS = ('--fleet', '-w', '--workdir', '-f', '--inifile')
+
+
+def parse_hosts(spec):
+    """ return the hosts of a comma separated list, or of a file given as
+    @FILE with one host per line """
+    if spec.startswith('@'):
+        with open(spec[1:]) as f:
+            hosts = [l.split('#')[0].strip() for l in f]
+    else:
+        hosts = [h.strip() for h in spec.split(',')]
+    hosts = [h for h in hosts if h]
+    if len(set(hosts)) != len(hosts):
+        raise RuntimeError(f"duplicate hosts in fleet '{spec}'")
+    return hosts
+
+
+def remote_args(argv):
+    """ return (argv without the coordinator options, the -f config file) """
+    args = []
+    inifile = None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        opt, sep, value = arg.partition('=')
+        if not opt.startswith('--'):
+            # -wDIR
+            opt, sep, value = (arg[:2], True, arg[2:]) if len(arg) > 2 else (arg, '', '')
+        if opt.startswith('--fleet') or opt in _LOCAL_OPTIONS:
+            if not sep and i < len(argv):
+                value = argv[i]
+                i += 1
+            if opt in ('-f', '--inifile'):
+                inifile = value
+            continue
+        args.append(arg)
+    return args, inifile
+
+
+def summarize(histograms):
+    """ return the statistics of the merged {cpu: Histogram} of a host """
+    hist = histfile.system(histograms)
+    stats = {'cpus': len(histograms), 'samples': hist.samples(), 'histogram': hist}
+    if hist.samples():
+        stats.update({'min': hist.min(), 'mean': hist.mean(), 'p99': hist.percentile(99),
+                      'p99.9': hist.percentile(99.9), 'max': hist.max(),
+                      'max_cpu': max(histograms, key=lambda c: histograms[c].max() or -1)})
+    return stats
+
+
+def find_outliers(values, mads=OUTLIER_MADS):
+    """ return the keys of {key: value} more than mads median absolute
+    deviations (at least 1us) above the median, with at least 3 values """
+    if len(values) < 3:
+        return []
+    median = statistics.median(values.values())
+    mad = statistics.median(abs(v - median) for v in values.values())
+    limit = median + mads * max(mad, 1)
+    return sorted(k for k, v in values.items() if v > limit)
+
+
+class Transport:
+    """ runs shell commands on the hosts and copies files to and from them """
+    def command(self, host, script):
+        """ return the argv running script on host """
+        raise NotImplementedError
+
+    def run(self, host, script, **kwargs):
+        return subprocess.run(self.command(host, script), check=False, **kwargs)
+
+    def put(self, host, local, remote):
+        with open(local, 'rb') as f:
+            ret = self.run(host, f"mkdir -p {shlex.quote(posixpath.dirname(remote))} && "
+                           f"cat > {shlex.quote(remote)}", stdin=f)
+        if ret.returncode:
+            raise RuntimeError(f"cannot copy {local} to {host}:{remote}")
+
+    def get(self, host, remote, local):
+        with open(local, 'wb') as f:
+            ret = self.run(host, f"cat {shlex.quote(remote)}", stdout=f)
+        if ret.returncode:
+            os.unlink(local)
+            raise RuntimeError(f"cannot copy {host}:{remote} to {local}")
+
+    def listdir(self, host, remote):
+        ret = self.run(host, f"ls {shlex.quote(remote)}", capture_output=True, text=True)
+        return ret.stdout.split() if ret.returncode == 0 else []
+
+
+class SSHTransport(Transport):
+    """ runs the commands with ssh, which must not ask for passwords """
+    def __init__(self, options=None):
+        self.__options = ['-o', 'BatchMode=yes'] + shlex.split(options or '')
+
+    def command(self, host, script):
+        return ['ssh'] + self.__options + [host, script]
+
+
+class LocalTransport(Transport):
+    """ runs the commands of all hosts on this machine, the hosts only
+    differing by their directories """
+    def command(self, host, script):
+        return ['sh', '-c', script]
+
+
+class FleetHost(threading.Thread):
+    """ the rteval run of a host, copying inifile to rundir/rteval.conf
+    first, streaming its output into outdir and fetching its report when
+    it is done """
+    def __init__(self, host, transport, rundir, outdir, command, inifile=None):
+        threading.Thread.__init__(self, name=f"fleet-{host}", daemon=True)
+        self.host = host
+        self.status = 'starting'
+        self.last = ''
+        self.exitcode = None
+        self.error = None
+        # local path of the fetched report
+        self.report = None
+        self.__transport = transport
+        self.__rundir = rundir
+        self.__outdir = outdir
+        self.__command = command
+        self.__inifile = inifile
+        self.__stopped = False
+
+    def run(self):
+        script = (f"mkdir -p {shlex.quote(self.__rundir)} && cd {shlex.quote(self.__rundir)} && "
+                  f"echo $$ > rteval.pid && exec {' '.join(shlex.quote(a) for a in self.__command)}")
+        try:
+            if self.__inifile:
+                self.__transport.put(self.host, self.__inifile, posixpath.join(self.__rundir, 'rteval.conf'))
+            if self.__stopped:
+                raise RuntimeError("stopped before rteval was started")
+            # in a session of its own, ^C must not end ssh before the remote run
+            with subprocess.Popen(self.__transport.command(self.host, script), stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                  errors='replace', start_new_session=True) as proc, \
+                 open(os.path.join(self.__outdir, 'rteval.out'), 'w') as out:
+                self.status = 'preparing'
+                for line in proc.stdout:
+                    out.write(line)
+                    out.flush()
+                    if line.startswith('rteval run on'):
+                        self.status = 'running'
+                    elif line.startswith('stopping run'):
+                        self.status = 'reporting'
+                    # not the separator lines of the text report
+                    if re.search(r'\w', line):
+                        self.last = line.strip()
+            self.exitcode = proc.returncode
+            self.status = 'fetching'
+            self.report = self.__fetch()
+            self.status = 'done'
+        except (OSError, RuntimeError) as err:
+            self.error = str(err)
+            self.status = 'failed'
+
+    def __fetch(self):
+        reports = sorted(f for f in self.__transport.listdir(self.host, self.__rundir)
+                         if re.match(r'rteval-\d{8}-\d+\.tar\.bz2$', f))
+        if not reports:
+            raise RuntimeError(f"no report (exit code {self.exitcode}), see {self.__outdir}/rteval.out")
+        local = os.path.join(self.__outdir, reports[-1])
+        self.__transport.get(self.host, posixpath.join(self.__rundir, reports[-1]), local)
+        return local
+
+    def stop(self):
+        """ ask the rteval of the host to stop and report """
+        self.__stopped = True
+        self.__transport.run(self.host, f"kill -INT $(cat {shlex.quote(self.__rundir)}/rteval.pid)",
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class Fleet:
+    """ coordinator of the rteval runs of a fleet """
+    def __init__(self, config, logger):
+        self.__cfg = config
+        self.__rtevcfg = config.GetSection('rteval')
+        self.__logger = logger
+        self.__hosts = parse_hosts(str(self.__rtevcfg.fleet))
+        transport = self.__rtevcfg.fleet_transport or 'ssh'
+        if transport not in TRANSPORTS:
+            raise RuntimeError(f"invalid fleet transport '{transport}' (valid: {', '.join(TRANSPORTS)})")
+        if transport == 'ssh':
+            self.__transport = SSHTransport(self.__rtevcfg.fleet_ssh_options)
+            command = self.__rtevcfg.fleet_command or 'rteval'
+        else:
+            self.__transport = LocalTransport()
+            # this rteval, with the same interpreter
+            command = self.__rtevcfg.fleet_command or \
+                f"{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(sys.argv[0]))}"
+        self.__command = shlex.split(command)
+        self.__remote_workdir = self.__rtevcfg.fleet_workdir or DEFAULT_REMOTE_WORKDIR
+        self.__delay = float(self.__rtevcfg.fleet_start_delay or DEFAULT_START_DELAY)
+        self.__stopped = threading.Event()
+        self.__fleetdir = None
+        self.__start = None
+        self.__runs = []
+        # test -> {'fleet': stats, host: stats}
+        self.__results = {}
+        # test -> {metric: [hosts]}
+        self.__outliers = {}
+
+
+    def __make_fleet_dir(self):
+        workdir = self.__rtevcfg.workdir
+        i = 1
+        while True:
+            fleetdir = os.path.join(workdir, datetime.now().strftime(f"rteval-fleet-%Y%m%d-{i}"))
+            if not os.path.exists(fleetdir):
+                os.mkdir(fleetdir)
+                return fleetdir
+            i += 1
+
+
+    def __sig_handler(self, signum, frame):
+        if not self.__stopped.is_set():
+            print("*** stop signal received - stopping the fleet run ***")
+            self.__stopped.set()
+
+
+    def __snapshot(self):
+        """ print the number of hosts in every state, and their last output when verbose """
+        states = {}
+        for run in self.__runs:
+            states[run.status] = states.get(run.status, 0) + 1
+        elapsed = time.time() - self.__start
+        when = f"{-elapsed:.0f}s to start" if elapsed < 0 else f"{elapsed:.0f}s since start"
+        print(f"fleet ({when}): " + ', '.join(f"{n} {s}" for s, n in states.items()))
+        for run in self.__runs:
+            self.__logger.log(Log.INFO, f"  {run.host} [{run.status}]: {run.error or run.last}")
+        sys.stdout.flush()
+        return states
+
+
+    def Run(self, argv):
+        """ run rteval with argv on all hosts, merge their reports and
+        return 0 if all of them reported, 1 if not """
+        self.__fleetdir = self.__make_fleet_dir()
+        args, inifile = remote_args(argv)
+        runid = os.path.basename(self.__fleetdir)
+        self.__start = time.time() + self.__delay
+        self.__logger.log(Log.INFO, f"running rteval on {len(self.__hosts)} hosts, "
+                          f"starting at {time.ctime(self.__start)}, results in {self.__fleetdir}")
+
+        for host in self.__hosts:
+            outdir = os.path.join(self.__fleetdir, host)
+            os.mkdir(outdir)
+            rundir = posixpath.join(self.__remote_workdir, runid, host)
+            command = self.__command + args + ['-w', rundir, f'--start-at={self.__start:.3f}']
+            if inifile:
+                command += ['-f', posixpath.join(rundir, 'rteval.conf')]
+            # the copies run in parallel, in the thread of every host
+            self.__runs.append(FleetHost(host, self.__transport, rundir, outdir, command, inifile))
+
+        signal.signal(signal.SIGINT, self.__sig_handler)
+        signal.signal(signal.SIGTERM, self.__sig_handler)
+        try:
+            for run in self.__runs:
+                run.start()
+            states = None
+            stopping = False
+            nextreport = time.time() + int(self.__rtevcfg.report_interval)
+            while any(run.is_alive() for run in self.__runs):
+                # only once, a second SIGINT would end rteval while it reports
+                if self.__stopped.wait(1.0) and not stopping:
+                    stopping = True
+                    for run in self.__runs:
+                        if run.is_alive():
+                            run.stop()
+                current = sorted((run.host, run.status) for run in self.__runs)
+                if current != states or time.time() >= nextreport:
+                    self.__snapshot()
+                    states = current
+                    nextreport = time.time() + int(self.__rtevcfg.report_interval)
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        for run in self.__runs:
+            if run.status == 'failed':
+                self.__logger.log(Log.WARN, f"{run.host}: {run.error}")
+        self.__merge()
+        self.__write_report()
+        self.__print_summary()
+        return 0 if all(run.report for run in self.__runs) else 1
+
+
+    def __merge(self):
+        for run in self.__runs:
+            if not run.report:
+                continue
+            try:
+                tests = histfile.read_report(run.report)
+            except (OSError, RuntimeError, tarfile.TarError, lxml.etree.XMLSyntaxError) as err:
+                self.__logger.log(Log.WARN, f"cannot read the report of {run.host}: {err}")
+                continue
+            for metadata, cpus in tests:
+                self.__results.setdefault(metadata['test'], {})[run.host] = summarize(cpus)
+
+        for test, hosts in self.__results.items():
+            fleet = summarize({host: stats['histogram'] for host, stats in hosts.items()})
+            if 'max_cpu' in fleet:
+                fleet['max_host'] = fleet.pop('max_cpu')
+            self.__outliers[test] = {
+                metric: find_outliers({h: s[metric] for h, s in hosts.items() if s['samples']})
+                for metric in OUTLIER_METRICS}
+            hosts['fleet'] = fleet
+
+
+    @staticmethod
+    def __stats_node(name, stats):
+        node = libxml2.newNode(name)
+        for key in ('cpus', 'samples', 'min', 'mean', 'p99', 'p99.9', 'max', 'max_cpu', 'max_host'):
+            if key in stats:
+                value = stats[key]
+                node.newProp(key.replace('.', '_'), f"{value:.2f}" if isinstance(value, float) else str(value))
+        return node
+
+
+    def __write_report(self):
+        doc = libxml2.newDoc('1.0')
+        root = libxml2.newNode('rteval_fleet')
+        doc.setRootElement(root)
+        root.newProp('start', str(datetime.fromtimestamp(self.__start)))
+        root.newProp('hosts', str(len(self.__runs)))
+        root.newProp('reports', str(len([r for r in self.__runs if r.report])))
+        for run in self.__runs:
+            host_n = root.newChild(None, 'host', None)
+            host_n.newProp('name', run.host)
+            host_n.newProp('status', run.status)
+            if run.exitcode is not None:
+                host_n.newProp('exitcode', str(run.exitcode))
+            if run.report:
+                host_n.newProp('report', os.path.relpath(run.report, self.__fleetdir))
+            if run.error:
+                host_n.newChild(None, 'error', run.error)
+            for test, hosts in self.__results.items():
+                if run.host in hosts:
+                    test_n = host_n.addChild(self.__stats_node(test, hosts[run.host]))
+                    outlier = [m for m, h in self.__outliers[test].items() if run.host in h]
+                    if outlier:
+                        test_n.newProp('outlier', ','.join(outlier))
+        for test, hosts in self.__results.items():
+            test_n = root.addChild(self.__stats_node(test, hosts['fleet']))
+            test_n.newProp('hosts', str(len(hosts) - 1))
+            test_n.addChild(hosts['fleet']['histogram'].MakeReport())
+        doc.saveFormatFileEnc(os.path.join(self.__fleetdir, 'fleet.xml'), 'UTF-8', 1)
+        doc.freeDoc()
+
+
+    def __print_summary(self):
+        ok = len([r for r in self.__runs if r.report])
+        print(f"\nrteval fleet run of {len(self.__runs)} hosts started at {time.ctime(self.__start)}: "
+              f"{ok} reports in {self.__fleetdir}")
+        for run in self.__runs:
+            if not run.report:
+                print(f"   {run.host}: {run.status}, {run.error}")
+        for test, hosts in self.__results.items():
+            fleet = hosts['fleet']
+            if not fleet['samples']:
+                continue
+            print(f"\n{test}: {fleet['samples']} samples on {len(hosts) - 1} hosts, min {fleet['min']}us, "
+                  f"mean {fleet['mean']:.2f}us, p99 {fleet['p99']}us, max {fleet['max']}us ({fleet['max_host']})")
+            print(f"   {'host':<24} {'samples':>12} {'min':>6} {'mean':>8} {'p99':>6} {'p99.9':>6} {'max':>6}")
+            for host in sorted(h for h in hosts if h != 'fleet'):
+                s = hosts[host]
+                if not s['samples']:
+                    continue
+                outlier = [m for m, h in self.__outliers[test].items() if host in h]
+                print(f" {'*' if outlier else ' '} {host:<24} {s['samples']:>12} {s['min']:>6} "
+                      f"{s['mean']:>8.2f} {s['p99']:>6} {s['p99.9']:>6} {s['max']:>6}"
+                      + (f"   outlier: {', '.join(outlier)}" if outlier else ''))
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/fleet.py """
+    import tempfile
+    from rteval.histogram import Histogram
+    try:
+        assert parse_hosts('a, b,,c') == ['a', 'b', 'c']
+        args, inifile = remote_args(['--fleet=a,b', '-d', '1h', '-w', '/tmp', '--fleet-transport', 'local',
+                                     '-f', 'my.conf', '--workdir=/x', '-w/y', '--simulate'])
+        print(f"remote args: {args}, {inifile}")
+        assert args == ['-d', '1h', '--simulate'] and inifile == 'my.conf'
+
+        assert find_outliers({'a': 10, 'b': 11, 'c': 12, 'd': 50}) == ['d']
+        assert find_outliers({'a': 10, 'b': 11, 'c': 12}) == [] and find_outliers({'a': 1, 'b': 90}) == []
+
+        stats = summarize({'0': Histogram({3: 50, 5: 49, 40: 1}), '1': Histogram({4: 100})})
+        print(f"summary: { {k: v for k, v in stats.items() if k != 'histogram'} }")
+        assert stats['samples'] == 200 and stats['max'] == 40 and stats['max_cpu'] == '0'
+        assert stats['p99'] == 5 and stats['min'] == 3
+
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'src')
+            with open(src, 'w') as f:
+                f.write('data')
+            transport = LocalTransport()
+            transport.put('h1', src, os.path.join(tmp, 'h1', 'dst'))
+            assert transport.listdir('h1', os.path.join(tmp, 'h1')) == ['dst']
+            transport.get('h1', os.path.join(tmp, 'h1', 'dst'), os.path.join(tmp, 'back'))
+            with open(os.path.join(tmp, 'back')) as f:
+                assert f.read() == 'data'
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(unit_test(None))
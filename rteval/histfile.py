@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Compact binary histogram files, and merging them
+
+The cyclictest and timerlat modules write the per cpu histograms of a run
+to histograms/TEST.rthist in the report directory, so distributions of
+many runs or hosts can be summed without parsing XML reports.  The
+format, integers little endian:
+
+  magic           b'RTHIST'
+  version         u16, readers refuse newer versions
+  bucket width    u16, us of the buckets below the log-scaled range
+  log subbuckets  u16, see histogram.LOG_SUBBUCKETS
+  metadata        u32 length and a JSON object: test, host, kernel,
+                  rteval version, start, duration, ...
+  histograms      zlib compressed unsigned LEB128 varints: the number of
+                  histograms, then for each its name (length and utf-8),
+                  linear + 1 (0: no log-scaled range), maximum + 1
+                  (0: empty), overflows, the number of buckets and an
+                  (index delta, count) pair per bucket
+
+The histograms are named by cpu number.  Reports of older versions,
+without histogram files, are read from the histograms of summary.xml.
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+import tarfile
+import libxml2
+import lxml.etree
+from rteval.histogram import Histogram, LOG_SUBBUCKETS, merge_segments
+from rteval.version import RTEVAL_VERSION
+
+MAGIC = b'RTHIST'
+VERSION = 1
+SUFFIX = '.rthist'
+BUCKET_WIDTH = 1
+LATENCY_TESTS = ('cyclictest', 'timerlat')
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+_HEADER = struct.Struct('<6sHHHI')
+
+
+def _varints(values):
+    """ return the LEB128 encoding of non-negative integers """
+    out = bytearray()
+    for value in values:
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+
+class _Reader:
+    """ cursor over the varints and strings of a histogram file body """
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            if self.pos >= len(self.data):
+                raise RuntimeError("truncated histogram file")
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def string(self):
+        length = self.varint()
+        if self.pos + length > len(self.data):
+            raise RuntimeError("truncated histogram file")
+        self.pos += length
+        return self.data[self.pos - length:self.pos].decode()
+
+
+def pack(metadata, histograms):
+    """ return the histogram file of a metadata dict and {name: Histogram} """
+    body = _varints([len(histograms)])
+    for name, hist in histograms.items():
+        encoded = str(name).encode()
+        body += _varints([len(encoded)]) + encoded
+        body += _varints([0 if hist.linear is None else hist.linear + 1,
+                          0 if hist.maximum is None else hist.maximum + 1,
+                          hist.overflows, len(hist.buckets)])
+        last = 0
+        for index in sorted(hist.buckets):
+            body += _varints([index - last, hist.buckets[index]])
+            last = index
+    meta = json.dumps(metadata, sort_keys=True).encode()
+    return _HEADER.pack(MAGIC, VERSION, BUCKET_WIDTH, LOG_SUBBUCKETS, len(meta)) + meta + zlib.compress(body)
+
+
+def unpack(data):
+    """ return (metadata, {name: Histogram}) of a histogram file """
+    if len(data) < _HEADER.size:
+        raise RuntimeError("truncated histogram file")
+    magic, version, width, subbuckets, metalen = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise RuntimeError("not a rteval histogram file")
+    if version > VERSION:
+        raise RuntimeError(f"histogram file version {version} is newer than {VERSION}, update rteval")
+    if width != BUCKET_WIDTH or subbuckets != LOG_SUBBUCKETS:
+        raise RuntimeError(f"unsupported buckets ({width}us wide, {subbuckets} log subbuckets)")
+    try:
+        metadata = json.loads(data[_HEADER.size:_HEADER.size + metalen])
+        reader = _Reader(zlib.decompress(data[_HEADER.size + metalen:]))
+    except (ValueError, zlib.error) as err:
+        raise RuntimeError(f"corrupt histogram file: {err}")
+
+    histograms = {}
+    for _ in range(reader.varint()):
+        name = reader.string()
+        linear, maximum, overflows, nbuckets = [reader.varint() for _ in range(4)]
+        hist = Histogram(linear=linear - 1 if linear else None)
+        index = 0
+        for _ in range(nbuckets):
+            index += reader.varint()
+            hist.buckets[index] = reader.varint()
+        hist.maximum = maximum - 1 if maximum else None
+        hist.overflows = overflows
+        histograms[name] = hist
+    return metadata, histograms
+
+
+def save(path, metadata, histograms):
+    with open(path, 'wb') as f:
+        f.write(pack(metadata, histograms))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return unpack(f.read())
+
+
+def MakeHistogramFile(reportdir, test, segments, **metadata):
+    """ write the merged histograms of the segments of a run to
+    histograms/TEST.rthist of the report directory and return the
+    <histogram_file> node of the report """
+    if segments:
+        metadata.update({'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(segments[0].start)),
+                         'duration': round(segments[-1].end - segments[0].start, 3)})
+    uname = os.uname()
+    metadata.update({'test': test, 'host': uname.nodename, 'kernel': uname.release,
+                     'rteval_version': RTEVAL_VERSION})
+    histdir = os.path.join(reportdir, 'histograms')
+    os.makedirs(histdir, exist_ok=True)
+    path = os.path.join(histdir, test + SUFFIX)
+    save(path, metadata, merge_segments(segments))
+    file_n = libxml2.newNode('histogram_file')
+    file_n.newProp('file', os.path.relpath(path, reportdir))
+    file_n.newProp('version', str(VERSION))
+    file_n.newProp('bytes', str(os.path.getsize(path)))
+    return file_n
+
+
+def _xml_histograms(doc):
+    """ return [(metadata, {cpu: Histogram})] of the histograms in a
+    summary.xml, for reports without histogram files """
+    run = doc.find('run_info')
+    seconds = sum(int(run.get(unit, 0)) * mult for unit, mult in
+                  (('days', 86400), ('hours', 3600), ('minutes', 60), ('seconds', 1))) if run is not None else None
+    ret = []
+    for test in LATENCY_TESTS:
+        histograms = {}
+        for core in doc.iterfind(f'Measurements/{test}/core'):
+            buckets = [(int(b.get('index')), int(b.get('value')), b.get('width'))
+                       for b in core.iterfind('histogram/bucket')]
+            # the log-scaled buckets start with the first wide one
+            linear = min((index for index, _, width in buckets if width), default=None)
+            hist = Histogram({index: count for index, count, _ in buckets}, linear)
+            maximum = core.findtext('statistics/maximum')
+            if maximum is not None and hist.samples():
+                hist.maximum = int(maximum)
+            hist.overflows = int(core.findtext('statistics/overflows') or 0)
+            histograms[core.get('id')] = hist
+        if histograms:
+            ret.append(({'test': test, 'host': doc.findtext('.//uname/node'),
+                         'kernel': doc.findtext('.//uname/kernel'),
+                         'start': f"{doc.findtext('run_info/date')}T{doc.findtext('run_info/time')}",
+                         'duration': seconds}, histograms))
+    return ret
+
+
+def read_report(path):
+    """ return [(metadata, {cpu: Histogram})] of the latency tests of a
+    histogram file, report directory, report tarball or summary.xml """
+    if path.endswith(SUFFIX):
+        return [load(path)]
+    if os.path.isdir(path):
+        # a report directory, or the output directory of rteval --merge
+        for histdir in (os.path.join(path, 'histograms'), path):
+            files = sorted(f for f in os.listdir(histdir) if f.endswith(SUFFIX)) if os.path.isdir(histdir) else []
+            if files:
+                return [load(os.path.join(histdir, f)) for f in files]
+        return _xml_histograms(lxml.etree.parse(os.path.join(path, 'summary.xml')))
+    if path.endswith('.xml'):
+        return _xml_histograms(lxml.etree.parse(path))
+    with tarfile.open(path) as tar:
+        members = tar.getmembers()
+        files = sorted((m for m in members if m.name.endswith(SUFFIX)), key=lambda m: m.name)
+        if files:
+            return [unpack(tar.extractfile(m).read()) for m in files]
+        summary = next((m for m in members if m.name.endswith('summary.xml')), None)
+        if summary is None:
+            raise RuntimeError(f"no histograms or summary.xml in {path}")
+        return _xml_histograms(lxml.etree.parse(tar.extractfile(summary)))
+
+
+def merge(runs):
+    """ return {test: (metadata, {cpu: Histogram})} summing the per cpu
+    histograms of a list of (metadata, {cpu: Histogram}) by test """
+    merged = {}
+    for metadata, histograms in runs:
+        test = metadata.get('test', 'unknown')
+        meta, hists = merged.setdefault(test, ({'test': test, 'runs': 0, 'hosts': [], 'duration': 0.0}, {}))
+        # the output of an earlier merge counts with all its runs
+        meta['runs'] += metadata.get('runs', 1)
+        for host in metadata.get('hosts', [metadata.get('host')]):
+            if host and host not in meta['hosts']:
+                meta['hosts'].append(host)
+        meta['duration'] += metadata.get('duration') or 0
+        if metadata.get('start') and (not meta.get('start') or metadata['start'] < meta['start']):
+            meta['start'] = metadata['start']
+        for cpu, hist in histograms.items():
+            if cpu not in hists:
+                hists[cpu] = Histogram(linear=hist.linear)
+            elif hist.linear is not None and (hists[cpu].linear is None or hist.linear < hists[cpu].linear):
+                # the coarser buckets of both
+                coarse = Histogram(linear=hist.linear)
+                coarse.merge(hists[cpu])
+                hists[cpu] = coarse
+            hists[cpu].merge(hist)
+    return merged
+
+
+def system(histograms):
+    """ return the histogram of all cpus of {cpu: Histogram} """
+    linears = [h.linear for h in histograms.values() if h.linear is not None]
+    hist = Histogram(linear=min(linears) if linears else None)
+    for h in histograms.values():
+        hist.merge(h)
+    return hist
+
+
+def summary(merged):
+    """ return the statistics of merge() as text """
+    lines = []
+    for test, (meta, histograms) in merged.items():
+        hist = system(histograms)
+        lines.append(f"{test}: {meta['runs']} runs on {len(meta['hosts'])} hosts, "
+                     f"{meta['duration']:.0f}s from {meta.get('start', 'unknown')}, {hist.samples()} samples")
+        if not hist.samples():
+            continue
+        lines.append(f"   min {hist.min()}us, mean {hist.mean():.2f}us, "
+                     f"stddev {hist.stddev() or 0:.2f}us, max {hist.max()}us")
+        lines.append("   percentiles: " + ', '.join(f"{pct:g}%: {hist.percentile(pct)}us" for pct in PERCENTILES))
+        if hist.overflows:
+            lines.append(f"   {hist.overflows} samples above the histogram range, the statistics are lower bounds")
+        lines.append(f"   {'cpu':<6} {'samples':>14} {'min':>6} {'mean':>8} {'p99':>6} {'p99.99':>7} {'max':>6}")
+        for cpu in sorted(histograms, key=lambda c: (len(c), c)):
+            h = histograms[cpu]
+            if h.samples():
+                lines.append(f"   {cpu:<6} {h.samples():>14} {h.min():>6} {h.mean():>8.2f} "
+                             f"{h.percentile(99):>6} {h.percentile(99.99):>7} {h.max():>6}")
+    return '\n'.join(lines)
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/histfile.py """
+    import tempfile
+    from rteval.histogram import HistogramSegment
+    try:
+        assert _varints([0, 127, 128, 300]) == b'\x00\x7f\x80\x01\xac\x02'
+        reader = _Reader(bytes(_varints([0, 127, 128, 300, 2**40])))
+        assert [reader.varint() for _ in range(5)] == [0, 127, 128, 300, 2**40]
+
+        big = Histogram({3: 10**12, 5: 2}, linear=100)
+        big.add_overflow(3, 5000)
+        hists = {'0': big, '1': Histogram({4: 1}), '2': Histogram()}
+        data = pack({'test': 'cyclictest', 'host': 'a'}, hists)
+        print(f"packed: {len(data)} bytes")
+        meta, back = unpack(data)
+        assert meta == {'test': 'cyclictest', 'host': 'a'}
+        assert back['0'].buckets == big.buckets and back['0'].linear == 100
+        assert back['0'].max() == 5000 and back['0'].overflows == 3
+        assert back['1'].linear is None and back['2'].max() is None and not back['2'].buckets
+
+        for bad, error in ((data[:10], 'truncated'), (b'X' + data[1:], 'not a rteval'),
+                           (data[:6] + b'\x09\x00' + data[8:], 'newer'), (data[:-3], 'corrupt')):
+            try:
+                unpack(bad)
+                assert False, f"no error for {error}"
+            except RuntimeError as err:
+                assert error in str(err), str(err)
+
+        # a week of runs, one with coarser buckets above 50us
+        runs = [({'test': 'cyclictest', 'host': h, 'start': s, 'duration': 10},
+                 {'0': Histogram({i: 1 for i in range(1, 101)}, linear)})
+                for h, s, linear in (('a', '2026-10-02T00:00:00', 100), ('b', '2026-10-01T00:00:00', 50))]
+        merged = merge(runs + [({'test': 'timerlat'}, {'0': Histogram({7: 1})})])
+        meta, hists = merged['cyclictest']
+        print(f"merged: {meta}, {len(hists['0'])} buckets")
+        assert meta['runs'] == 2 and meta['hosts'] == ['a', 'b'] and meta['duration'] == 20
+        assert meta['start'] == '2026-10-01T00:00:00' and hists['0'].linear == 50
+        assert hists['0'].samples() == 200 and hists['0'].max() == 100 and hists['0'].percentile(50) == 50
+        assert merge([runs[1], runs[0]])['cyclictest'][1]['0'].buckets == hists['0'].buckets
+        assert merged['timerlat'][0]['runs'] == 1 and 'p99.99' in summary(merged)
+        remerged = merge([merged['cyclictest'], runs[0]])['cyclictest'][0]
+        assert remerged['runs'] == 3 and remerged['hosts'] == ['a', 'b'] and remerged['duration'] == 30
+
+        with tempfile.TemporaryDirectory() as tmp:
+            seg = HistogramSegment('', 100.0, 160.0, {'0': Histogram({3: 4}, linear=100)})
+            node = MakeHistogramFile(tmp, 'cyclictest', [seg, seg], command_line='cyclictest')
+            assert node.prop('file') == 'histograms/cyclictest.rthist'
+            (meta, hists), = read_report(tmp)
+            assert meta['duration'] == 60 and meta['command_line'] == 'cyclictest'
+            assert hists['0'].buckets == {3: 8}
+
+            xml = os.path.join(tmp, 'summary.xml')
+            with open(xml, 'w') as f:
+                f.write("""<rteval><run_info hours="1"><date>2026-10-01</date><time>10:00:00</time></run_info>
+                   <SystemInfo><uname><node>h1</node></uname></SystemInfo><Measurements><cyclictest>
+                   <system><histogram><bucket index="3" value="5"/></histogram></system>
+                   <core id="2"><statistics><maximum>3510</maximum><overflows above="3500">2</overflows></statistics>
+                     <histogram nbuckets="3"><bucket index="3" value="5"/><bucket index="4" value="1"/>
+                       <bucket index="3500" value="2" width="84"/></histogram></core>
+                 </cyclictest></Measurements></rteval>""")
+            (meta, hists), = read_report(xml)
+        print(f"xml: {meta}, {hists['2'].buckets}")
+        assert meta['host'] == 'h1' and meta['duration'] == 3600 and meta['start'] == '2026-10-01T10:00:00'
+        assert hists['2'].buckets == {3: 5, 4: 1, 3500: 2} and hists['2'].linear == 3500
+        assert hists['2'].max() == 3510 and hists['2'].overflows == 2
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Sparse latency histograms and histogram segments
+
+A Histogram only keeps the buckets holding samples, so keeping one per
+cpu for every segment of a long run stays small.  Above an optional
+linear range the buckets grow logarithmically (HDR histogram style),
+which bounds the number of buckets outliers can use.  Measurement
+modules close a HistogramSegment each time they rotate their histograms
+(at a fixed interval or when a load phase starts) and report the
+segments next to the merged histogram of the whole run.
+"""
+
+import math
+from datetime import datetime
+import libxml2
+
+# buckets per power of two above the linear range, each is at most
+# 1/LOG_SUBBUCKETS of its value wide
+LOG_SUBBUCKETS = 8
+
+
+def log_bucket(value, linear):
+    """ return (lower bound, width) of the bucket holding value, with 1us
+    buckets below linear and log-scaled buckets from linear on """
+    if linear is None or value < linear:
+        return value, 1
+    width = max((1 << (int(value).bit_length() - 1)) // LOG_SUBBUCKETS, 1)
+    lower = max(value - value % width, linear)
+    return lower, width - (lower - (value - value % width))
+
+
+class Histogram:
+    """ latency histogram, keeping only the buckets with samples.
+    Values from linear on go to log-scaled buckets keyed by their lower bound.
+    """
+    def __init__(self, buckets=None, linear=None):
+        self.buckets = {}
+        self.linear = linear
+        # the exact maximum, the bucket of an outlier only has a lower bound
+        self.maximum = None
+        # samples above the range of the measuring tool, see add_overflow()
+        self.overflows = 0
+        for index, count in (buckets or {}).items():
+            self.add(index, count)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, index, count=1):
+        """ add count samples to the bucket of index """
+        if count:
+            if self.maximum is None or index > self.maximum:
+                self.maximum = index
+            index = log_bucket(index, self.linear)[0]
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def add_overflow(self, count, maximum):
+        """ add count samples above the linear range when only their number
+        and maximum are known.  One goes to the bucket of the maximum, the
+        others to the first bucket above the range, which makes statistics
+        from them lower bounds """
+        if count and self.linear is not None:
+            self.add(maximum, 1)
+            self.add(self.linear, count - 1)
+            self.overflows += count
+
+    def merge(self, other):
+        """ add the samples of another histogram """
+        for index, count in other.buckets.items():
+            self.add(index, count)
+        if other.maximum is not None and (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+        self.overflows += other.overflows
+
+    def samples(self):
+        """ return the number of samples """
+        return sum(self.buckets.values())
+
+    def min(self):
+        """ return the lowest bucket with samples, None if empty """
+        return min(self.buckets) if self.buckets else None
+
+    def max(self):
+        """ return the highest sample, None if empty """
+        return self.maximum
+
+    def mean(self):
+        """ return the mean latency, None if empty """
+        samples = self.samples()
+        if not samples:
+            return None
+        return sum(i * c for i, c in self.buckets.items()) / samples
+
+    def stddev(self):
+        """ return the sample standard deviation, None with less than 2 samples """
+        samples = self.samples()
+        if samples < 2:
+            return None
+        mean = self.mean()
+        return math.sqrt(sum(c * (i - mean) ** 2 for i, c in self.buckets.items()) / (samples - 1))
+
+    def percentile(self, pct):
+        """ return the bucket holding the pct percentile, None if empty """
+        samples = self.samples()
+        if not samples:
+            return None
+        rank = pct * samples / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return index
+        return self.max()
+
+    def MakeReport(self):
+        hist_n = libxml2.newNode('histogram')
+        hist_n.newProp('nbuckets', str(len(self.buckets)))
+        for index in sorted(self.buckets):
+            b_n = hist_n.newChild(None, 'bucket', None)
+            b_n.newProp('index', str(index))
+            b_n.newProp('value', str(self.buckets[index]))
+            width = log_bucket(index, self.linear)[1]
+            if width > 1:
+                b_n.newProp('width', str(width))
+        return hist_n
+
+
+class HistogramSegment:
+    """ the per cpu histograms measured between start and end """
+    def __init__(self, name, start, end, histograms):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.histograms = histograms
+
+    def system(self):
+        """ return the histogram of all cpus """
+        hist = Histogram(linear=next((h.linear for h in self.histograms.values()), None))
+        for h in self.histograms.values():
+            hist.merge(h)
+        return hist
+
+    def MakeReport(self, index):
+        hist = self.system()
+        seg_n = libxml2.newNode('segment')
+        seg_n.newProp('index', str(index))
+        if self.name:
+            seg_n.newProp('name', self.name)
+        seg_n.newProp('start', str(datetime.fromtimestamp(self.start)))
+        seg_n.newProp('duration', f"{self.end - self.start:.3f}")
+        seg_n.newProp('samples', str(hist.samples()))
+        if hist.samples():
+            seg_n.newProp('min', str(hist.min()))
+            seg_n.newProp('max', str(hist.max()))
+            seg_n.newProp('mean', f"{hist.mean():.2f}")
+            # the cpu having the highest latency of the segment
+            worst = max(self.histograms, key=lambda c: self.histograms[c].max() or -1)
+            seg_n.newProp('max_cpu', str(worst))
+        seg_n.addChild(hist.MakeReport())
+        return seg_n
+
+
+def merge_segments(segments):
+    """ return the {cpu: Histogram} of the whole run of a list of HistogramSegment """
+    merged = {}
+    for seg in segments:
+        for cpu, hist in seg.histograms.items():
+            merged.setdefault(cpu, Histogram(linear=hist.linear)).merge(hist)
+    return merged
+
+
+def MakeSegmentsReport(segments):
+    """ return a <segments> node for a list of HistogramSegment """
+    segs_n = libxml2.newNode('segments')
+    segs_n.newProp('count', str(len(segments)))
+    for index, seg in enumerate(segments):
+        segs_n.addChild(seg.MakeReport(index))
+    return segs_n
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/histogram.py """
+    try:
+        a = Histogram({3: 10, 5: 2})
+        b = Histogram({3: 1, 40: 1, 7: 0})
+        print(f"a: {a.buckets}, b: {b.buckets}")
+        assert len(b) == 2 and 7 not in b.buckets
+        assert a.min() == 3 and a.max() == 5 and a.samples() == 12
+        assert Histogram().max() is None and Histogram().mean() is None
+        p = Histogram({i: 1 for i in range(1, 101)})
+        assert p.percentile(50) == 50 and p.percentile(99) == 99 and p.percentile(100) == 100
+        assert abs(p.stddev() - 29.011) < 0.001 and Histogram({1: 1}).stddev() is None
+
+        seg = HistogramSegment('kcompile', 100.0, 160.0, {'0': a, '1': b})
+        merged = seg.system()
+        print(f"merged: {merged.buckets}")
+        assert merged.buckets == {3: 11, 5: 2, 40: 1}
+        assert merged.samples() == 14 and merged.max() == 40
+
+        seg_n = seg.MakeReport(0)
+        assert seg_n.prop('max_cpu') == '1' and seg_n.prop('max') == '40'
+        assert seg_n.prop('duration') == '60.000'
+        segs_n = MakeSegmentsReport([seg, HistogramSegment('', 160.0, 161.0, {})])
+        assert segs_n.prop('count') == '2'
+
+        # log-scaled buckets above 100us
+        assert log_bucket(99, 100) == (99, 1)
+        assert log_bucket(100, 100) == (100, 4) and log_bucket(103, 100) == (100, 4)
+        assert log_bucket(104, 100) == (104, 8) and log_bucket(5000, 100) == (4608, 512)
+        h = Histogram(linear=100)
+        for v in range(100, 100000):
+            h.add(v)
+        print(f"hybrid: {len(h)} buckets for {h.samples()} samples")
+        assert len(h) < 100 and h.samples() == 99900
+        h = Histogram({5: 10}, linear=100)
+        h.add_overflow(3, 2500)
+        print(f"overflow: {h.buckets}")
+        assert h.buckets == {5: 10, 100: 2, 2304: 1} and h.max() == 2500 and h.overflows == 3
+
+        run = merge_segments([seg, HistogramSegment('', 160.0, 161.0, {'1': h})])
+        print(f"run: { {c: r.buckets for c, r in run.items()} }")
+        assert run['0'].buckets == a.buckets and run['1'].samples() == 15 and run['1'].overflows == 3
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
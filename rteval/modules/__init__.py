@@ -37,6 +37,7 @@ class rtevalModulePrototype(threading.Thread):
         self.__runtimeError = False
         self.__events = {"start": threading.Event(),
                          "stop": threading.Event(),
+                         "wake": threading.Event(),
                          "finished": threading.Event()}
         self._donotrun = False
         self._exclusive = False
@@ -107,9 +108,16 @@ class rtevalModulePrototype(threading.Thread):
     def setStop(self):
         """ Sets the stop event state """
         self.__events["stop"].set()
+        self.__events["wake"].set()
         self.__timestamps["stop_set"] = datetime.now()
 
 
+    def _setWake(self):
+        """ Wakes the module thread to run _WorkloadTask() without waiting
+        for the next round """
+        self.__events["wake"].set()
+
+
     def shouldStop(self):
         """ Returns the stop event state - indicating the module should stop """
         return self.__events["stop"].isSet()
@@ -170,6 +178,28 @@ class rtevalModulePrototype(threading.Thread):
         raise NotImplementedError(f"_WorkloadCleanup() method must be implemented in the {self._name} module")
 
 
+    def PhaseChange(self, name, timestamp):
+        """ Optional module method, called when the load schedule starts
+        the phase 'name' at timestamp (seconds since the epoch)
+        """
+        pass
+
+
+    def SetCollecting(self, active):
+        """ Optional module method, pauses (active=False) or resumes the data
+        collection of a measurement module not measuring latency.
+        Returns False if the module can't be paused
+        """
+        return False
+
+
+    def Segments(self):
+        """ Optional module method, returns the HistogramSegment list of a
+        latency measurement module
+        """
+        return []
+
+
     def WorkloadWillRun(self):
         "Returns True if this workload will be run"
         return self._donotrun is False
@@ -204,9 +234,10 @@ class rtevalModulePrototype(threading.Thread):
                 # Run the workload
                 self._WorkloadTask()
 
-                if self.shouldStop():
-                    break
-                time.sleep(self.__sleeptime)
+                # woken by setStop(), the cleanup must fit the join in Stop(),
+                # or by _setWake()
+                self.__events["wake"].wait(self.__sleeptime)
+                self.__events["wake"].clear()
 
             self.__timestamps["runloop_stop"] = datetime.now()
             self._log(Log.DEBUG, f"stopping {self._module_type} workload")
@@ -297,6 +328,30 @@ reference from the first import"""
                                   metavar='IDLESTATE',
                                   default=None,
                                   help='Idle state depth to set on cpus running measurement modules')
+            grparser.add_argument('--governor',
+                                  dest='measurement___governor',
+                                  metavar='GOVERNOR',
+                                  default=None,
+                                  help='cpufreq scaling governor to set on cpus running measurement modules')
+            grparser.add_argument(f'--{self.__modtype}-calibrate',
+                                  dest=f'{self.__modtype}___calibrate',
+                                  metavar='SECONDS',
+                                  default=config.GetSection("measurement").calibrate,
+                                  help='Measure the latency added by each measurement module, '
+                                  'switching them on one at a time for SECONDS')
+
+        # Set up options for load modules only
+        if self.__modtype == 'loads':
+            grparser.add_argument(f'--{self.__modtype}-cgroup',
+                                  dest=f'{self.__modtype}___cgroup',
+                                  action='store_true',
+                                  default=str(config.GetSection("loads").setdefault("cgroup", "false")).lower() == "true",
+                                  help='Run each load module in its own cgroup v2 group')
+            grparser.add_argument(f'--{self.__modtype}-schedule',
+                                  dest=f'{self.__modtype}___schedule',
+                                  metavar='SCHEDULE',
+                                  default=config.GetSection("loads").schedule,
+                                  help="Run the loads in phases, e.g. '10m idle, 20m kcompile, 10m hackbench+stressng'")
 
         for (modname, mod) in list(self.__modsloaded.items()):
             opts = mod.ModuleParameters()
@@ -485,6 +540,33 @@ class RtEvalModules:
         return nthreads
 
 
+    def PhaseChange(self, name, timestamp):
+        """Tells all the loaded modules a new load phase started"""
+
+        for (modname, mod) in self.__modules:
+            mod.PhaseChange(name, timestamp)
+
+
+    def SetCollecting(self, active):
+        """Pauses the modules not measuring latency, except the ones in active
+        :return: a dict of module name to False if it can't be paused
+        """
+
+        pausable = {}
+        for (modname, mod) in self.__modules:
+            if mod._latency_test or not mod.WorkloadWillRun():
+                continue
+            pausable[modname] = mod.SetCollecting(modname in active)
+        return pausable
+
+
+    def Segments(self):
+        """Returns the histogram segments of the latency measurement modules"""
+
+        return {modname: mod.Segments() for (modname, mod) in self.__modules
+                if mod._latency_test and mod.Segments()}
+
+
     def isAlive(self):
         """Returns True if all modules are running"""
 
@@ -5,15 +5,75 @@
 #
 
 import os
+import sys
+import json
 import time
 import threading
+import subprocess
+from datetime import datetime
 import libxml2
 from rteval.Log import Log
 from rteval.rtevalConfig import rtevalCfgSection
-from rteval.modules import RtEvalModules, rtevalModulePrototype
-from rteval.systopology import SysTopology as SysTop
+from rteval.modules import RtEvalModules, rtevalModulePrototype, rtevalRuntimeError
+from rteval.systopology import get_systopology
+from rteval.spawn import SpawnAttrs
+from rteval.cgroup import LoadCgroups
 import rteval.cpulist_utils as cpulist_utils
 
+# load generator script run by WorkerLoad modules
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workers.py')
+SIZE_SUFFIXES = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+# seconds the workers of a load get to exit after SIGTERM, all together,
+# staying below the time RtEvalModules.Stop() waits for a load
+WORKER_STOP_TIMEOUT = 1.5
+
+
+def parse_size(value):
+    """ return the number of bytes in value, which may end in K, M or G """
+    value = str(value).strip().lower().rstrip('b')
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+DURATION_SUFFIXES = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value):
+    """ return the number of seconds in value, which may end in s, m, h or d """
+    value = str(value).strip().lower()
+    if value and value[-1] in DURATION_SUFFIXES:
+        return float(value[:-1]) * DURATION_SUFFIXES[value[-1]]
+    return float(value)
+
+
+def parse_schedule(spec):
+    """ parse a load schedule, a ',' separated list of 'DURATION LOADS'
+    phases.  LOADS is 'idle', 'all' or load names joined by '+'.  The
+    phases repeat until the run ends.
+    :return: list of (phase name, seconds, list of loads or None for all)
+    """
+    phases = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        try:
+            duration, name = item.split()
+            seconds = parse_duration(duration)
+        except ValueError:
+            raise ValueError(f"invalid load phase '{item.strip()}' (expected 'DURATION LOADS')")
+        if seconds <= 0:
+            raise ValueError(f"load phase '{item.strip()}' has no duration")
+        if name == 'all':
+            loads = None
+        elif name == 'idle':
+            loads = []
+        else:
+            loads = name.split('+')
+        phases.append((name, seconds, loads))
+    return phases
+
+
 class LoadThread(rtevalModulePrototype):
     def __init__(self, name, config, logger=None):
 
@@ -43,6 +103,8 @@ class LoadThread(rtevalModulePrototype):
         self.mydir = None
         self.jobs = 0
         self.args = None
+        self._cgroup = None
+        self._timescale = float(config.setdefault('timescale', 1.0))
 
         if not os.path.exists(self.builddir):
             os.makedirs(self.builddir)
@@ -52,6 +114,55 @@ class LoadThread(rtevalModulePrototype):
         return os.open(os.path.join(self.reportdir, "logs", name), os.O_CREAT|os.O_WRONLY)
 
 
+    def set_cgroup(self, cgroup):
+        """ set the LoadCgroup the processes of this load are started in """
+        self._cgroup = cgroup
+
+
+    def _spawn_attrs(self, cpus=None, **kwargs):
+        """ return SpawnAttrs for processes of this load, placing them
+        in the load cgroup unless another cgroup is given
+        """
+        if kwargs.get('cgroup') is None and self._cgroup is not None:
+            kwargs['cgroup'] = self._cgroup.path
+        return SpawnAttrs(cpus=cpus, log=self._log, **kwargs)
+
+
+    def _frozen_time(self, start, end):
+        """ return the seconds between start and end (time.time()) the
+        load was frozen by the load schedule, to leave out of its rates
+        """
+        if self._cgroup is None:
+            return 0.0
+        return self._cgroup.frozen_time(start, end)
+
+
+    def _tool_seconds(self, seconds):
+        """ convert seconds of rteval's clock to the time the load tools
+        report, which runs faster in a simulation """
+        return seconds * self._timescale
+
+
+    def _node_cpus(self):
+        """ return a dict of the cpus this load may use, keyed by node.
+        Nodes without usable cpus are left out.  Without a cpulist
+        isolated cpus are excluded
+        """
+        systop = get_systopology()
+        cpulist = cpulist_utils.expand_cpulist(self.cpulist) if self.cpulist else None
+        cpus = {}
+        for n in systop.getnodes():
+            if cpulist is not None:
+                nodecpus = [c for c in systop.getcpus(n) if c in cpulist]
+            else:
+                nodecpus = systop.default_cpulist(systop.getcpus(n))
+            if not nodecpus:
+                self._log(Log.DEBUG, f"node {n} has no available cpus, removing")
+                continue
+            cpus[n] = nodecpus
+        return cpus
+
+
 class CommandLineLoad(LoadThread):
     def __init__(self, name, config, logger):
         LoadThread.__init__(self, name, config, logger)
@@ -72,6 +183,163 @@ class CommandLineLoad(LoadThread):
         return rep_n
 
 
+class WorkerProcess:
+    """ class managing one process running workers.py """
+    def __init__(self, kind, params, attrs, node, label=None):
+        self.kind = kind
+        self.params = params
+        self.attrs = attrs
+        self.node = node
+        self.label = label or kind
+        self.process = None
+        self.results = []
+        # (start, end) time of the run of every result
+        self.windows = []
+        self.__started = None
+
+    def start(self, sin, serr):
+        """ start (or restart) the worker """
+        args = [sys.executable, WORKER_SCRIPT, self.kind, json.dumps(self.params)]
+        self.process = self.attrs.spawn(args, stdin=sin, stdout=subprocess.PIPE, stderr=serr)
+        self.__started = time.time()
+
+    def running(self):
+        """ return True if the worker is running """
+        return self.process is not None and self.process.poll() is None
+
+    def collect(self):
+        """ read the results of an exited worker, return False if it had none """
+        output = self.process.stdout.read()
+        self.process.stdout.close()
+        try:
+            self.results.append(json.loads(output))
+        except ValueError:
+            return False
+        self.windows.append((self.__started, time.time()))
+        return True
+
+    def terminate(self):
+        """ ask the worker to stop """
+        if self.running():
+            self.process.terminate()
+
+    def finish(self, deadline):
+        """ wait until deadline (time.monotonic()) for the terminated worker
+        to exit, killing it if it doesn't, and collect its results """
+        if self.process is None:
+            return
+        try:
+            self.process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.collect()
+
+
+class WorkerLoad(CommandLineLoad):
+    """ Load running load generators from workers.py as separate processes,
+    pinned by SpawnAttrs.  Subclasses add their workers in _WorkloadSetup()
+    with _add_worker().  The counters each worker prints when stopped are
+    turned into per second rates for every node in the report.
+    """
+    def __init__(self, name, config, logger):
+        CommandLineLoad.__init__(self, name, config, logger)
+        self._workers = []
+        self.__nullfp = None
+        self.__err = None
+
+
+    def _add_worker(self, kind, params, cpus, node, mems=None, label=None):
+        """ add a worker process running on cpus of node, the report sums
+        up workers by node and label (the kind by default) """
+        attrs = self._spawn_attrs(cpus=cpus, mems=mems)
+        self._workers.append(WorkerProcess(kind, params, attrs, node, label))
+        self.jobs = len(self._workers)
+        if self.args is None:
+            self.args = [kind] + [f"{k}={v}" for k, v in params.items()]
+
+
+    def _WorkloadBuild(self):
+        # Nothing to build
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        self.__nullfp = os.open("/dev/null", os.O_RDWR)
+        if self._logging:
+            self.__err = self.open_logfile(f"{self._name}.stderr")
+        else:
+            self.__err = self.__nullfp
+
+
+    def _WorkloadTask(self):
+        for w in self._workers:
+            if w.running():
+                continue
+            if w.process is not None:
+                w.process.wait()
+                if not w.collect():
+                    self._log(Log.WARN, f"{w.kind} worker exited ({w.process.returncode}) without results, restarting")
+            try:
+                w.start(self.__nullfp, self.__err)
+            except OSError as err:
+                raise rtevalRuntimeError(self, f"failed to start {w.kind} worker: {err}")
+
+
+    def WorkloadAlive(self):
+        # dead workers are restarted by _WorkloadTask()
+        return True
+
+
+    def _WorkloadCleanup(self):
+        if self._donotrun:
+            return
+        # a worker may take a moment to notice SIGTERM (the network worker
+        # is waiting in select()), so they are all told at once
+        for w in self._workers:
+            w.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for w in self._workers:
+            w.finish(deadline)
+        if self._logging:
+            os.close(self.__err)
+        os.close(self.__nullfp)
+        self._setFinished()
+
+
+    def MakeReport(self):
+        rep_n = CommandLineLoad.MakeReport(self)
+        if rep_n is None:
+            return None
+
+        # sum the per second rate of every counter per node and label,
+        # the results of restarted workers are added up first
+        nodes = {}
+        for w in self._workers:
+            rates = nodes.setdefault((w.node, w.label), {'workers': 0})
+            rates['workers'] += 1
+            # time frozen by the load schedule doesn't count
+            elapsed = sum(max(r.get('elapsed', 0) - self._frozen_time(*window), 0)
+                          for r, window in zip(w.results, w.windows))
+            if elapsed <= 0:
+                continue
+            totals = {}
+            for res in w.results:
+                for key, value in res.items():
+                    if key != 'elapsed':
+                        totals[key] = totals.get(key, 0) + value
+            for key, value in totals.items():
+                rates[key] = rates.get(key, 0.0) + value / elapsed
+        for (node, label), rates in sorted(nodes.items()):
+            node_n = rep_n.newChild(None, 'throughput', None)
+            node_n.newProp('node', str(node))
+            node_n.newProp('type', label)
+            node_n.newProp('workers', str(rates.pop('workers')))
+            for key, rate in sorted(rates.items()):
+                node_n.newProp(f'{key}_per_sec', f"{rate:.1f}")
+        return rep_n
+
+
 class LoadModules(RtEvalModules):
     """Module container for LoadThread based modules"""
 
@@ -81,6 +349,13 @@ class LoadModules(RtEvalModules):
         self._report_tag = "loads"
         self.__loadavg_accum = 0.0
         self.__loadavg_samples = 0
+        self.__cgroups = None
+        self.__schedule = []
+        self.__phases = []
+        self.__phase_end = None
+        # the loads running in the current phase
+        self.__running = None
+        self.__loadnames = []
         RtEvalModules.__init__(self, config, "modules.loads", logger)
         self.__LoadModules(self._cfg.GetSection(self._module_config))
 
@@ -89,10 +364,12 @@ class LoadModules(RtEvalModules):
         "Loads and imports all the configured modules"
 
         for m in modcfg:
-            # hope to eventually have different kinds but module is only one
-            # for now (jcw)
-            if m[1].lower() == 'module':
+            # 'module' loads are python modules, 'command' loads are
+            # described by their config section and run by the generic module
+            if str(m[1]).lower() == 'module':
                 self._LoadModule(m[0])
+            elif str(m[1]).lower() == 'command':
+                self._LoadModule('generic')
 
 
     def Setup(self, modparams):
@@ -101,14 +378,110 @@ class LoadModules(RtEvalModules):
 
         modcfg = self._cfg.GetSection(self._module_config)
         cpulist = modcfg.cpulist
+        if modcfg.schedule:
+            try:
+                self.__schedule = parse_schedule(str(modcfg.schedule))
+            except ValueError as err:
+                raise RuntimeError(f"load schedule: {err}")
+        if self.__schedule:
+            # phases freeze and thaw the cgroups of the loads
+            try:
+                self.__cgroups = LoadCgroups(self._logger)
+            except OSError as err:
+                raise RuntimeError(f"load schedule needs cgroup v2: {err}")
+        elif str(modcfg.setdefault('cgroup', False)).lower() in ('true', '1', 'yes'):
+            try:
+                self.__cgroups = LoadCgroups(self._logger)
+            except OSError as err:
+                self._logger.log(Log.WARN, f"not running loads in cgroups: {err}")
+
         for m in modcfg:
-            # hope to eventually have different kinds but module is only on
-            # for now (jcw)
-            if m[1].lower() == 'module':
+            if str(m[1]).lower() == 'module':
                 self._cfg.AppendConfig(m[0], modparams)
                 self._cfg.AppendConfig(m[0], {'cpulist': cpulist})
                 modobj = self._InstantiateModule(m[0], self._cfg.GetSection(m[0]))
-                self._RegisterModuleObject(m[0], modobj)
+            elif str(m[1]).lower() == 'command':
+                if not self._cfg.HasSection(m[0]):
+                    raise RuntimeError(f"command load '{m[0]}' has no [{m[0]}] config section")
+                self._cfg.AppendConfig(m[0], modparams)
+                self._cfg.AppendConfig(m[0], {'cpulist': cpulist, 'loadname': m[0]})
+                modobj = self._InstantiateModule('generic', self._cfg.GetSection(m[0]))
+            else:
+                continue
+            if self.__cgroups is not None:
+                self.__SetupCgroup(m[0], modobj)
+            self._RegisterModuleObject(m[0], modobj)
+
+        self.__loadnames = [m[0] for m in modcfg if str(m[1]).lower() in ('module', 'command')]
+        for name, _, loads in self.__schedule:
+            unknown = [l for l in loads or [] if l not in self.__loadnames]
+            if unknown:
+                raise RuntimeError(f"load schedule phase '{name}' uses unknown loads: {', '.join(unknown)}")
+
+
+    def __SetupCgroup(self, name, modobj):
+        """ create the cgroup of a load, limited to the cpus and nodes it uses """
+        nodecpus = modobj._node_cpus()
+        cpus = [c for n in nodecpus for c in nodecpus[n]]
+        cfg = self._cfg.GetSection(name)
+        limits = {}
+        for key in ('memory_max', 'io_max', 'pids_max'):
+            value = getattr(cfg, key)
+            if value:
+                limits[key.replace('_', '.')] = value
+        try:
+            cgroup = self.__cgroups.create(name, cpulist_utils.collapse_cpulist(cpus),
+                                           cpulist_utils.collapse_cpulist(list(nodecpus.keys())),
+                                           limits)
+        except OSError as err:
+            raise RuntimeError(f"failed to create cgroup for load {name}: {err}")
+        self._logger.log(Log.DEBUG, f"load {name} runs in cgroup {cgroup}")
+        modobj.set_cgroup(cgroup)
+
+
+    def PhaseSwitch(self, now):
+        """ start the phase of the load schedule due at now
+        :return: the name of the started phase, None if it didn't change
+        """
+        if not self.__schedule:
+            return None
+        if self.__phase_end is not None and now < self.__phase_end:
+            return None
+
+        if self.__phases:
+            self.__phases[-1]['end'] = now
+        name, seconds, loads = self.__schedule[len(self.__phases) % len(self.__schedule)]
+        # the loads of the new phase are thawed by PhaseStart()
+        self.__running = loads if loads is not None else self.__loadnames
+        self.__cgroups.freeze(self.__running, thaw=False)
+        self.__phases.append({'name': name, 'start': now, 'end': None})
+        # phase boundaries follow the schedule, not the time we woke up
+        self.__phase_end = (self.__phase_end or now) + seconds
+        self._logger.log(Log.INFO, f"starting load phase {len(self.__phases) - 1}: {name}")
+        return name
+
+
+    def PhaseStart(self):
+        """ let the loads of the phase started by PhaseSwitch() run """
+        if self.__running is not None:
+            self.__cgroups.freeze(self.__running)
+
+
+    def NextPhaseSwitch(self):
+        """ return the time the current load phase ends, None without schedule """
+        return self.__phase_end
+
+
+    def Stop(self):
+        if self.__phases:
+            # frozen loads can't handle the signals stopping them
+            self.__phases[-1]['end'] = time.time()
+            self.__cgroups.thaw()
+        RtEvalModules.Stop(self)
+        if self.__cgroups is not None:
+            # read the accounting before left over processes are killed
+            self.__cgroups.collect()
+            self.__cgroups.cleanup()
 
 
     def MakeReport(self):
@@ -119,14 +492,34 @@ class LoadModules(RtEvalModules):
         if cpulist:
             # Convert str to list and remove offline cpus
             cpulist = cpulist_utils.expand_cpulist(cpulist)
-            cpulist = cpulist_utils.online_cpulist(cpulist)
+            cpulist = get_systopology().online_cpulist(cpulist)
         else:
-            cpulist = SysTop().default_cpus()
+            cpulist = get_systopology().default_cpus()
         rep_n.newProp("loadcpus", cpulist_utils.collapse_cpulist(cpulist))
+        if self.__cgroups is not None:
+            rep_n.addChild(self.__cgroups.MakeReport())
+        if self.__phases:
+            rep_n.addChild(self.__MakeScheduleReport())
 
         return rep_n
 
 
+    def __MakeScheduleReport(self):
+        sched_n = libxml2.newNode("schedule")
+        sched_n.newProp("spec", str(self._cfg.GetSection(self._module_config).schedule))
+        first = self.__phases[0]['start']
+        for index, phase in enumerate(self.__phases):
+            end = phase['end'] if phase['end'] is not None else phase['start']
+            phase_n = sched_n.newChild(None, "phase", None)
+            phase_n.newProp("index", str(index))
+            phase_n.newProp("name", phase['name'])
+            phase_n.newProp("start", str(datetime.fromtimestamp(phase['start'])))
+            phase_n.newProp("end", str(datetime.fromtimestamp(end)))
+            phase_n.newProp("offset", f"{phase['start'] - first:.3f}")
+            phase_n.newProp("duration", f"{end - phase['start']:.3f}")
+        return sched_n
+
+
     def SaveLoadAvg(self):
         with open("/proc/loadavg") as p:
             load = float(p.readline().split()[0])
@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   generic.py - run an arbitrary command described in the config file as a load
+#
+""" Load module - run a command line configured in rteval.conf as a load
+
+A load of type 'command' in the [loads] section is run by this module,
+using the config section with the same name:
+
+  [loads]
+  myload: command
+
+  [myload]
+  command:   my-load --threads {ncpus} --cpus {cpulist}
+  instances: per-node
+  count:     1
+  restart:   always
+  affinity:  cpus
+  mempolicy: bind
+  policy:    other
+  nice:      0
+  env:       MYLOAD_OPTS="-v"
+  setup:     tar -xzf {srcdir}/myload.tar.gz
+  build:     make -C myload
+
+The command, setup and build values are templates which can use
+{cpulist}, {ncpus}, {node}, {cpu}, {instance}, {builddir}, {srcdir}
+and {reportdir}.  setup and build are run through the shell in the
+load's build directory, the command is run without a shell.
+
+Each instance is bound to its cpus (affinity: cpus) and, with a
+mempolicy other than default, to the memory of their nodes.  policy,
+priority, nice and cgroup set the scheduling and cgroup placement of
+the instances.
+"""
+
+import os
+import time
+import shlex
+import signal
+import subprocess
+from rteval.modules import rtevalRuntimeError
+from rteval.modules.loads import CommandLineLoad, WORKER_STOP_TIMEOUT
+from rteval.spawn import SCHED_POLICIES
+from rteval.Log import Log
+import rteval.cpulist_utils as cpulist_utils
+
+INSTANCES = ('single', 'per-node', 'per-cpu')
+RESTART = ('always', 'on-failure', 'never')
+AFFINITY = ('cpus', 'none')
+MEMPOLICY = ('default', 'bind', 'preferred', 'interleave')
+
+
+class LoadInstance:
+    """ class to manage one process of a command load """
+    def __init__(self, args, attrs, env):
+        self.args = args
+        self.attrs = attrs
+        self.env = env
+        self.process = None
+        self.starts = 0
+
+    def start(self, sin, sout, serr):
+        """ start (or restart) the process with its placement attributes """
+        self.process = self.attrs.spawn(self.args, env=self.env,
+                                        stdin=sin, stdout=sout, stderr=serr)
+        self.starts += 1
+
+    def running(self):
+        """ return True if the process is running """
+        return self.process is not None and self.process.poll() is None
+
+    def terminate(self):
+        """ ask the process to stop """
+        if self.running():
+            self.process.send_signal(signal.SIGTERM)
+
+    def finish(self, deadline):
+        """ wait until deadline (time.monotonic()) for the terminated
+        process to exit, killing it if it doesn't """
+        if self.process is None:
+            return
+        try:
+            self.process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class GenericLoad(CommandLineLoad):
+    """ class running a command described by its config section as a load """
+    def __init__(self, config, logger):
+        CommandLineLoad.__init__(self, config.loadname, config, logger)
+        self.__instances = []
+        self.__nullfp = None
+        self.__out = None
+        self.__err = None
+        self.__workdir = os.path.join(self.builddir, self._name)
+
+        if not self._cfg.command:
+            raise rtevalRuntimeError(self, f"no command configured for load {self._name}")
+        self.__mode = self.__option('instances', 'single', INSTANCES)
+        self.__restart = self.__option('restart', 'always', RESTART)
+        self.__affinity = self.__option('affinity', 'cpus', AFFINITY)
+        self.__mempolicy = self.__option('mempolicy', 'default', MEMPOLICY)
+        self.__policy = self.__option('policy', 'other', SCHED_POLICIES)
+        self.__count = int(self._cfg.setdefault('count', 1))
+
+
+    def __option(self, key, default, valid):
+        value = str(self._cfg.setdefault(key, default)).lower()
+        if value not in valid:
+            raise rtevalRuntimeError(self, f"invalid {key} '{value}' for load {self._name} (valid: {', '.join(valid)})")
+        return value
+
+
+    def __format(self, template, cpus, node=None, cpu=None, instance=0):
+        return template.format(cpulist=cpulist_utils.collapse_cpulist(cpus),
+                               ncpus=len(cpus),
+                               node=node if node is not None else "",
+                               cpu=cpu if cpu is not None else "",
+                               instance=instance,
+                               builddir=self.__workdir,
+                               srcdir=self.srcdir,
+                               reportdir=self.reportdir)
+
+
+    def __shell(self, key):
+        """ run the setup or build shell command, if configured """
+        template = getattr(self._cfg, key)
+        if not template:
+            return
+        cmd = self.__format(template, self.__allcpus)
+        self._log(Log.DEBUG, f"{key}: {cmd}")
+        ret = subprocess.call(cmd, shell=True, cwd=self.__workdir,
+                              stdin=self.__nullfp, stdout=self.__out, stderr=self.__err)
+        if ret:
+            raise rtevalRuntimeError(self, f"{key} of load {self._name} failed (ret={ret})")
+
+
+    def _WorkloadSetup(self):
+        if self._donotrun:
+            return
+
+        nodecpus = self._node_cpus()
+        self.__allcpus = sorted([c for cpus in nodecpus.values() for c in cpus])
+        if not self.__allcpus:
+            raise rtevalRuntimeError(self, f"no cpus available for load {self._name}")
+
+        env = dict(os.environ)
+        for var in shlex.split(self._cfg.env or ""):
+            key, _, val = var.partition('=')
+            env[key] = val
+
+        # (cpus, node, cpu) for every placement of the command
+        if self.__mode == 'per-node':
+            slots = [(cpus, node, None) for node, cpus in nodecpus.items()]
+        elif self.__mode == 'per-cpu':
+            slots = [([c], node, c) for node, cpus in nodecpus.items() for c in cpus]
+        else:
+            slots = [(self.__allcpus, None, None)]
+
+        for cpus, node, cpu in slots:
+            try:
+                attrs = self._spawn_attrs(cpus=cpus if self.__affinity == 'cpus' else None,
+                                          mems=list(nodecpus.keys()) if node is None else [node],
+                                          mempolicy=self.__mempolicy,
+                                          policy=self.__policy,
+                                          priority=self._cfg.setdefault('priority', 0),
+                                          nice=self._cfg.nice,
+                                          cgroup=self._cfg.cgroup)
+            except ValueError as err:
+                raise rtevalRuntimeError(self, f"invalid placement for load {self._name}: {err}")
+            for _ in range(self.__count):
+                instance = len(self.__instances)
+                args = shlex.split(self.__format(self._cfg.command, cpus, node, cpu, instance))
+                self.__instances.append(LoadInstance(args, attrs, env))
+
+        self.jobs = len(self.__instances)
+        self.args = self.__instances[0].args
+        if not os.path.isdir(self.__workdir):
+            os.makedirs(self.__workdir)
+        self._log(Log.DEBUG, f"{self.jobs} instances ({self.__mode}, restart {self.__restart}): {self.__instances[0].attrs}")
+
+
+    def _WorkloadBuild(self):
+        if self._donotrun:
+            self._setReady()
+            return
+
+        self.__nullfp = os.open("/dev/null", os.O_RDWR)
+        if self._logging:
+            self.__out = self.open_logfile(f"{self._name}.stdout")
+            self.__err = self.open_logfile(f"{self._name}.stderr")
+        else:
+            self.__out = self.__err = self.__nullfp
+
+        self.__shell('setup')
+        self.__shell('build')
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        pass
+
+
+    def _WorkloadTask(self):
+        for inst in self.__instances:
+            if inst.running():
+                continue
+            if inst.process is not None:
+                ret = inst.process.returncode
+                if self.__restart == 'never' or (self.__restart == 'on-failure' and ret == 0):
+                    continue
+                self._log(Log.DEBUG, f"restarting instance (returned {ret}): {' '.join(inst.args)}")
+            try:
+                inst.start(self.__nullfp, self.__out, self.__err)
+            except OSError as err:
+                raise rtevalRuntimeError(self, f"failed to start load {self._name}: {err}")
+
+
+    def WorkloadAlive(self):
+        if self.__restart != 'never':
+            return True
+        return any(inst.running() for inst in self.__instances)
+
+
+    def _WorkloadCleanup(self):
+        if self._donotrun:
+            return
+
+        # all instances are told at once, a per-cpu load has many of them
+        for inst in self.__instances:
+            inst.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for inst in self.__instances:
+            inst.finish(deadline)
+        restarts = sum(max(inst.starts - 1, 0) for inst in self.__instances)
+        self._log(Log.DEBUG, f"stopped {len(self.__instances)} instances ({restarts} restarts)")
+
+        if self._logging:
+            os.close(self.__out)
+            os.close(self.__err)
+        os.close(self.__nullfp)
+        self._setFinished()
+
+
+
+def ModuleParameters():
+    # All parameters are taken from the config section of each command load
+    return {}
+
+
+
+def create(config, logger):
+    return GenericLoad(config, logger)
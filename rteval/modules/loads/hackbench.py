@@ -11,21 +11,83 @@ import sys
 import os
 import os.path
 import time
-import subprocess
+import re
 import errno
+import subprocess
 from signal import SIGKILL
+import libxml2
+from rteval.modules import rtevalRuntimeError
 from rteval.modules.loads import CommandLineLoad
 from rteval.Log import Log
-from rteval.systopology import SysTopology
 import rteval.cpulist_utils as cpulist_utils
 
 expand_cpulist = cpulist_utils.expand_cpulist
 isolated_cpulist = cpulist_utils.isolated_cpulist
 
+MODES = ('process', 'thread')
+IPC = ('socket', 'pipe')
+
+
+class HackbenchStats:
+    """ class accumulating the completed hackbench runs of one node """
+    TIME_RE = re.compile(r'^Time:\s+([0-9.]+)', re.MULTILINE)
+
+    def __init__(self, node, groups, fds, loops, datasize):
+        self.node = node
+        # every sender passes loops messages to each receiver of its group
+        self.messages = groups * fds * fds * loops
+        self.loops = loops
+        self.datasize = datasize
+        self.runs = 0
+        self.failed = 0
+        self.frozen = 0
+        self.runtime = 0.0
+        self.min_time = None
+        self.max_time = None
+
+    def add(self, output, frozen_time=None):
+        """ parse the output of a finished run, return False if it had no
+        Time: line.  frozen_time(t) returns the seconds the run was frozen
+        by the load schedule in the t seconds it took.  Such runs are left
+        out of the timing, their Time: includes the frozen time """
+        m = self.TIME_RE.search(output)
+        if not m:
+            self.failed += 1
+            return False
+        t = float(m.group(1))
+        if frozen_time and frozen_time(t) > 0:
+            self.frozen += 1
+            return True
+        self.runs += 1
+        self.runtime += t
+        self.min_time = t if self.min_time is None else min(self.min_time, t)
+        self.max_time = t if self.max_time is None else max(self.max_time, t)
+        return True
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('throughput')
+        rep_n.newProp('node', str(self.node))
+        rep_n.newProp('runs', str(self.runs))
+        rep_n.newProp('failed', str(self.failed))
+        rep_n.newProp('frozen', str(self.frozen))
+        rep_n.newProp('time', f"{self.runtime:.3f}")
+        if self.runs and self.runtime > 0:
+            rep_n.newProp('min_time', f"{self.min_time:.3f}")
+            rep_n.newProp('max_time', f"{self.max_time:.3f}")
+            rep_n.newProp('loops_per_sec', f"{self.runs * self.loops / self.runtime:.1f}")
+            msgs = self.runs * self.messages / self.runtime
+            rep_n.newProp('messages_per_sec', f"{msgs:.0f}")
+            rep_n.newProp('bytes_per_sec', f"{msgs * self.datasize:.0f}")
+        return rep_n
+
+
 class Hackbench(CommandLineLoad):
     def __init__(self, config, logger):
         self.__cfg = config
         CommandLineLoad.__init__(self, "hackbench", config, logger)
+        self.__stats = {}
+        # start time of the current run of every node
+        self.__started = {}
 
     def _WorkloadSetup(self):
         if self._donotrun:
@@ -48,51 +110,42 @@ class Hackbench(CommandLineLoad):
                 self._log(Log.WARN, f"Low memory system ({ratio} GB/core)! Not running hackbench")
                 self._donotrun = True
 
-        sysTop = SysTopology()
-        # get the number of nodes
-        self.nodes = sysTop.getnodes()
-
-        # get the cpus for each node
-        self.cpus = {}
-        biggest = 0
-        for n in sysTop.getnodes():
-            self.cpus[n] = sysTop.getcpus(int(n))
-            # if a cpulist was specified, only allow cpus in that list on the node
-            if self.cpulist:
-                self.cpus[n] = [c for c in self.cpus[n] if c in expand_cpulist(self.cpulist)]
-            # if a cpulist was not specified, exclude isolated cpus
-            else:
-                self.cpus[n] = cpulist_utils.nonisolated_cpulist(self.cpus[n])
-
-            # track largest number of cpus used on a node
-            node_biggest = len(self.cpus[n])
-            if node_biggest > biggest:
-                biggest = node_biggest
+        # get the cpus for each node, leaving out nodes without usable cpus
+        self.cpus = self._node_cpus()
+        self.nodes = list(self.cpus.keys())
 
-        # remove nodes with no cpus available for running
-        for node, cpus in list(self.cpus.items()):
-            if not cpus:
-                self.nodes.remove(node)
-                self._log(Log.DEBUG, f"node {node} has no available cpus, removing")
+        # track largest number of cpus used on a node
+        biggest = max([len(c) for c in self.cpus.values()] + [0])
 
-        # setup jobs based on the number of cores available per node
-        self.jobs = biggest * 3
+        # setup jobs (hackbench groups) based on the number of cores available per node
+        jobspercore = int(self._cfg.setdefault('jobspercore', ModuleParameters()['jobspercore']['default']))
+        self.jobs = biggest * jobspercore
 
-        # figure out if we can use numactl or have to use taskset
-        self.__usenumactl = False
-        self.__multinodes = False
         if len(self.nodes) > 1:
-            self.__multinodes = True
             self._log(Log.INFO, f"running with multiple nodes ({len(self.nodes)})")
-            if os.path.exists('/usr/bin/numactl') and not self.cpulist:
-                self.__usenumactl = True
-                self._log(Log.INFO, "using numactl for thread affinity")
 
-        self.args = ['hackbench', '-P',
+        # bind each hackbench instance to the usable cpus of its node
+        self.__attrs = {n: self._spawn_attrs(cpus=self.cpus[n]) for n in self.nodes}
+
+        mode = str(self._cfg.setdefault('mode', 'process')).lower()
+        ipc = str(self._cfg.setdefault('ipc', 'socket')).lower()
+        if mode not in MODES or ipc not in IPC:
+            raise rtevalRuntimeError(self, f"invalid mode '{mode}' or ipc '{ipc}' "
+                                     f"(valid: {'|'.join(MODES)}, {'|'.join(IPC)})")
+        loops = int(self._cfg.setdefault('loops', 1000))
+        datasize = int(self._cfg.setdefault('datasize', 1000))
+        fds = int(self._cfg.setdefault('fds', 20))
+
+        self.args = ['hackbench', '-P' if mode == 'process' else '-T',
                      '-g', str(self.jobs),
-                     '-l', str(self._cfg.setdefault('loops', '1000')),
-                     '-s', str(self._cfg.setdefault('datasize', '1000'))
+                     '-f', str(fds),
+                     '-l', str(loops),
+                     '-s', str(datasize)
                      ]
+        if ipc == 'pipe':
+            self.args.append('-p')
+
+        self.__stats = {n: HackbenchStats(n, self.jobs, fds, loops, datasize) for n in self.nodes}
 
     def _WorkloadBuild(self):
         # Nothing to build, so we're basically ready
@@ -114,25 +167,32 @@ class Hackbench(CommandLineLoad):
         self.started = False
 
     def __starton(self, node):
-        if self.__multinodes or self.cpulist:
-            if self.__usenumactl:
-                args = ['numactl', '--cpunodebind', str(node)] + self.args
-            else:
-                cpulist = ",".join([str(n) for n in self.cpus[node]])
-                args = ['taskset', '-c', cpulist] + self.args
-        else:
-            args = self.args
-
-        self._log(Log.DEBUG, f"starting on node {node}: args = {args}")
-        p = subprocess.Popen(args,
-                             stdin=self.__nullfp,
-                             stdout=self.__out,
-                             stderr=self.__err)
+        attrs = self.__attrs[node]
+        self._log(Log.DEBUG, f"starting on node {node} ({attrs}): args = {self.args}")
+        # the output of a run is a few lines, read when it has exited
+        p = attrs.spawn(self.args,
+                        stdin=self.__nullfp,
+                        stdout=subprocess.PIPE,
+                        stderr=self.__err)
         if not p:
             self._log(Log.DEBUG, f"hackbench failed to start on node {node}")
             raise RuntimeError(f"hackbench failed to start on node {node}")
+        self.__started[node] = time.time()
         return p
 
+    def __finished(self, node):
+        """ account the output of the finished run on node """
+        p = self.tasks[node]
+        output = p.stdout.read()
+        p.stdout.close()
+        if self._logging:
+            os.write(self.__out, output)
+        # the run took the time it reports from when it was started
+        start = self.__started[node]
+        if not self.__stats[node].add(output.decode(errors='replace'),
+                                      lambda t: self._frozen_time(start, start + t / self._timescale)):
+            self._log(Log.DEBUG, f"hackbench on node {node} returned {p.returncode} without timing")
+
     def _WorkloadTask(self):
         if self.shouldStop():
             return
@@ -148,6 +208,7 @@ class Hackbench(CommandLineLoad):
             try:
                 if self.tasks[n].poll() is not None:
                     self.tasks[n].wait()
+                    self.__finished(n)
                     self.tasks[n] = self.__starton(n)
             except OSError as e:
                 if e.errno != errno.ENOMEM:
@@ -173,8 +234,13 @@ class Hackbench(CommandLineLoad):
                 self.tasks[node].send_signal(SIGKILL)
                 if self.tasks[node].poll() is None:
                     time.sleep(2)
-            self.tasks[node].wait()
-            del self.tasks[node]
+                self.tasks[node].wait()
+                # a killed run has no timing, don't account it
+                self.tasks[node].stdout.close()
+            elif node in self.tasks:
+                self.tasks[node].wait()
+                self.__finished(node)
+            self.tasks.pop(node, None)
 
         os.close(self.__nullfp)
         if self._logging:
@@ -186,11 +252,35 @@ class Hackbench(CommandLineLoad):
         del self.__nullfp
 
 
+    def MakeReport(self):
+        rep_n = CommandLineLoad.MakeReport(self)
+        if rep_n is None:
+            return None
+        for n in self.nodes:
+            rep_n.addChild(self.__stats[n].MakeReport())
+        return rep_n
+
+
 
 def ModuleParameters():
-    return {"jobspercore": {"descr": "Number of working threads per CPU core",
-                            "default": 5,
+    return {"jobspercore": {"descr": "Number of hackbench groups per CPU core",
+                            "default": 3,
                             "metavar": "NUM"},
+            "mode": {"descr": "Run the hackbench groups as processes or threads",
+                     "default": "process",
+                     "metavar": "process|thread"},
+            "ipc": {"descr": "Pass the messages through sockets or pipes",
+                    "default": "socket",
+                    "metavar": "socket|pipe"},
+            "loops": {"descr": "Number of messages each sender passes per run",
+                      "default": 1000,
+                      "metavar": "NUM"},
+            "datasize": {"descr": "Message size in bytes",
+                         "default": 1000,
+                         "metavar": "BYTES"},
+            "fds": {"descr": "Number of sender/receiver pairs in a group",
+                    "default": 20,
+                    "metavar": "NUM"},
             "runlowmem": {"descr": "Run hackbench on machines where low memory is detected",
                             "default": False,
                             "metavar": "True|False"}
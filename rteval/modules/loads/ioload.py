@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   ioload.py - block I/O on scratch files as an rteval load
+#
+""" Load module - read and write scratch files with O_DIRECT and fsync
+to exercise block layer interrupts and writeback on the load cpus """
+
+import os
+from rteval.modules import rtevalRuntimeError
+from rteval.modules.loads import WorkerLoad, parse_size
+from rteval.modules.loads.workers import fill_file
+from rteval.Log import Log
+
+PATTERNS = ('seq', 'rand')
+
+
+class Ioload(WorkerLoad):
+    """ class running one I/O worker per node, with a pool of threads
+    per load cpu, on a scratch file of its own """
+    def __init__(self, config, logger):
+        WorkerLoad.__init__(self, "ioload", config, logger)
+        self.__files = []
+
+
+    def _WorkloadSetup(self):
+        if self._donotrun:
+            return
+
+        pattern = str(self._cfg.setdefault('pattern', 'rand')).lower()
+        if pattern not in PATTERNS:
+            raise rtevalRuntimeError(self, f"invalid pattern '{pattern}' (valid: {', '.join(PATTERNS)})")
+        readpct = int(self._cfg.setdefault('readpct', 50))
+        if not 0 <= readpct <= 100:
+            raise rtevalRuntimeError(self, f"readpct must be 0-100, not {readpct}")
+        direct = str(self._cfg.setdefault('direct', 'true')).lower() in ('true', 'yes', '1')
+        blocksize = parse_size(self._cfg.setdefault('blocksize', '4K'))
+        if direct and blocksize % 4096:
+            raise rtevalRuntimeError(self, f"blocksize {blocksize} is not a multiple of 4K, needed for O_DIRECT")
+        filesize = parse_size(self._cfg.setdefault('filesize', '256M'))
+        filesize -= filesize % blocksize
+        if filesize < blocksize:
+            raise rtevalRuntimeError(self, f"filesize must hold at least one {blocksize} byte block")
+
+        scratch = self._cfg.dir or self.builddir
+        if not os.path.isdir(scratch):
+            os.makedirs(scratch)
+        threads = int(self._cfg.setdefault('threads', 2))
+
+        for node, cpus in self._node_cpus().items():
+            path = os.path.join(scratch, f"ioload-node{node}.dat")
+            self.__files.append(path)
+            self._add_worker('io', {'file': path,
+                                    'filesize': filesize,
+                                    'blocksize': blocksize,
+                                    'pattern': pattern,
+                                    'readpct': readpct,
+                                    'direct': int(direct),
+                                    'fsync': int(self._cfg.setdefault('fsync', 0)),
+                                    'threads': threads * len(cpus)},
+                             cpus, node, mems=[node])
+        self._log(Log.DEBUG, f"{self.jobs} workers doing {pattern} {blocksize} byte I/O, "
+                  f"{readpct}% reads, on {filesize} byte files in {scratch}")
+
+
+    def _WorkloadBuild(self):
+        # write the scratch files before measuring starts
+        for path in self.__files:
+            self._log(Log.DEBUG, f"creating {path}")
+            fill_file(path, self._workers[0].params['filesize'])
+        self._setReady()
+
+
+    def _WorkloadCleanup(self):
+        WorkerLoad._WorkloadCleanup(self)
+        for path in self.__files:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+
+def ModuleParameters():
+    return {"dir": {"descr": "Directory for the scratch files (default: the build directory)",
+                    "default": "",
+                    "metavar": "DIR"},
+            "filesize": {"descr": "Size of the scratch file of each node",
+                         "default": "256M",
+                         "metavar": "SIZE"},
+            "blocksize": {"descr": "Size of each read and write",
+                          "default": "4K",
+                          "metavar": "SIZE"},
+            "pattern": {"descr": "Sequential or random offsets",
+                        "default": "rand",
+                        "metavar": "seq|rand"},
+            "readpct": {"descr": "Percentage of reads, the rest are writes",
+                        "default": 50,
+                        "metavar": "PERCENT"},
+            "direct": {"descr": "Bypass the page cache with O_DIRECT",
+                       "default": "true",
+                       "metavar": "true|false"},
+            "fsync": {"descr": "fdatasync after every N writes of a thread (0: never)",
+                      "default": 0,
+                      "metavar": "N"},
+            "threads": {"descr": "I/O threads per load CPU",
+                        "default": 2,
+                        "metavar": "NUM"},
+            }
+
+
+
+def create(config, logger):
+    return Ioload(config, logger)
@@ -14,58 +14,44 @@ import subprocess
 from rteval.modules import rtevalRuntimeError
 from rteval.modules.loads import CommandLineLoad
 from rteval.Log import Log
-from rteval.systopology import SysTopology
+from rteval.systopology import get_systopology
 import rteval.cpulist_utils as cpulist_utils
 
 expand_cpulist = cpulist_utils.expand_cpulist
-compress_cpulist = cpulist_utils.compress_cpulist
-nonisolated_cpulist = cpulist_utils.nonisolated_cpulist
 
 DEFAULT_KERNEL_PREFIX = "linux-6.10.5"
 
 class KBuildJob:
     '''Class to manage a build job bound to a particular node'''
 
-    def __init__(self, node, kdir, logger=None, cpulist=None):
+    def __init__(self, node, kdir, attrs, logger=None):
         self.kdir = kdir
         self.jobid = None
         self.node = node
         self.logger = logger
-        self.binder = None
         self.builddir = os.path.dirname(kdir)
         self.objdir = f"{self.builddir}/node{int(node)}"
 
         if not os.path.isdir(self.objdir):
             os.mkdir(self.objdir)
 
-        # Exclude isolated CPUs if cpulist not set
-        cpus_available = len(nonisolated_cpulist(self.node.cpus))
-
-        if os.path.exists('/usr/bin/numactl') and not cpulist:
-            # Use numactl
-            self.binder = f'numactl --cpunodebind {int(self.node)}'
-            self.jobs = self.calc_jobs_per_cpu() * cpus_available
-        elif cpulist:
-            # Use taskset
-            self.jobs = self.calc_jobs_per_cpu() * len(cpulist)
-            self.binder = f'taskset -c {compress_cpulist(cpulist)}'
-        else:
-            # Without numactl calculate number of jobs from the node
-            self.jobs = self.calc_jobs_per_cpu() * cpus_available
+        # make and everything it forks is placed by the SpawnAttrs of the node
+        self.attrs = attrs
+        self.jobs = self.calc_jobs_per_cpu() * len(self.attrs.cpus)
 
-        self.runcmd = f"make O={self.objdir} -C {self.kdir} -j{self.jobs}"
-        self.cleancmd = f"make O={self.objdir} -C {self.kdir} clean allmodconfig"
-        self.cleancmd += f"&& pushd {self.objdir} && {self.kdir}/scripts/config -d CONFIG_MODULE_SIG_SHA1 -e CONFIG_MODULE_SIG_SHA512 && popd && make O={self.objdir} -C {self.kdir} olddefconfig"
-        if self.binder:
-            self.runcmd = self.binder + " " + self.runcmd
-            self.cleancmd = self.binder + " " + self.cleancmd
+        make = ['make', f'O={self.objdir}', '-C', self.kdir]
+        self.runcmd = make + [f'-j{self.jobs}']
+        self.cleancmds = [make + ['clean', 'allmodconfig'],
+                          [f'{self.kdir}/scripts/config', '--file', f'{self.objdir}/.config',
+                           '-d', 'CONFIG_MODULE_SIG_SHA1', '-e', 'CONFIG_MODULE_SIG_SHA512'],
+                          make + ['olddefconfig']]
 
-        self.log(Log.DEBUG, f"node {int(node)}: jobs == {self.jobs}")
-        self.log(Log.DEBUG, f"cleancmd = {self.cleancmd}")
-        self.log(Log.DEBUG, f"node{int(node)} kcompile command: {self.runcmd}")
+        self.log(Log.DEBUG, f"node {int(node)}: jobs == {self.jobs} ({self.attrs})")
+        self.log(Log.DEBUG, f"cleancmd = {' && '.join(' '.join(c) for c in self.cleancmds)}")
+        self.log(Log.DEBUG, f"node{int(node)} kcompile command: {self}")
 
     def __str__(self):
-        return self.runcmd
+        return " ".join(self.runcmd)
 
     def log(self, logtype, msg):
         """ starting logging for the kcompile module """
@@ -90,14 +76,18 @@ class KBuildJob:
     def clean(self, sin=None, sout=None, serr=None):
         """ Runs command to clean any previous builds and configure kernel """
         self.log(Log.DEBUG, f"cleaning objdir {self.objdir}")
-        subprocess.call(self.cleancmd, shell=True,
-                        stdin=sin, stdout=sout, stderr=serr)
+        for cmd in self.cleancmds:
+            ret = self.attrs.spawn(cmd, stdin=sin, stdout=sout, stderr=serr).wait()
+            if ret:
+                self.log(Log.DEBUG, f"{' '.join(cmd)} failed (ret={ret})")
+                return ret
+        return 0
 
     def run(self, sin=None, sout=None, serr=None):
-        """ Use Popen to launch a kcompile job """
+        """ Launch a kcompile job bound to the cpus of the node """
         self.log(Log.INFO, f"starting workload on node {int(self.node)}")
-        self.log(Log.DEBUG, f"running on node {int(self.node)}: {self.runcmd}")
-        self.jobid = subprocess.Popen(self.runcmd, shell=True,
+        self.log(Log.DEBUG, f"running on node {int(self.node)}: {self}")
+        self.jobid = self.attrs.spawn(self.runcmd,
                                       stdin=sin, stdout=sout, stderr=serr)
 
     def isrunning(self):
@@ -118,7 +108,7 @@ class Kcompile(CommandLineLoad):
     def __init__(self, config, logger):
         self.buildjobs = {}
         self.config = config
-        self.topology = SysTopology()
+        self.topology = None
         self.cpulist = config.cpulist
         CommandLineLoad.__init__(self, "kcompile", config, logger)
         self.logger = logger
@@ -215,31 +205,20 @@ class Kcompile(CommandLineLoad):
             raise rtevalRuntimeError(self, "Can't find kernel directory!")
         self.mydir = os.path.join(self.builddir, kdir)
         self._log(Log.DEBUG, f"mydir = {self.mydir}")
+        self.topology = get_systopology()
         self._log(Log.DEBUG, f"systopology: {self.topology}")
         self.jobs = len(self.topology)
         self.args = []
 
-        # get the cpus for each node
-        self.cpus = {}
-        self.nodes = self.topology.getnodes()
-        for n in self.nodes:
-            self.cpus[n] = self.topology.getcpus(n)
-            self.cpus[n].sort()
-
-            # if a cpulist was specified, only allow cpus in that list on the node
-            if self.cpulist:
-                self.cpus[n] = [c for c in self.cpus[n] if c in expand_cpulist(self.cpulist)]
-
-        # remove nodes with no cpus available for running
-        for node, cpus in self.cpus.items():
-            if not cpus:
-                self.nodes.remove(node)
-                self._log(Log.DEBUG, f"node {node} has no available cpus, removing")
+        # get the cpus for each node, leaving out nodes without usable cpus
+        self.cpus = self._node_cpus()
+        self.nodes = list(self.cpus.keys())
 
         for n in self.nodes:
             self._log(Log.DEBUG, f"Configuring build job for node {int(n)}")
-            self.buildjobs[n] = KBuildJob(self.topology[n], self.mydir, \
-                self.logger, self.cpus[n] if self.cpulist else None)
+            self.buildjobs[n] = KBuildJob(self.topology[n], self.mydir,
+                                          self._spawn_attrs(cpus=self.cpus[n]),
+                                          self.logger)
             self.args.append(str(self.buildjobs[n])+";")
 
 
@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   memload.py - memory bandwidth and page fault load
+#
+""" Load module - copy memory of the local or another NUMA node and churn
+mappings to load memory controllers and cause page faults, THP compaction
+and TLB shootdowns on the load cpus """
+
+from rteval.modules import rtevalRuntimeError
+from rteval.modules.loads import WorkerLoad, parse_size
+from rteval.systopology import get_systopology
+from rteval.Log import Log
+
+MODES = ('local', 'remote', 'churn')
+
+
+class Memload(WorkerLoad):
+    """ class running a copy worker per load cpu and mode, the memory of
+    'local' workers is on their own node and of 'remote' workers on the
+    next node.  'churn' runs one worker per node with a thread per cpu.
+    """
+    def __init__(self, config, logger):
+        WorkerLoad.__init__(self, "memload", config, logger)
+
+
+    def _WorkloadSetup(self):
+        if self._donotrun:
+            return
+
+        modes = [m.strip().lower() for m in str(self._cfg.setdefault('modes', 'local')).split(',') if m.strip()]
+        for mode in modes:
+            if mode not in MODES:
+                raise rtevalRuntimeError(self, f"invalid mode '{mode}' (valid: {', '.join(MODES)})")
+        size = parse_size(self._cfg.setdefault('size', '64M'))
+        thp = str(self._cfg.setdefault('thp', 'true')).lower() in ('true', 'yes', '1')
+
+        memnodes = sorted(get_systopology().getnodes())
+        if 'remote' in modes and len(memnodes) < 2:
+            self._log(Log.WARN, "single node system, 'remote' workers use local memory")
+
+        for node, cpus in self._node_cpus().items():
+            remote = memnodes[(memnodes.index(node) + 1) % len(memnodes)]
+            for mode in modes:
+                if mode == 'churn':
+                    self._add_worker('churn', {'size': size, 'thp': int(thp), 'threads': len(cpus)},
+                                     cpus, node, mems=[node], label=mode)
+                    continue
+                memnode = node if mode == 'local' else remote
+                for cpu in cpus:
+                    self._add_worker('mem', {'size': size, 'memnode': memnode},
+                                     [cpu], node, mems=[memnode], label=mode)
+        self._log(Log.DEBUG, f"{self.jobs} workers ({', '.join(modes)}) using {size} byte buffers")
+
+
+
+def ModuleParameters():
+    return {"modes": {"descr": "Comma separated workers to run: local and remote "
+                               "node copies, churn of mappings",
+                      "default": "local",
+                      "metavar": "local,remote,churn"},
+            "size": {"descr": "Size of each copy buffer and churned mapping",
+                     "default": "64M",
+                     "metavar": "SIZE"},
+            "thp": {"descr": "Ask for transparent huge pages for churned mappings",
+                    "default": "true",
+                    "metavar": "true|false"},
+            }
+
+
+
+def create(config, logger):
+    return Memload(config, logger)
@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   netload.py - loopback network traffic as an rteval load
+#
+""" Load module - pass TCP or UDP messages over loopback to create
+softirq (NET_RX/NET_TX) pressure on the load cpus """
+
+from rteval.modules import rtevalRuntimeError
+from rteval.modules.loads import WorkerLoad
+from rteval.Log import Log
+
+PROTOCOLS = ('tcp', 'udp')
+
+
+class Netload(WorkerLoad):
+    """ class running one loopback traffic worker per load cpu """
+    def __init__(self, config, logger):
+        WorkerLoad.__init__(self, "netload", config, logger)
+
+
+    def _WorkloadSetup(self):
+        if self._donotrun:
+            return
+
+        protocol = str(self._cfg.setdefault('protocol', 'tcp')).lower()
+        if protocol not in PROTOCOLS:
+            raise rtevalRuntimeError(self, f"invalid protocol '{protocol}' (valid: {', '.join(PROTOCOLS)})")
+        params = {'protocol': protocol,
+                  'msgsize': int(self._cfg.setdefault('msgsize', 1024)),
+                  'connections': int(self._cfg.setdefault('connections', 2))}
+
+        # sender and receiver of a connection share the cpu of their worker
+        for node, cpus in self._node_cpus().items():
+            for cpu in cpus:
+                self._add_worker('net', params, [cpu], node)
+        self._log(Log.DEBUG, f"{self.jobs} workers passing {params['msgsize']} byte {protocol} messages")
+
+
+
+def ModuleParameters():
+    return {"protocol": {"descr": "Loopback protocol to use",
+                         "default": "tcp",
+                         "metavar": "tcp|udp"},
+            "msgsize": {"descr": "Size of each message in bytes",
+                        "default": 1024,
+                        "metavar": "BYTES"},
+            "connections": {"descr": "Number of connections per load CPU",
+                            "default": 2,
+                            "metavar": "NUM"},
+            }
+
+
+
+def create(config, logger):
+    return Netload(config, logger)
@@ -2,36 +2,115 @@
 """ Module containing class Stressng to manage stress-ng as an rteval load """
 import os
 import os.path
+import shlex
 import time
-import subprocess
 import signal
+import subprocess
+import libxml2
 from rteval.modules.loads import CommandLineLoad
 from rteval.Log import Log
-from rteval.systopology import SysTopology
 import rteval.cpulist_utils as cpulist_utils
 
 expand_cpulist = cpulist_utils.expand_cpulist
 
+# instance count of stressors passed on to stress-ng as configured
+AS_GIVEN = object()
+
+
+def parse_stressors(spec):
+    """ parse a ';' separated list of stressor specs, each being
+    'name[:instances] [extra stress-ng arguments]'.
+    Without an instance count one instance per cpu of the node is run.
+    :return: list of (name, instances or None, list of extra arguments)
+    """
+    stressors = []
+    for item in spec.split(';'):
+        words = shlex.split(item)
+        if not words:
+            continue
+        name, _, count = words[0].lstrip('-').partition(':')
+        stressors.append((name, int(count) if count else None, words[1:]))
+    return stressors
+
+
+def option_stressor(option, arg):
+    """ return the stressor spec of the single stressor option/arg form,
+    which is passed on as configured without adding an instance count
+    """
+    return (str(option), AS_GIVEN, [str(arg)] if arg is not None else [])
+
+
+def stressor_args(spec, ncpus):
+    """ return the stress-ng arguments running the stressors of spec on a
+    node with ncpus usable cpus, and the list of (name, instances) run,
+    instances being None when left to stress-ng
+    """
+    args = []
+    stressors = []
+    for name, count, extra in spec:
+        if count is AS_GIVEN:
+            args += [f'--{name}'] + extra
+            stressors.append((name, None))
+            continue
+        count = str(count if count is not None else ncpus)
+        args += [f'--{name}', count] + extra
+        stressors.append((name, count))
+    return args, stressors
+
+
+def parse_metrics(text):
+    """ return the entries of the metrics list in stress-ng --yaml output
+    as a list of dicts, without needing a yaml parser
+    """
+    metrics = []
+    inside = False
+    for line in text.splitlines():
+        if not line.strip() or line.strip() == '---':
+            continue
+        if not line.startswith(' '):
+            inside = line.startswith('metrics:')
+            continue
+        if not inside:
+            continue
+        entry = line.strip()
+        if entry.startswith('- '):
+            metrics.append({})
+            entry = entry[2:]
+        if not metrics:
+            continue
+        key, _, value = entry.partition(':')
+        metrics[-1][key.strip()] = value.strip()
+    return metrics
+
+
 class Stressng(CommandLineLoad):
     " This class creates a load module that runs stress-ng "
     def __init__(self, config, logger):
         CommandLineLoad.__init__(self, "stressng", config, logger)
         self.logger = logger
         self.started = False
-        self.process = None
+        self.processes = {}
         self.cfg = config
         self.__in = None
         self.__out = None
         self.__err = None
         self.__nullfp = None
+        self.__nodeargs = {}
+        self.__attrs = {}
+        self.__stressors = {}
+        self.__metrics = {}
+        self.__started = None
+        self.__stopped = None
         self.args = None
-        " Only run this module if the user specifies an option "
+
+        # stressors is a list of specs, option/arg is the single stressor
+        # form, passed on as given
+        self.__spec = parse_stressors(self.cfg.stressors or "")
         if self.cfg.option is not None:
-            self._donotrun = False
-        else:
-            self._donotrun = True
-        # When this module runs, other load modules should not
-        self.set_exclusive()
+            self.__spec.append(option_stressor(self.cfg.option, self.cfg.arg))
+
+        " Only run this module if the user specifies a stressor "
+        self._donotrun = not self.__spec
 
     def _WorkloadSetup(self):
         " Since there is nothing to build, we don't need to do anything here "
@@ -41,6 +120,9 @@ class Stressng(CommandLineLoad):
         " Nothing to build, so we are ready "
         self._setReady()
 
+    def __yamlfile(self, node):
+        return os.path.join(self.builddir, f"stressng-node{node}.yaml")
+
     def _WorkloadPrepare(self):
         " Set-up logging "
         self.__nullfp = os.open("/dev/null", os.O_RDWR)
@@ -51,40 +133,22 @@ class Stressng(CommandLineLoad):
         else:
             self.__out = self.__err = self.__nullfp
 
-        # stress-ng is only run if the user specifies an option
-        self.args = ['stress-ng']
-        self.args.append(f'--{str(self.cfg.option)}')
-        if self.cfg.arg is not None:
-            self.args.append(self.cfg.arg)
-        if self.cfg.timeout is not None:
-            self.args.append('--timeout')
-            self.args.append(self.cfg.timeout)
-
-        systop = SysTopology()
-        # get the number of nodes
-        nodes = systop.getnodes()
-
-        # get the cpus for each node
-        cpus = {}
-        for n in nodes:
-            cpus[n] = systop.getcpus(int(n))
-            # if a cpulist was specified, only allow cpus in that list on the node
-            if self.cpulist:
-                cpus[n] = [c for c in cpus[n] if c in expand_cpulist(self.cpulist)]
-            # if a cpulist was not specified, exclude isolated cpus
-            else:
-                cpus[n] = cpulist_utils.nonisolated_cpulist(cpus[n])
-
-
-        # remove nodes with no cpus available for running
-        for node, cpu in cpus.items():
-            if not cpu:
-                nodes.remove(node)
-                self._log(Log.DEBUG, f"node {node} has no available cpus, removing")
-        if self.cpulist:
-            for node in nodes:
-                cpulist = ",".join([str(n) for n in cpus[node]])
-                self.args.append(f'--taskset {cpulist}')
+        # one stress-ng per node running every stressor, bound to the
+        # usable cpus and the memory of the node
+        cpus = self._node_cpus()
+        for node, nodecpus in cpus.items():
+            stressargs, stressors = stressor_args(self.__spec, len(nodecpus))
+            args = ['stress-ng', '--metrics-brief', '--yaml', self.__yamlfile(node)] + stressargs
+            if self.cfg.timeout is not None:
+                args += ['--timeout', str(self.cfg.timeout)]
+            self.__nodeargs[node] = args
+            self.__stressors[node] = stressors
+            self.__attrs[node] = self._spawn_attrs(cpus=nodecpus, mems=[node])
+            if os.path.exists(self.__yamlfile(node)):
+                os.remove(self.__yamlfile(node))
+
+        self.jobs = len(self.__nodeargs)
+        self.args = self.__nodeargs[min(self.__nodeargs)] if self.__nodeargs else None
 
     def _WorkloadTask(self):
         """ Kick of the workload here """
@@ -92,14 +156,15 @@ class Stressng(CommandLineLoad):
             # Only start the task once
             return
 
-        self._log(Log.DEBUG, f'starting with {" ".join(self.args)}')
         try:
-            self.process = subprocess.Popen(self.args,
-                                            stdout=self.__out,
-                                            stderr=self.__err,
-                                            stdin=self.__in)
+            for node, args in self.__nodeargs.items():
+                self._log(Log.DEBUG, f'starting on node {node} ({self.__attrs[node]}): {" ".join(args)}')
+                self.processes[node] = self.__attrs[node].spawn(args,
+                                                                stdout=self.__out,
+                                                                stderr=self.__err,
+                                                                stdin=self.__in)
             self.started = True
-            self.jobs = 1
+            self.__started = time.time()
             self._log(Log.DEBUG, "running")
         except OSError:
             self._log(Log.DEBUG, "Failed to run")
@@ -109,20 +174,101 @@ class Stressng(CommandLineLoad):
     def WorkloadAlive(self):
         " Return true if stress-ng workload is alive "
         if self.started:
-            return self.process.poll() is None
+            return all(p.poll() is None for p in self.processes.values())
         return False
 
     def _WorkloadCleanup(self):
         " Makesure to kill stress-ng before rteval ends "
         if not self.started:
             return
-        # poll() returns None if the process is still running
-        while self.process.poll() is None:
+        # poll() returns None if the process is still running,
+        # stress-ng writes its metrics when interrupted
+        while any(p.poll() is None for p in self.processes.values()):
             self._log(Log.DEBUG, "Sending SIGINT")
-            self.process.send_signal(signal.SIGINT)
-            time.sleep(2)
+            for p in self.processes.values():
+                if p.poll() is None:
+                    p.send_signal(signal.SIGINT)
+            for p in self.processes.values():
+                try:
+                    p.wait(2)
+                except subprocess.TimeoutExpired:
+                    pass
+        self.__stopped = time.time()
+
+        for node in self.processes:
+            try:
+                with open(self.__yamlfile(node), 'r', encoding='utf-8') as f:
+                    self.__metrics[node] = parse_metrics(f.read())
+            except OSError as err:
+                self._log(Log.WARN, f"no metrics from stress-ng on node {node}: {err}")
         return
 
+    def MakeReport(self):
+        rep_n = CommandLineLoad.MakeReport(self)
+        if rep_n is None:
+            return None
+        # stress-ng's own rate includes the time frozen by the load schedule
+        frozen = self._tool_seconds(self._frozen_time(self.__started, self.__stopped)) if self.__started else 0.0
+        for node, stressors in self.__stressors.items():
+            metrics = {m.get('stressor'): m for m in self.__metrics.get(node, [])}
+            for name, count in stressors:
+                st_n = rep_n.newChild(None, 'stressor', None)
+                st_n.newProp('node', str(node))
+                st_n.newProp('name', name)
+                if count is not None:
+                    st_n.newProp('instances', count)
+                m = metrics.get(name)
+                if m is None:
+                    continue
+                st_n.newProp('bogo_ops', m.get('bogo-ops', ''))
+                st_n.newProp('bogo_ops_per_sec', running_rate(m, frozen))
+                st_n.newProp('wall_time', m.get('wall-clock-time', ''))
+        return rep_n
+
+
+def running_rate(metrics, frozen):
+    """ return the bogo ops per second of the metrics of a stressor,
+    leaving out frozen seconds of its wall clock time """
+    rate = metrics.get('bogo-ops-per-second-real-time', '')
+    if not frozen:
+        return rate
+    try:
+        running = float(metrics['wall-clock-time']) - frozen
+        return f"{float(metrics['bogo-ops']) / running:.2f}" if running > 0 else rate
+    except (KeyError, ValueError):
+        return rate
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/modules/loads/stressng.py """
+    try:
+        spec = parse_stressors("cpu:2 --cpu-method fft; vm --vm-bytes 10%")
+        print(f"stressors: {spec}")
+        assert spec == [('cpu', 2, ['--cpu-method', 'fft']), ('vm', None, ['--vm-bytes', '10%'])]
+        args, stressors = stressor_args(spec, 4)
+        assert args == ['--cpu', '2', '--cpu-method', 'fft', '--vm', '4', '--vm-bytes', '10%']
+        assert stressors == [('cpu', '2'), ('vm', '4')]
+
+        # option/arg is passed on as configured, a flag without arg too
+        for arg, expected in (('8', ['--hdd', '8']), (None, ['--hdd'])):
+            args, stressors = stressor_args([option_stressor('hdd', arg)], 4)
+            print(f"option hdd, arg {arg}: {args}")
+            assert args == expected, f"{args} != {expected}"
+            assert stressors == [('hdd', None)]
+
+        metrics = parse_metrics("---\nsystem-info:\n      run-by: root\n"
+                                "metrics:\n    - stressor: cpu\n      bogo-ops: 1000\n")
+        assert metrics == [{'stressor': 'cpu', 'bogo-ops': '1000'}]
+
+        # frozen time is left out of the rate
+        m = {'bogo-ops': '1000', 'wall-clock-time': '10.0', 'bogo-ops-per-second-real-time': '100.00'}
+        assert running_rate(m, 0.0) == '100.00'
+        assert running_rate(m, 6.0) == '250.00', running_rate(m, 6.0)
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
 
 def create(config, logger):
     """ Create an instance of the Stressng class in stressng module """
@@ -131,6 +277,10 @@ def create(config, logger):
 def ModuleParameters():
     """ Commandline options for Stress-ng """
     return {
+        "stressors": {
+            "descr": "';' separated stressors, each 'name[:instances] [args]'",
+            "metavar": "STRESSORS"
+        },
         "option": {
             "descr": "stressor specific option",
             "metavar": "OPTION"
@@ -144,3 +294,8 @@ def ModuleParameters():
             "metavar" : "T"
         },
         }
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
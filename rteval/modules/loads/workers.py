@@ -0,0 +1,282 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   workers.py - load generators run as separate processes by WorkerLoad modules
+#
+""" Load generator processes for the python based load modules
+
+This file is run as a script, one process per load cpu:
+
+  python3 workers.py KIND PARAMS_JSON
+
+It only uses the standard library so it starts without importing rteval.
+The worker runs until it gets SIGTERM or SIGINT and then prints its
+counters as a JSON object on stdout.  The object always holds 'elapsed'
+(seconds), other keys are counters a rate is calculated from.
+"""
+
+import os
+import sys
+import mmap
+import json
+import time
+import random
+import signal
+import socket
+import selectors
+import threading
+
+_stop = False
+
+
+def _handle_stop(signum, frame):
+    global _stop
+    _stop = True
+
+
+def stopped():
+    """ return True when the worker was asked to stop """
+    return _stop
+
+
+def net_worker(params):
+    """ pass messages over loopback TCP or UDP connections
+    params: protocol (tcp|udp), msgsize (bytes), connections
+    """
+    protocol = params.get('protocol', 'tcp')
+    msgsize = int(params.get('msgsize', 1024))
+    connections = int(params.get('connections', 1))
+    payload = b'r' * msgsize
+
+    sel = selectors.DefaultSelector()
+    socks = []
+    for _ in range(connections):
+        if protocol == 'udp':
+            rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rx.bind(('127.0.0.1', 0))
+            tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            tx.connect(rx.getsockname())
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            tx = socket.create_connection(listener.getsockname())
+            rx, _ = listener.accept()
+            listener.close()
+            tx.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        tx.setblocking(False)
+        rx.setblocking(False)
+        sel.register(tx, selectors.EVENT_WRITE, 'tx')
+        sel.register(rx, selectors.EVENT_READ, 'rx')
+        socks += [tx, rx]
+
+    sent = received = messages = 0
+    start = time.monotonic()
+    while not stopped():
+        for key, _ in sel.select(0.5):
+            try:
+                if key.data == 'tx':
+                    sent += key.fileobj.send(payload)
+                else:
+                    data = key.fileobj.recv(65536)
+                    received += len(data)
+                    if protocol == 'udp':
+                        messages += 1
+            except (BlockingIOError, InterruptedError):
+                pass
+            except ConnectionRefusedError:
+                # UDP receiver queue overflow is reported on the sender
+                pass
+    elapsed = time.monotonic() - start
+
+    for s in socks:
+        s.close()
+    if protocol != 'udp':
+        messages = received // msgsize
+    return {'elapsed': elapsed, 'messages': messages, 'bytes': received}
+
+
+def fill_file(path, size):
+    """ write path up to size bytes unless it already is, so reads hit the
+    device rather than holes.  Return False if stopped before done.
+    """
+    st = os.stat(path) if os.path.exists(path) else None
+    if st is not None and st.st_size >= size and st.st_blocks * 512 >= size:
+        return True
+    with open(path, 'wb') as f:
+        chunk = b'r' * (1024 * 1024)
+        for _ in range(0, size, len(chunk)):
+            if stopped():
+                return False
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def _io_thread(fd, params, index, counters):
+    """ one I/O thread of io_worker """
+    blocksize = int(params['blocksize'])
+    nblocks = max(int(params['filesize']) // blocksize, 1)
+    threads = int(params.get('threads', 1))
+    readpct = int(params.get('readpct', 50))
+    fsync = int(params.get('fsync', 0))
+    sequential = params.get('pattern', 'seq') == 'seq'
+    rnd = random.Random(index)
+
+    # an anonymous mapping is page aligned, as O_DIRECT needs
+    buf = mmap.mmap(-1, blocksize)
+    buf.write(b'r' * blocksize)
+    # sequential threads each walk their own part of the file
+    first = nblocks * index // threads
+    last = max(nblocks * (index + 1) // threads, first + 1)
+    block = first
+    reads = writes = read_bytes = write_bytes = 0
+    while not stopped():
+        if sequential:
+            offset = block * blocksize
+            block = block + 1 if block + 1 < last else first
+        else:
+            offset = rnd.randrange(nblocks) * blocksize
+        if rnd.randrange(100) < readpct:
+            read_bytes += os.preadv(fd, [buf], offset)
+            reads += 1
+        else:
+            write_bytes += os.pwritev(fd, [buf], offset)
+            writes += 1
+            if fsync and writes % fsync == 0:
+                os.fdatasync(fd)
+    buf.close()
+    counters.append((reads, writes, read_bytes, write_bytes))
+
+
+def io_worker(params):
+    """ read and write blocks of a scratch file with a pool of threads
+    params: file, filesize, blocksize, pattern (seq|rand), readpct,
+            direct (0|1), fsync (fdatasync every N writes, 0 = never), threads
+    """
+    path = params['file']
+    filesize = int(params['filesize'])
+
+    if not fill_file(path, filesize):
+        return {'elapsed': 0}
+
+    flags = os.O_RDWR
+    if int(params.get('direct', 0)):
+        flags |= os.O_DIRECT
+    try:
+        fd = os.open(path, flags)
+    except OSError as err:
+        # tmpfs and some other filesystems don't support O_DIRECT
+        print(f"io worker: {path}: {err}, not using O_DIRECT", file=sys.stderr)
+        fd = os.open(path, os.O_RDWR)
+
+    counters = []
+    threads = [threading.Thread(target=_io_thread, args=(fd, params, i, counters))
+               for i in range(int(params.get('threads', 1)))]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    while not stopped() and any(t.is_alive() for t in threads):
+        time.sleep(0.2)
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    os.close(fd)
+
+    reads, writes, read_bytes, write_bytes = [sum(c) for c in zip(*counters)] or [0, 0, 0, 0]
+    return {'elapsed': elapsed, 'read_ops': reads, 'write_ops': writes,
+            'read_bytes': read_bytes, 'write_bytes': write_bytes}
+
+
+def _touch(buf, step=mmap.PAGESIZE):
+    """ write one byte in every page of buf """
+    view = memoryview(buf)
+    view[::step] = b'\1' * len(range(0, len(buf), step))
+    view.release()
+
+
+def mem_worker(params):
+    """ copy between two buffers, stream style, to load the memory bus
+    params: size (bytes per buffer)
+    The buffers are allocated by this process, so they follow its memory
+    policy.  GB counts the bytes read plus the bytes written.
+    """
+    size = int(params.get('size', 64 << 20))
+    src = mmap.mmap(-1, size)
+    dst = mmap.mmap(-1, size)
+    _touch(src)
+    _touch(dst)
+    srcview = memoryview(src)
+    dstview = memoryview(dst)
+
+    copies = 0
+    start = time.monotonic()
+    while not stopped():
+        dstview[:] = srcview
+        copies += 1
+    elapsed = time.monotonic() - start
+
+    srcview.release()
+    dstview.release()
+    src.close()
+    dst.close()
+    return {'elapsed': elapsed, 'copies': copies, 'GB': copies * 2 * size / 1e9}
+
+
+def _churn_thread(size, thp, counters):
+    """ one thread of churn_worker """
+    maps = pages = 0
+    while not stopped():
+        buf = mmap.mmap(-1, size)
+        if thp and hasattr(mmap, 'MADV_HUGEPAGE'):
+            buf.madvise(mmap.MADV_HUGEPAGE)
+        _touch(buf)
+        buf.close()
+        maps += 1
+        pages += size // mmap.PAGESIZE
+    counters.append((maps, pages))
+
+
+def churn_worker(params):
+    """ map, fault in and unmap memory over and over from several threads,
+    causing page faults, page zeroing, THP compaction and TLB shootdowns
+    params: size (bytes per mapping), thp (0|1), threads
+    """
+    size = int(params.get('size', 64 << 20))
+    thp = int(params.get('thp', 1))
+    counters = []
+    threads = [threading.Thread(target=_churn_thread, args=(size, thp, counters))
+               for _ in range(int(params.get('threads', 1)))]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    while not stopped() and any(t.is_alive() for t in threads):
+        time.sleep(0.2)
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    maps, pages = [sum(c) for c in zip(*counters)] or [0, 0]
+    return {'elapsed': elapsed, 'maps': maps, 'pages': pages,
+            'GB': pages * mmap.PAGESIZE / 1e9}
+
+
+WORKERS = {'net': net_worker,
+           'io': io_worker,
+           'mem': mem_worker,
+           'churn': churn_worker}
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in WORKERS:
+        print(f"usage: {argv[0]} {{{'|'.join(WORKERS)}}} PARAMS_JSON", file=sys.stderr)
+        return 2
+    signal.signal(signal.SIGTERM, _handle_stop)
+    signal.signal(signal.SIGINT, _handle_stop)
+    result = WORKERS[argv[1]](json.loads(argv[2]))
+    print(json.dumps(result), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -4,10 +4,15 @@
 #
 
 import libxml2
+from rteval.Log import Log
 from rteval.modules import RtEvalModules, ModuleContainer
 from rteval.systopology import parse_cpulist_from_config
+from rteval.histogram import Histogram
 import rteval.cpulist_utils as cpulist_utils
 
+# the segments of a calibration run with no collector running
+BASELINE = 'baseline'
+
 class MeasurementModules(RtEvalModules):
     """Module container for measurement modules"""
 
@@ -15,6 +20,12 @@ class MeasurementModules(RtEvalModules):
         self._module_type = "measurement"
         self._report_tag = "Measurements"
         RtEvalModules.__init__(self, config, "modules.measurement", logger)
+        self.__calibrate = 0.0
+        self.__plan = []
+        self.__fixed = []
+        self.__steps = 0
+        self.__step = None
+        self.__step_end = None
         self.__LoadModules(self._cfg.GetSection("measurement"))
 
 
@@ -44,17 +55,97 @@ class MeasurementModules(RtEvalModules):
         if cpulist is None:
             # Get default cpulist value
             cpulist = cpulist_utils.collapse_cpulist(parse_cpulist_from_config("", run_on_isolcpus))
+        self.__calibrate = float(modcfg.calibrate or 0)
 
         for (modname, modtype) in modcfg:
             if isinstance(modtype, str) and modtype.lower() == 'module':  # Only 'module' will be supported (ds)
                 self._cfg.AppendConfig(modname, modparams)
                 self._cfg.AppendConfig(modname, {'cpulist':cpulist})
                 self._cfg.AppendConfig(modname, {'run-on-isolcpus':run_on_isolcpus})
+                self._cfg.AppendConfig(modname, {'calibrate':self.__calibrate})
 
                 modobj = self._InstantiateModule(modname, self._cfg.GetSection(modname))
                 self._RegisterModuleObject(modname, modobj)
 
 
+    def Calibrating(self):
+        "Returns True if the run measures the latency the other modules add"
+        return self.__calibrate > 0
+
+
+    def CalibrationSwitch(self, now):
+        """ switch to the next calibration step when it is due, each
+        collector runs alone after a baseline step with none running.
+        All collectors are paused, CalibrationStart() resumes the one of
+        the new step
+        :return: the name of the started step, None if it didn't change
+        """
+        if not self.__calibrate:
+            return None
+        if self.__step_end is not None and now < self.__step_end:
+            return None
+
+        # the collector of the last step stops before the histograms rotate
+        pausable = self.SetCollecting([])
+        if self.__steps == 0:
+            # the modules which can't pause run during all steps
+            self.__fixed = sorted(m for m in pausable if not pausable[m])
+            for modname in self.__fixed:
+                self._logger.log(Log.WARN, f"{modname} can't be paused, it runs during all calibration steps")
+            collectors = sorted(m for m in pausable if pausable[m])
+            self.__plan = [name for c in collectors for name in (BASELINE, c)]
+            if not self.__plan:
+                self._logger.log(Log.WARN, "no measurement modules to calibrate")
+                self.__plan = [BASELINE]
+        name = self.__plan[self.__steps % len(self.__plan)]
+        self.__step = name
+        self.__steps += 1
+        self.__step_end = (self.__step_end or now) + self.__calibrate
+        self._logger.log(Log.INFO, f"calibration step {self.__steps}: {name}")
+        return name
+
+
+    def CalibrationStart(self):
+        "Resumes the collector of the step started by CalibrationSwitch()"
+        if self.__step not in (None, BASELINE):
+            self.SetCollecting([self.__step])
+
+
+    def NextCalibrationSwitch(self):
+        "Returns the time the current calibration step ends, None if not calibrating"
+        return self.__step_end
+
+
+    def __MakeCalibrationReport(self):
+        cal_n = libxml2.newNode('calibration')
+        cal_n.newProp('step', str(self.__calibrate))
+        cal_n.newProp('steps', str(self.__steps))
+        if self.__fixed:
+            cal_n.newProp('not_paused', ','.join(self.__fixed))
+        for modname, segments in self.Segments().items():
+            for collector in dict.fromkeys(s.name for s in segments if s.name and s.name != BASELINE):
+                base = Histogram()
+                active = Histogram()
+                # compare every step to the baseline right before it
+                for prev, seg in zip(segments, segments[1:]):
+                    if seg.name == collector and prev.name == BASELINE:
+                        base.merge(prev.system())
+                        active.merge(seg.system())
+                if not base.samples() or not active.samples():
+                    continue
+                n = cal_n.newChild(None, 'collector', None)
+                n.newProp('name', collector)
+                n.newProp('measurement', modname)
+                n.newProp('samples', str(active.samples()))
+                for what, base_val, val in (('p99', base.percentile(99), active.percentile(99)),
+                                            ('max', base.max(), active.max())):
+                    n.newProp(f'baseline_{what}', str(base_val))
+                    n.newProp(what, str(val))
+                    n.newProp(f'delta_{what}', str(val - base_val))
+                n.newProp('unit', 'us')
+        return cal_n
+
+
     def MakeReport(self):
         rep_n = super().MakeReport()
 
@@ -62,5 +153,7 @@ class MeasurementModules(RtEvalModules):
         run_on_isolcpus = self._cfg.GetSection("measurement").run_on_isolcpus
         cpulist = parse_cpulist_from_config(cpulist, run_on_isolcpus)
         rep_n.newProp("measurecpus", cpulist_utils.collapse_cpulist(cpulist))
+        if self.__steps:
+            rep_n.addChild(self.__MakeCalibrationReport())
 
         return rep_n
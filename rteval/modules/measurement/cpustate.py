@@ -0,0 +1,198 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   cpustate.py - rteval measurement module sampling cpuidle residency
+#                 and cpufreq frequency of the measurement cpus
+#
+""" cpustate.py - sample per-cpu idle state residency and frequency """
+
+import time
+import libxml2
+from rteval.Log import Log
+from rteval.modules import rtevalModulePrototype
+from rteval.cpupower import read_idle_stats, read_cpufreq
+from rteval.cpulist_utils import expand_cpulist, collapse_cpulist
+
+
+class CpuStateData:
+    """ class to keep the idle and frequency samples of one cpu """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.first = None
+        self.last = None
+        self.freq_min = None
+        self.freq_max = None
+        self.freq_sum = 0
+        self.freq_samples = 0
+
+    def sample(self):
+        """ read the current idle counters and frequency """
+        self.last = read_idle_stats(self.cpu)
+        if self.first is None:
+            self.first = self.last
+        freq = read_cpufreq(self.cpu)
+        if freq is not None:
+            self.freq_min = freq if self.freq_min is None else min(self.freq_min, freq)
+            self.freq_max = freq if self.freq_max is None else max(self.freq_max, freq)
+            self.freq_sum += freq
+            self.freq_samples += 1
+
+    def MakeReport(self, window_us):
+        rep_n = libxml2.newNode('cpu')
+        rep_n.newProp('id', str(self.cpu))
+
+        if self.freq_samples:
+            freq_n = rep_n.newChild(None, 'frequency', None)
+            freq_n.newProp('minimum', str(self.freq_min))
+            freq_n.newProp('maximum', str(self.freq_max))
+            freq_n.newProp('mean', str(int(self.freq_sum / self.freq_samples)))
+            freq_n.newProp('unit', 'kHz')
+
+        if self.first is None:
+            return rep_n
+
+        for state, last in self.last.items():
+            first = self.first.get(state, {'usage': 0, 'time': 0})
+            usage = last['usage'] - first['usage']
+            residency = last['time'] - first['time']
+            st_n = rep_n.newChild(None, 'idlestate', None)
+            st_n.newProp('state', state)
+            st_n.newProp('name', last['name'])
+            st_n.newTextChild(None, 'usage', str(usage))
+            n = st_n.newTextChild(None, 'residency', str(residency))
+            n.newProp('unit', 'us')
+            if window_us > 0:
+                n = st_n.newTextChild(None, 'residency_percent',
+                                      f"{100.0 * residency / window_us:.2f}")
+                n.newProp('unit', '%')
+        return rep_n
+
+
+class CpuState(rtevalModulePrototype):
+    """ measurement module sampling cpuidle and cpufreq state """
+    def __init__(self, config, logger=None):
+        rtevalModulePrototype.__init__(self, 'measurement', 'cpustate', logger)
+        self.__cfg = config
+        default_interval = ModuleParameters()["interval"]["default"]
+        self.__interval = float(self.__cfg.setdefault('interval', default_interval))
+        self.__cpulist = self.__cfg.setdefault('cpulist', "")
+        self.__cpus = expand_cpulist(self.__cpulist)
+        self.__cpus.sort()
+        self.__data = {cpu: CpuStateData(cpu) for cpu in self.__cpus}
+        self.__samples = 0
+        self.__start = None
+        self.__stop = None
+        self.__next_sample = 0.0
+        self.__collecting = True
+
+
+    def __sample(self):
+        for data in self.__data.values():
+            data.sample()
+        self.__samples += 1
+        self.__next_sample = time.time() + self.__interval
+
+
+    def _WorkloadSetup(self):
+        # Nothing to do here
+        pass
+
+
+    def _WorkloadBuild(self):
+        # Nothing to build
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        pass
+
+
+    def _WorkloadTask(self):
+        # Called every few seconds by the module runner, the first call
+        # takes the start sample, afterwards sample on the interval
+        if self.__start is None:
+            self.__start = time.time()
+            self.__sample()
+            self._log(Log.DEBUG, f"sampling cpus {self.__cpulist} every {self.__interval}s")
+        elif self.__collecting and time.time() >= self.__next_sample:
+            self.__sample()
+
+
+    def SetCollecting(self, active):
+        self.__collecting = active
+        return True
+
+
+    def WorkloadAlive(self):
+        # Sampling sysfs can't die
+        return True
+
+
+    def _WorkloadCleanup(self):
+        if self.__start is not None:
+            self.__sample()
+            self.__stop = time.time()
+        self._setFinished()
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('cpustate')
+        rep_n.newProp('cpulist', collapse_cpulist(self.__cpus))
+        rep_n.newProp('samples', str(self.__samples))
+        rep_n.newProp('interval', str(self.__interval))
+
+        window_us = 0
+        if self.__start is not None and self.__stop is not None:
+            window_us = int((self.__stop - self.__start) * 1000000)
+        rep_n.newProp('window', str(window_us))
+
+        for cpu in self.__cpus:
+            rep_n.addChild(self.__data[cpu].MakeReport(window_us))
+        return rep_n
+
+
+
+def ModuleParameters():
+    return {"interval": {"descr": "Seconds between cpuidle/cpufreq samples",
+                         "default": 60,
+                         "metavar": "SECONDS"}
+            }
+
+
+
+def create(params, logger):
+    return CpuState(params, logger)
+
+
+if __name__ == '__main__':
+    from rteval.rtevalConfig import rtevalConfig
+    from rteval.systopology import get_systopology
+
+    l = Log()
+    l.SetLogVerbosity(Log.INFO|Log.DEBUG|Log.ERR|Log.WARN)
+
+    cfg = rtevalConfig({}, logger=l)
+    prms = {}
+    modprms = ModuleParameters()
+    for c, p in list(modprms.items()):
+        prms[c] = p['default']
+    cfg.AppendConfig('cpustate', prms)
+
+    cfg_cs = cfg.GetSection('cpustate')
+    cfg_cs.cpulist = collapse_cpulist(get_systopology().online_cpus())
+    cfg_cs.interval = 1
+
+    runtime = 5
+
+    c = CpuState(cfg_cs, l)
+    c._WorkloadSetup()
+    c._WorkloadPrepare()
+    while runtime > 0:
+        c._WorkloadTask()
+        time.sleep(1)
+        runtime -= 1
+    c._WorkloadCleanup()
+    rep_n = c.MakeReport()
+
+    xml = libxml2.newDoc('1.0')
+    xml.setRootElement(rep_n)
+    xml.saveFormatFileEnc('-', 'UTF-8', 1)
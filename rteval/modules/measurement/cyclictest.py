@@ -12,22 +12,30 @@ import subprocess
 import signal
 import time
 import tempfile
+import threading
 import math
 import libxml2
 from rteval.Log import Log
 from rteval.modules import rtevalModulePrototype
-from rteval.systopology import cpuinfo, SysTopology
+from rteval.systopology import get_systopology
 from rteval.cpulist_utils import expand_cpulist, collapse_cpulist
+from rteval.histogram import Histogram, HistogramSegment, MakeSegmentsReport, log_bucket
+from rteval.histfile import MakeHistogramFile
+
+# seconds a phase change waits for the histogram to be rotated
+ROTATE_TIMEOUT = 5.0
 
 class RunData:
     '''class to keep instance data from a cyclictest run'''
-    def __init__(self, coreid, datatype, priority, logfnc):
+    def __init__(self, coreid, datatype, priority, logfnc, linear=None):
         self.__id = coreid
         self.__type = datatype
         self.__priority = int(priority)
         self.description = ''
-        # histogram of data
+        # histogram of data, log-scaled from linear on
         self.__samples = {}
+        self.__linear = linear
+        self.__overflows = 0
         self.__numsamples = 0
         self.__min = 100000000
         self.__max = 0
@@ -62,12 +70,28 @@ class RunData:
             self.__min = value
 
     def bucket(self, index, value):
-        self.__samples[index] = self.__samples.setdefault(index, 0) + value
         if value:
             self.update_max(index)
             self.update_min(index)
+        index = log_bucket(index, self.__linear)[0]
+        self.__samples[index] = self.__samples.setdefault(index, 0) + value
         self.__numsamples += value
 
+    def overflow(self, count, maximum):
+        """ add samples above the histogram range, of which cyclictest only
+        tells the number and the maximum.  One is put in the bucket of the
+        maximum and the others in the first bucket above the range, so the
+        statistics become lower bounds """
+        if not count:
+            return
+        self.__overflows += count
+        self.bucket(maximum, 1)
+        if count > 1:
+            self.bucket(self.__linear, count - 1)
+
+    def get_overflows(self):
+        return self.__overflows
+
     def reduce(self):
 
         # check to see if we have any samples and if we
@@ -166,6 +190,11 @@ class RunData:
             n = stat_n.newTextChild(None, 'standard_deviation', str(self.__stddev))
             n.newProp('unit', 'us')
 
+            if self.__overflows:
+                n = stat_n.newTextChild(None, 'overflows', str(self.__overflows))
+                n.newProp('above', str(self.__linear))
+                n.newProp('unit', 'us')
+
             hist_n = rep_n.newChild(None, 'histogram', None)
             hist_n.newProp('nbuckets', str(len(self.__samples)))
             keys = list(self.__samples.keys())
@@ -177,6 +206,9 @@ class RunData:
                 b_n = hist_n.newChild(None, 'bucket', None)
                 b_n.newProp('index', str(k))
                 b_n.newProp('value', str(self.__samples[k]))
+                width = log_bucket(k, self.__linear)[1]
+                if width > 1:
+                    b_n.newProp('width', str(width))
 
         return rep_n
 
@@ -198,24 +230,34 @@ class Cyclictest(rtevalModulePrototype):
         self.__cpus = [str(c) for c in expand_cpulist(self.__cpulist)]
         self.__numcores = len(self.__cpus)
 
-        info = cpuinfo()
+        info = get_systopology().cpuinfo()
 
         # create a RunData object for each core we'll measure
         for core in self.__cpus:
             self.__cyclicdata[core] = RunData(core, 'core', self.__priority,
-                                              logfnc=self._log)
-            self.__cyclicdata[core].description = info[core]['model name']
+                                              logfnc=self._log, linear=self.__buckets)
+            self.__cyclicdata[core].description = info.get(core, info['0'])['model name']
 
         # Create a RunData object for the overall system
         self.__cyclicdata['system'] = RunData('system',
                                               'system', self.__priority,
-                                              logfnc=self._log)
+                                              logfnc=self._log, linear=self.__buckets)
         self.__cyclicdata['system'].description = (f"({self.__numcores} cores) ") + info['0']['model name']
 
         self._log(Log.DEBUG, f"system using {self.__numcores} cpu cores")
         self.__started = False
         self.__cyclicoutput = None
         self.__breaktraceval = None
+
+        # histograms are rotated every segment seconds and on load phase changes
+        self.__segment = float(self.__cfg.setdefault('segment', 0) or 0)
+        self.__segments = []
+        self.__segment_start = None
+        self.__phase = None
+        self.__phase_pending = None
+        self.__rotating = False
+        # set when the histogram was rotated for a phase change
+        self.__rotated = threading.Event()
         self.set_latency_test()
 
 
@@ -264,13 +306,63 @@ class Cyclictest(rtevalModulePrototype):
         elif self.__cfg.threshold:
             self.__cmd.append(f"-b{int(self.__cfg.threshold)}")
 
-        # Buffer for cyclictest data written to stdout
+
+    def __start_cyclictest(self, timestamp=None):
+        # Buffer for the cyclictest data of this segment written to stdout
         self.__cyclicoutput = tempfile.SpooledTemporaryFile(mode='w+b')
+        try:
+            self.__cyclicprocess = subprocess.Popen(self.__cmd,
+                                                    stdout=self.__cyclicoutput,
+                                                    stderr=self.__nullfp,
+                                                    stdin=self.__nullfp)
+            self.__started = True
+            self.__segment_start = timestamp or time.time()
+        except OSError:
+            self.__started = False
+
+
+    def __stop_cyclictest(self):
+        while self.__cyclicprocess.poll() is None:
+            self._log(Log.DEBUG, "Sending SIGINT")
+            os.kill(self.__cyclicprocess.pid, signal.SIGINT)
+            try:
+                self.__cyclicprocess.wait(2)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+    def __rotate(self):
+        """ close the current histogram segment and start a new one.
+        cyclictest only prints its histogram when it exits, so it is
+        restarted, samples during the restart are lost """
+        # WorkloadAlive() must not see the old process exited before
+        # the new one runs
+        self.__rotating = True
+        # a phase change moves the segment boundary to the phase start
+        pending = self.__phase_pending
+        timestamp = pending[1] if pending else None
+        try:
+            self.__stop_cyclictest()
+            self.__close_segment(timestamp)
+            if self.__breaktraceval:
+                # cyclictest stopped on its own, let the run end
+                return
+            if pending:
+                self.__phase, self.__phase_pending = pending[0], None
+            self._log(Log.DEBUG, f"starting histogram segment {len(self.__segments)}")
+            self.__start_cyclictest(timestamp)
+        finally:
+            self.__rotating = False
+            if pending:
+                self.__rotated.set()
 
 
     def _WorkloadTask(self):
         if self.__started:
-            # Don't restart cyclictest if it is already runing
+            # Only restart cyclictest when the histogram is rotated
+            if self.__phase_pending is not None or \
+               (self.__segment and time.time() - self.__segment_start >= self.__segment):
+                self.__rotate()
             return
 
         self._log(Log.DEBUG, f'starting with cmd: {" ".join(self.__cmd)}')
@@ -284,18 +376,29 @@ class Cyclictest(rtevalModulePrototype):
                 fp.write("0")
                 fp.flush()
 
-        self.__cyclicoutput.seek(0)
-        try:
-            self.__cyclicprocess = subprocess.Popen(self.__cmd,
-                                                    stdout=self.__cyclicoutput,
-                                                    stderr=self.__nullfp,
-                                                    stdin=self.__nullfp)
-            self.__started = True
-        except OSError:
-            self.__started = False
+        self.__start_cyclictest()
+
+
+    def Segments(self):
+        return self.__segments
+
+
+    def PhaseChange(self, name, timestamp):
+        # the first phase starts before cyclictest does
+        if not self.__started or self.shouldStop():
+            self.__phase = name
+            return
+        # rotate now, the loads of the new phase are started after it
+        self.__rotated.clear()
+        self.__phase_pending = (name, timestamp)
+        self._setWake()
+        if not self.__rotated.wait(ROTATE_TIMEOUT):
+            self._log(Log.WARN, f"histogram not rotated for load phase {name}")
 
 
     def WorkloadAlive(self):
+        if self.__rotating:
+            return True
         if self.__started:
             return self.__cyclicprocess.poll() is None
         return False
@@ -303,7 +406,7 @@ class Cyclictest(rtevalModulePrototype):
 
     def _parse_max_latencies(self, line):
         if not line.startswith('# Max Latencies: '):
-            return
+            return None
 
         line = line.split(':')[1]
         vals = [int(x) for x in line.split()]
@@ -311,17 +414,17 @@ class Cyclictest(rtevalModulePrototype):
         for i, core in enumerate(self.__cpus):
             self.__cyclicdata[core].update_max(vals[i])
             self.__cyclicdata['system'].update_max(vals[i])
+        return vals
 
 
-    def _WorkloadCleanup(self):
-        if not self.__started:
+    def __close_segment(self, timestamp=None):
+        """ parse the output of the stopped cyclictest into the histograms
+        of the whole run and a new segment """
+        if self.__cyclicoutput is None:
             return
-        while self.__cyclicprocess.poll() is None:
-            self._log(Log.DEBUG, "Sending SIGINT")
-            os.kill(self.__cyclicprocess.pid, signal.SIGINT)
-            time.sleep(2)
+        histograms = {core: Histogram(linear=self.__buckets) for core in self.__cpus}
+        maxima = overflows = None
 
-        # now parse the histogram output
         self.__cyclicoutput.seek(0)
         for line in self.__cyclicoutput:
             line = bytes.decode(line)
@@ -330,7 +433,9 @@ class Cyclictest(rtevalModulePrototype):
                 if line.startswith('# Break value: '):
                     self.__breaktraceval = int(line.split(':')[1])
                 elif line.startswith('# Max Latencies: '):
-                    self._parse_max_latencies(line)
+                    maxima = self._parse_max_latencies(line)
+                elif line.startswith('# Histogram Overflows: '):
+                    overflows = [int(x) for x in line.split(':')[1].split()]
                 continue
 
             # Skipping blank lines
@@ -351,6 +456,28 @@ class Cyclictest(rtevalModulePrototype):
             for i, core in enumerate(self.__cpus):
                 self.__cyclicdata[core].bucket(index, int(vals[i+1]))
                 self.__cyclicdata['system'].bucket(index, int(vals[i+1]))
+                histograms[core].add(index, int(vals[i+1]))
+
+        # samples above the histogram range are only counted
+        if overflows and maxima:
+            for i, core in enumerate(self.__cpus):
+                self.__cyclicdata[core].overflow(overflows[i], maxima[i])
+                self.__cyclicdata['system'].overflow(overflows[i], maxima[i])
+                histograms[core].add_overflow(overflows[i], maxima[i])
+
+        self.__cyclicoutput.close()
+        self.__cyclicoutput = None
+        self.__segments.append(HistogramSegment(self.__phase, self.__segment_start,
+                                                timestamp or time.time(), histograms))
+
+
+    def _WorkloadCleanup(self):
+        if not self.__started:
+            return
+        self.__stop_cyclictest()
+
+        # now parse the histogram output
+        self.__close_segment()
 
         # generate statistics for each RunData object
         for n in list(self.__cyclicdata.keys()):
@@ -384,10 +511,9 @@ class Cyclictest(rtevalModulePrototype):
             rep_n.addChild(abrt_n)
 
         # Let the user know if max latency overshot the number of buckets
-        if self.__cyclicdata["system"].get_max() > self.__buckets:
-            self._log(Log.ERR, f'Max latency({self.__cyclicdata["system"].get_max()}us) exceeded histogram range({self.__buckets}us). Skipping statistics')
-            self._log(Log.ERR, "Increase number of buckets to avoid lost samples")
-            return rep_n
+        if self.__cyclicdata["system"].get_overflows():
+            self._log(Log.WARN, f'{self.__cyclicdata["system"].get_overflows()} samples exceeded the histogram range({self.__buckets}us), max latency {self.__cyclicdata["system"].get_max()}us')
+            self._log(Log.WARN, "Statistics including them are lower bounds, increase number of buckets for exact values")
 
         rep_n.addChild(self.__cyclicdata["system"].MakeReport())
         for thr in self.__cpus:
@@ -395,6 +521,15 @@ class Cyclictest(rtevalModulePrototype):
                 continue
             rep_n.addChild(self.__cyclicdata[str(thr)].MakeReport())
 
+        # the statistics above are of the merged segments
+        if len(self.__segments) > 1:
+            rep_n.addChild(MakeSegmentsReport(self.__segments))
+
+        # the histograms in binary, for rteval --merge
+        if self.__cfg.reportdir:
+            rep_n.addChild(MakeHistogramFile(self.__cfg.reportdir, 'cyclictest', self.__segments,
+                                             command_line=' '.join(self.__cmd)))
+
         return rep_n
 
 
@@ -414,7 +549,10 @@ def ModuleParameters():
                            "metavar": "USEC"},
             "threshold": {"descr": "Exit rteval if latency > USEC",
                           "default": None,
-                          "metavar": "USEC"}
+                          "metavar": "USEC"},
+            "segment": {"descr": "Rotate the histogram every SECONDS (0: only at load phase changes)",
+                        "default": 0,
+                        "metavar": "SECONDS"}
             }
 
 
@@ -438,7 +576,7 @@ if __name__ == '__main__':
     cfg.AppendConfig('cyclictest', prms)
 
     cfg_ct = cfg.GetSection('cyclictest')
-    cfg_ct.cpulist = collapse_cpulist(SysTopology().online_cpus())
+    cfg_ct.cpulist = collapse_cpulist(get_systopology().online_cpus())
 
     runtime = 10
 
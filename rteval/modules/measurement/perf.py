@@ -0,0 +1,237 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   perf.py - rteval measurement module running perf record or perf stat
+#
+""" perf.py - diagnostic module sampling call stacks with 'perf record',
+or counting scheduler and cache events with 'perf stat', during a run.
+By default only the load cpus are profiled, so the latency measurement
+threads are not interrupted by sampling """
+
+import os
+import re
+import signal
+import subprocess
+import libxml2
+from rteval.Log import Log
+from rteval.modules import rtevalModulePrototype, rtevalRuntimeError
+from rteval.systopology import get_systopology
+from rteval.cpulist_utils import expand_cpulist, collapse_cpulist
+
+MODES = ('record', 'stat')
+# sampling above this rate would show up in the latencies it is to explain
+MAX_FREQ = 1000
+
+#     12.34%  stress-ng  stress-ng          [.] stress_cpu_fft
+_REPORT = re.compile(r'^\s*([\d.]+)%\s+(\S+)\s+(\S+)\s+\[(.)\]\s+(.*\S)\s*$')
+
+
+class Perf(rtevalModulePrototype):
+    """ measurement module running perf on the load or measurement cpus """
+    def __init__(self, config, logger=None):
+        rtevalModulePrototype.__init__(self, 'measurement', 'perf', logger)
+        self.__cfg = config
+        self.__mode = str(self.__cfg.setdefault('mode', 'record')).lower()
+        self.__freq = int(self.__cfg.setdefault('freq', 99))
+        self.__top = int(self.__cfg.setdefault('top', 20))
+        self.__events = str(self.__cfg.setdefault('events', ModuleParameters()['events']['default']))
+        self.__cpus = self.__cfg.setdefault('cpus', 'load')
+        self.__datadir = os.path.join(self.__cfg.reportdir or os.getcwd(), 'perf')
+        self.__cmd = None
+        self.__process = None
+        self.__failed = False
+        self.__collecting = True
+        # fifo taking enable/disable commands when calibrating
+        self.__control = None
+        if float(self.__cfg.calibrate or 0):
+            self.__control = os.path.join(self.__datadir, 'control')
+        self.__out = None
+        self.__cpulist = ""
+        self.__symbols = []
+        self.__counters = []
+
+
+    def __profiled_cpus(self):
+        """ return the cpulist the 'cpus' parameter selects """
+        measured = expand_cpulist(self.__cfg.cpulist or "")
+        if self.__cpus == 'load':
+            return collapse_cpulist(get_systopology().invert_cpulist(measured))
+        if self.__cpus == 'measurement':
+            return collapse_cpulist(measured)
+        if self.__cpus == 'all':
+            return collapse_cpulist(get_systopology().online_cpus())
+        return collapse_cpulist(expand_cpulist(self.__cpus))
+
+
+    def _WorkloadSetup(self):
+        if self.__mode not in MODES:
+            raise rtevalRuntimeError(self, f"invalid mode '{self.__mode}' (valid: {', '.join(MODES)})")
+        if self.__freq > MAX_FREQ:
+            self._log(Log.WARN, f"limiting the sampling frequency to {MAX_FREQ}Hz")
+            self.__freq = MAX_FREQ
+
+        self.__cpulist = self.__profiled_cpus()
+        if not self.__cpulist:
+            # measurement and loads share all cpus
+            self._log(Log.WARN, "no cpus without measurement threads, not running perf "
+                      "(use --perf-cpus=all to profile anyway)")
+            self.set_donotrun()
+
+
+    def _WorkloadBuild(self):
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        if self._donotrun:
+            return
+        os.makedirs(self.__datadir, exist_ok=True)
+        if self.__mode == 'record':
+            self.__cmd = ['perf', 'record', '-a', '-C', self.__cpulist, '-F', str(self.__freq), '-g',
+                          '-o', os.path.join(self.__datadir, 'perf.data')]
+        else:
+            self.__cmd = ['perf', 'stat', '-a', '-C', self.__cpulist, '-x', ',', '-e', self.__events,
+                          '-o', os.path.join(self.__datadir, 'perf-stat.csv')]
+        if self.__control:
+            if not os.path.exists(self.__control):
+                os.mkfifo(self.__control)
+            self.__cmd.append(f'--control=fifo:{self.__control}')
+        self._log(Log.DEBUG, f"cmd: {' '.join(self.__cmd)}")
+
+
+    def _WorkloadTask(self):
+        if self.__process is not None or self.__failed:
+            return
+        self.__out = open(os.path.join(self.__datadir, f'perf-{self.__mode}.log'), 'wb')
+        # start with the events disabled when paused
+        cmd = self.__cmd + (['--delay=-1'] if not self.__collecting else [])
+        try:
+            self.__process = subprocess.Popen(cmd, stdout=self.__out,
+                                              stderr=subprocess.STDOUT, stdin=None)
+        except OSError as err:
+            self._log(Log.WARN, f"cannot run perf: {err}")
+            self.__failed = True
+            self.__out.close()
+
+
+    def SetCollecting(self, active):
+        if not self.__control:
+            return False
+        self.__collecting = active
+        if self.__process is not None and self.__process.poll() is None:
+            try:
+                fd = os.open(self.__control, os.O_WRONLY | os.O_NONBLOCK)
+                os.write(fd, b'enable\n' if active else b'disable\n')
+                os.close(fd)
+            except OSError as err:
+                self._log(Log.WARN, f"cannot {'enable' if active else 'disable'} perf: {err}")
+        return True
+
+
+    def WorkloadAlive(self):
+        # a diagnostic failing must not end the run
+        if self.__process is not None and self.__process.poll() not in (None, 0) and not self.__failed:
+            self._log(Log.WARN, f"perf exited with {self.__process.returncode}, "
+                      f"see {self.__out.name}")
+            self.__failed = True
+        return True
+
+
+    def __stop(self):
+        while self.__process.poll() is None:
+            self._log(Log.DEBUG, "Sending SIGINT")
+            os.kill(self.__process.pid, signal.SIGINT)
+            try:
+                self.__process.wait(5)
+            except subprocess.TimeoutExpired:
+                pass
+        self.__out.close()
+
+
+    def __summarize_record(self):
+        """ the top symbols of the samples """
+        cmd = ['perf', 'report', '-i', os.path.join(self.__datadir, 'perf.data'),
+               '--stdio', '-q', '-g', 'none', '--sort', 'comm,dso,sym']
+        try:
+            out = subprocess.run(cmd, capture_output=True, text=True, check=False).stdout
+        except OSError as err:
+            self._log(Log.WARN, f"cannot run perf report: {err}")
+            return
+        for line in out.splitlines():
+            match = _REPORT.match(line)
+            if match:
+                self.__symbols.append(match.groups())
+                if len(self.__symbols) == self.__top:
+                    break
+
+
+    def __summarize_stat(self):
+        """ the counters of the csv output """
+        path = os.path.join(self.__datadir, 'perf-stat.csv')
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                # value,unit,event,run time,percentage running,...
+                fields = line.strip().split(',')
+                if line.startswith('#') or len(fields) < 3 or not fields[2]:
+                    continue
+                self.__counters.append((fields[2], fields[0], fields[1]))
+
+
+    def _WorkloadCleanup(self):
+        if self.__process is not None:
+            self.__stop()
+            if self.__mode == 'record':
+                self.__summarize_record()
+            else:
+                self.__summarize_stat()
+        self._setFinished()
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('perf')
+        rep_n.newProp('mode', self.__mode)
+        rep_n.newProp('cpulist', self.__cpulist)
+        if self.__cmd:
+            rep_n.newProp('command_line', ' '.join(self.__cmd))
+        if self.__mode == 'record':
+            rep_n.newProp('freq', str(self.__freq))
+            rep_n.newProp('datafile', 'perf/perf.data')
+        for rank, (percent, comm, dso, ctx, symbol) in enumerate(self.__symbols, 1):
+            n = rep_n.newChild(None, 'symbol', symbol)
+            n.newProp('rank', str(rank))
+            n.newProp('percent', percent)
+            n.newProp('comm', comm)
+            n.newProp('dso', dso)
+            n.newProp('kernel', 'true' if ctx == 'k' else 'false')
+        for event, value, unit in self.__counters:
+            n = rep_n.newChild(None, 'counter', value)
+            n.newProp('event', event)
+            if unit:
+                n.newProp('unit', unit)
+        return rep_n
+
+
+
+def ModuleParameters():
+    return {"mode": {"descr": "Sample call stacks (record) or count events (stat)",
+                     "default": "record",
+                     "metavar": "record|stat"},
+            "cpus": {"descr": "CPUs to profile: load, measurement, all or a cpulist",
+                     "default": "load",
+                     "metavar": "CPUS"},
+            "freq": {"descr": f"Samples per second per cpu for record (at most {MAX_FREQ})",
+                     "default": 99,
+                     "metavar": "HZ"},
+            "top": {"descr": "Number of symbols to add to the report",
+                    "default": 20,
+                    "metavar": "NUM"},
+            "events": {"descr": "Comma separated events to count in stat mode",
+                       "default": "context-switches,cpu-migrations,page-faults,cache-misses",
+                       "metavar": "EVENTS"},
+            }
+
+
+
+def create(params, logger):
+    return Perf(params, logger)
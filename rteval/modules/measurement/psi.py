@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   psi.py - rteval measurement module sampling pressure stall information
+#
+""" psi.py - sample cpu/memory/io pressure of the system and load cgroups """
+
+import os
+import glob
+import time
+import threading
+import libxml2
+from rteval.Log import Log
+from rteval.modules import rtevalModulePrototype
+from rteval.cgroup import read_pressure, cgroup2_mount, PRESSURE_RESOURCES
+
+
+class PressureSeries:
+    """ class keeping the samples of one PSI line (resource and some/full) """
+    def __init__(self, source, resource, kind):
+        self.source = source
+        self.resource = resource
+        self.kind = kind
+        self.first = None
+        self.last = None
+        self.last_time = None
+        # percentage of each sample interval spent stalled
+        self.series = []
+        # (time, total) of every sample, to split the stall time by phase
+        self.totals = []
+        self.avg10 = []
+        self.avg60 = []
+
+    def add(self, now, values):
+        """ add the parsed values of one sample taken at now """
+        total = values.get('total', 0)
+        if self.last is not None and now > self.last_time:
+            stalled = total - self.last
+            self.series.append(100.0 * stalled / ((now - self.last_time) * 1000000))
+        else:
+            self.first = total
+        self.last = total
+        self.last_time = now
+        self.totals.append((now, total))
+        self.avg10.append(values.get('avg10', 0.0))
+        self.avg60.append(values.get('avg60', 0.0))
+
+    def phase_percent(self, start, end):
+        """ return the percentage of time stalled from start to end, using
+        the first samples taken at or after each (phase changes force a
+        sample), None without samples in that window """
+        first = next((s for s in self.totals if s[0] >= start), None)
+        last = next((s for s in self.totals if s[0] >= end), self.totals[-1] if self.totals else None)
+        if first is None or last[0] <= first[0]:
+            return None
+        return 100.0 * (last[1] - first[1]) / ((last[0] - first[0]) * 1000000)
+
+    def MakeReport(self, window_us, phases=None):
+        rep_n = libxml2.newNode('pressure')
+        rep_n.newProp('source', self.source)
+        rep_n.newProp('resource', self.resource)
+        rep_n.newProp('type', self.kind)
+        if self.first is None:
+            return rep_n
+
+        total = self.last - self.first
+        n = rep_n.newTextChild(None, 'total', str(total))
+        n.newProp('unit', 'us')
+        if window_us > 0:
+            n = rep_n.newTextChild(None, 'percent', f"{100.0 * total / window_us:.2f}")
+            n.newProp('unit', '%')
+        for name, values in (('avg10', self.avg10), ('avg60', self.avg60)):
+            n = rep_n.newChild(None, name, None)
+            n.newProp('mean', f"{sum(values) / len(values):.2f}")
+            n.newProp('max', f"{max(values):.2f}")
+        n = rep_n.newTextChild(None, 'series', " ".join(f"{p:.2f}" for p in self.series))
+        n.newProp('unit', '%')
+        for index, (name, start, end) in enumerate(phases or []):
+            percent = self.phase_percent(start, end)
+            if percent is None:
+                continue
+            n = rep_n.newTextChild(None, 'phase', f"{percent:.2f}")
+            n.newProp('index', str(index))
+            n.newProp('name', name)
+            n.newProp('unit', '%')
+        return rep_n
+
+
+class Psi(rtevalModulePrototype):
+    """ measurement module sampling /proc/pressure and cgroup pressure files """
+    def __init__(self, config, logger=None):
+        rtevalModulePrototype.__init__(self, 'measurement', 'psi', logger)
+        self.__cfg = config
+        default_interval = ModuleParameters()["interval"]["default"]
+        self.__interval = float(self.__cfg.setdefault('interval', default_interval))
+        self.__sources = {}
+        self.__series = {}
+        self.__samples = 0
+        self.__start = None
+        self.__stop = None
+        self.__next_sample = 0.0
+        self.__phases = []
+        self.__collecting = True
+        # samples are taken by the module thread and at phase changes
+        self.__lock = threading.Lock()
+
+
+    def __find_sources(self):
+        """ return a dict of source name to PSI file directory and name prefix """
+        sources = {}
+        if os.path.exists('/proc/pressure'):
+            sources['system'] = ('/proc/pressure', '')
+
+        # the cgroups rteval creates for the loads, and any configured ones
+        paths = []
+        mount = cgroup2_mount()
+        if mount:
+            paths += sorted(glob.glob(os.path.join(mount, f'rteval-{os.getpid()}', '*', '')))
+        if self.__cfg.cgroups:
+            paths += [p.strip() for p in str(self.__cfg.cgroups).split(',') if p.strip()]
+        for path in paths:
+            path = path.rstrip('/')
+            if mount and not os.path.isabs(path):
+                path = os.path.join(mount, path)
+            if os.path.exists(os.path.join(path, 'cpu.pressure')):
+                sources[os.path.basename(path)] = (path, '.pressure')
+        return sources
+
+
+    def __sample(self):
+        with self.__lock:
+            self.__sample_locked()
+
+
+    def __sample_locked(self):
+        now = time.time()
+        for source, (path, suffix) in self.__sources.items():
+            for res in PRESSURE_RESOURCES:
+                psi = read_pressure(os.path.join(path, f'{res}{suffix}'))
+                if not psi:
+                    continue
+                for kind, values in psi.items():
+                    key = (source, res, kind)
+                    if key not in self.__series:
+                        self.__series[key] = PressureSeries(source, res, kind)
+                    self.__series[key].add(now, values)
+        self.__samples += 1
+        self.__next_sample = now + self.__interval
+
+
+    def _WorkloadSetup(self):
+        # Nothing to do here
+        pass
+
+
+    def _WorkloadBuild(self):
+        # Nothing to build
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        pass
+
+
+    def _WorkloadTask(self):
+        # Called every few seconds by the module runner, the first call
+        # finds the pressure files and takes the start sample
+        if self.__start is None:
+            self.__sources = self.__find_sources()
+            if not self.__sources:
+                self._log(Log.WARN, "no pressure stall information available")
+            self.__start = time.time()
+            self.__sample()
+            self._log(Log.DEBUG, f"sampling {', '.join(self.__sources)} every {self.__interval}s")
+        elif self.__collecting and time.time() >= self.__next_sample:
+            self.__sample()
+
+
+    def PhaseChange(self, name, timestamp):
+        # sample at the phase boundary right away, reading the pressure
+        # files doesn't block.  Before the first task call the start
+        # sample is the boundary
+        self.__phases.append((name, timestamp))
+        if self.__start is not None:
+            self.__sample()
+
+
+    def SetCollecting(self, active):
+        self.__collecting = active
+        return True
+
+
+    def WorkloadAlive(self):
+        # Reading procfs can't die
+        return True
+
+
+    def _WorkloadCleanup(self):
+        if self.__start is not None:
+            self.__sample()
+            self.__stop = time.time()
+        self._setFinished()
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('psi')
+        rep_n.newProp('samples', str(self.__samples))
+        rep_n.newProp('interval', str(self.__interval))
+
+        window_us = 0
+        if self.__start is not None and self.__stop is not None:
+            window_us = int((self.__stop - self.__start) * 1000000)
+        rep_n.newProp('window', str(window_us))
+
+        # each phase lasts until the next one starts
+        phases = []
+        for index, (name, start) in enumerate(self.__phases):
+            end = self.__phases[index + 1][1] if index + 1 < len(self.__phases) else self.__stop
+            phases.append((name, start, end or start))
+
+        for key in sorted(self.__series):
+            rep_n.addChild(self.__series[key].MakeReport(window_us, phases))
+        return rep_n
+
+
+
+def ModuleParameters():
+    return {"interval": {"descr": "Seconds between pressure samples (at least 2)",
+                         "default": 5,
+                         "metavar": "SECONDS"},
+            "cgroups": {"descr": "Comma separated list of extra cgroups to sample",
+                        "default": "",
+                        "metavar": "CGROUPS"}
+            }
+
+
+
+def create(params, logger):
+    return Psi(params, logger)
+
+
+if __name__ == '__main__':
+    from rteval.rtevalConfig import rtevalConfig
+
+    l = Log()
+    l.SetLogVerbosity(Log.INFO|Log.DEBUG|Log.ERR|Log.WARN)
+
+    cfg = rtevalConfig({}, logger=l)
+    prms = {}
+    modprms = ModuleParameters()
+    for c, p in list(modprms.items()):
+        prms[c] = p['default']
+    cfg.AppendConfig('psi', prms)
+
+    cfg_psi = cfg.GetSection('psi')
+    cfg_psi.interval = 1
+
+    runtime = 5
+
+    c = Psi(cfg_psi, l)
+    c._WorkloadSetup()
+    c._WorkloadPrepare()
+    while runtime > 0:
+        c._WorkloadTask()
+        time.sleep(1)
+        runtime -= 1
+    c._WorkloadCleanup()
+    rep_n = c.MakeReport()
+
+    xml = libxml2.newDoc('1.0')
+    xml.setRootElement(rep_n)
+    xml.saveFormatFileEnc('-', 'UTF-8', 1)
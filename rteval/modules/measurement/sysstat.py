@@ -26,6 +26,7 @@ class sysstat(rtevalModulePrototype):
         self.__bin_sadc = "/usr/lib64/sa/sadc" # FIXME: Do dynamically
         self.__datadir = os.path.join(self.__cfg.reportdir, 'sysstat')
         self.__datafile = os.path.join(self.__datadir, "sysstat.dat")
+        self.__collecting = True
 
 
     def _WorkloadSetup(self):
@@ -54,7 +55,14 @@ class sysstat(rtevalModulePrototype):
             self.__logentry += 1
 
 
+    def SetCollecting(self, active):
+        self.__collecting = active
+        return True
+
+
     def WorkloadAlive(self):
+        if not self.__collecting:
+            return True
         # Here the sysstat tool will be called, which will update
         # the file containing the system information
         cmd = [self.__bin_sadc, "-S", "XALL", "1", "1", self.__datafile]
@@ -8,13 +8,24 @@ import subprocess
 import signal
 import time
 import tempfile
+import threading
 import math
 import sys
 import libxml2
 from rteval.Log import Log
 from rteval.modules import rtevalModulePrototype
-from rteval.systopology import cpuinfo, SysTopology
+from rteval.systopology import get_systopology
 from rteval.cpulist_utils import expand_cpulist, collapse_cpulist
+from rteval.histogram import Histogram, HistogramSegment, MakeSegmentsReport
+from rteval.histfile import MakeHistogramFile
+from rteval.timerlat_analysis import TimerlatAnalysis
+
+# seconds a phase change waits for the histogram to be rotated
+ROTATE_TIMEOUT = 5.0
+
+# the latencies rtla measures: timer IRQ, kernel thread and return to user space
+LATENCY_TYPES = ('irq', 'thread', 'user')
+PERCENTILES = (50, 90, 99, 99.9)
 
 
 class TLRunData:
@@ -26,10 +37,8 @@ class TLRunData:
         self.description = ''
         self._log = logfnc
         self.duration = ''
-        # histogram data, irqs, kernel threads and user threads per core
-        self.irqs = {}
-        self.thrs = {}
-        self.usrs = {}
+        # histogram data of irqs, kernel threads and user threads
+        self.latencies = {t: Histogram() for t in LATENCY_TYPES}
         self.__samples = {}
         self.__numsamples = 0
         self.min = 100000000
@@ -54,9 +63,8 @@ class TLRunData:
         """ Store results index=bucket number, val1=IRQ, val2=thr, val3=usr """
         values = val1 + val2 + val3
         self.__samples[index] = self.__samples.setdefault(index, 0) + values
-        self.irqs[index] = val1
-        self.thrs[index] = val2
-        self.usrs[index] = val3
+        for latency, val in zip(LATENCY_TYPES, (val1, val2, val3)):
+            self.latencies[latency].add(index, val)
         if values:
             self.update_max(index)
             self.update_min(index)
@@ -158,6 +166,8 @@ class TLRunData:
             n = stat_n.newTextChild(None, 'standard_deviation', str(self.__stddev))
             n.newProp('unit', 'us')
 
+            self.__percentiles(stat_n, Histogram(self.__samples))
+
         hist_n = rep_n.newChild(None, 'histogram', None)
         hist_n.newProp('nbuckets', str(len(self.__samples)))
 
@@ -171,8 +181,34 @@ class TLRunData:
             b_n.newProp('index', str(k))
             b_n.newProp('value', str(self.__samples[k]))
 
+        # the statistics above combine these
+        for latency in LATENCY_TYPES:
+            hist = self.latencies[latency]
+            if not hist.samples():
+                continue
+            lat_n = rep_n.newChild(None, 'latency', None)
+            lat_n.newProp('type', latency)
+            stat_n = lat_n.newChild(None, 'statistics', None)
+            stat_n.newTextChild(None, 'samples', str(hist.samples()))
+            for name, value in (('minimum', hist.min()),
+                                ('maximum', hist.max()),
+                                ('mean', f"{hist.mean():.3f}"),
+                                ('standard_deviation', f"{hist.stddev() or 0.0:.3f}")):
+                n = stat_n.newTextChild(None, name, str(value))
+                n.newProp('unit', 'us')
+            self.__percentiles(stat_n, hist)
+            lat_n.addChild(hist.MakeReport())
+
         return rep_n
 
+    @staticmethod
+    def __percentiles(stat_n, hist):
+        """ add the PERCENTILES of hist to a statistics node """
+        for pct in PERCENTILES:
+            n = stat_n.newTextChild(None, 'percentile', str(hist.percentile(pct)))
+            n.newProp('value', f"{pct:g}")
+            n.newProp('unit', 'us')
+
 class Timerlat(rtevalModulePrototype):
     """ measurement modules for rteval """
     def __init__(self, config, logger=None):
@@ -191,10 +227,8 @@ class Timerlat(rtevalModulePrototype):
 
         # Has tracing been triggered
         self.__stoptrace = False
-        # This stores the output from rtla
-        self.__posttrace = ""
-        # Stop Trace Data
-        self.__stdata = {}
+        # The auto-analysis rtla prints after stopping the trace
+        self.__analysis = TimerlatAnalysis()
         # Stop Trace Cpu
         self.stcpu = -1
 
@@ -202,13 +236,23 @@ class Timerlat(rtevalModulePrototype):
         self.__timerlat_err = None
         self.__started = False
 
+        # histograms are rotated every segment seconds and on load phase changes
+        self.__segment = float(self.__cfg.setdefault('segment', 0) or 0)
+        self.__segments = []
+        self.__segment_start = None
+        self.__phase = None
+        self.__phase_pending = None
+        self.__rotating = False
+        # set when the histogram was rotated for a phase change
+        self.__rotated = threading.Event()
+
         # Create a TLRunData object for each core we'll measure
-        info = cpuinfo()
+        info = get_systopology().cpuinfo()
         self.__timerlatdata = {}
         for core in self.__cpus:
             self.__timerlatdata[core] = TLRunData(core, 'core', self.__priority,
                                                 logfnc=self._log)
-            self.__timerlatdata[core].description = info[core]['model name']
+            self.__timerlatdata[core].description = info.get(core, info['0'])['model name']
 
         # Create a TLRunData object for the overall system
         self.__timerlatdata['system'] = TLRunData('system', 'system',
@@ -240,48 +284,100 @@ class Timerlat(rtevalModulePrototype):
                 self.__cmd.append(f'-t={self.__cfg.trace}')
 
         self._log(Log.DEBUG, f'self.__cmd = {self.__cmd}')
-        self.__timerlat_out = tempfile.SpooledTemporaryFile(mode='w+b')
         self.__timerlat_err = tempfile.SpooledTemporaryFile(mode='w+b')
 
-
-    def _WorkloadTask(self):
-        if self.__started:
-            return
-
-        self._log(Log.DEBUG, f'starting with cmd: {" ".join(self.__cmd)}')
-
-        self.__timerlat_out.seek(0)
-        self.__timerlat_err.seek(0)
+    def __start_timerlat(self, timestamp=None):
+        # Buffer for the rtla output of this segment
+        self.__timerlat_out = tempfile.SpooledTemporaryFile(mode='w+b')
         try:
             self.__timerlat_process = subprocess.Popen(self.__cmd,
                                                        stdout=self.__timerlat_out,
                                                        stderr=self.__timerlat_err,
                                                        stdin=None)
             self.__started = True
+            self.__segment_start = timestamp or time.time()
         except OSError:
             self.__started = False
 
+    def __stop_timerlat(self):
+        while self.__timerlat_process.poll() is None:
+            self._log(Log.DEBUG, "Sending SIGINT")
+            os.kill(self.__timerlat_process.pid, signal.SIGINT)
+            try:
+                self.__timerlat_process.wait(2)
+            except subprocess.TimeoutExpired:
+                pass
+
+    def __rotate(self):
+        """ close the current histogram segment and start a new one.
+        rtla only prints its histogram when it exits, so it is restarted,
+        samples during the restart are lost """
+        # WorkloadAlive() must not see the old process exited before
+        # the new one runs
+        self.__rotating = True
+        # a phase change moves the segment boundary to the phase start
+        pending = self.__phase_pending
+        timestamp = pending[1] if pending else None
+        try:
+            self.__stop_timerlat()
+            self.__close_segment(timestamp)
+            if self.__stoptrace:
+                # rtla stopped tracing and exited, let the run end
+                return
+            if pending:
+                self.__phase, self.__phase_pending = pending[0], None
+            self._log(Log.DEBUG, f"starting histogram segment {len(self.__segments)}")
+            self.__start_timerlat(timestamp)
+        finally:
+            self.__rotating = False
+            if pending:
+                self.__rotated.set()
+
+    def _WorkloadTask(self):
+        if self.__started:
+            # Only restart rtla when the histogram is rotated
+            if self.__phase_pending is not None or \
+               (self.__segment and time.time() - self.__segment_start >= self.__segment):
+                self.__rotate()
+            return
+
+        self._log(Log.DEBUG, f'starting with cmd: {" ".join(self.__cmd)}')
+
+        self.__timerlat_err.seek(0)
+        self.__start_timerlat()
+
+    def Segments(self):
+        return self.__segments
+
+    def PhaseChange(self, name, timestamp):
+        # the first phase starts before rtla does
+        if not self.__started or self.shouldStop():
+            self.__phase = name
+            return
+        # rotate now, the loads of the new phase are started after it
+        self.__rotated.clear()
+        self.__phase_pending = (name, timestamp)
+        self._setWake()
+        if not self.__rotated.wait(ROTATE_TIMEOUT):
+            self._log(Log.WARN, f"histogram not rotated for load phase {name}")
+
     def WorkloadAlive(self):
+        if self.__rotating:
+            return True
         if self.__started:
             return self.__timerlat_process.poll() is None
         return False
 
-    def _WorkloadCleanup(self):
-        if not self.__started:
+    def __close_segment(self, timestamp=None):
+        """ parse the output of the stopped rtla into the histograms of
+        the whole run and a new segment """
+        if self.__timerlat_out is None:
             return
-        while self.__timerlat_process.poll() is None:
-            self._log(Log.DEBUG, "Sending SIGINT")
-            os.kill(self.__timerlat_process.pid, signal.SIGINT)
-            time.sleep(2)
-
+        histograms = {core: Histogram() for core in self.__cpus}
 
         # Parse histogram output
         self.__timerlat_out.seek(0)
 
-        blocking_thread_detected = False
-        softirq_interference_detected = False
-        irq_interference_detected = False
-
         for line in self.__timerlat_out:
             line = bytes.decode(line)
 
@@ -289,81 +385,9 @@ class Timerlat(rtevalModulePrototype):
             if not line:
                 continue
 
-            # Parsing if stoptrace has been invoked
+            # Everything after the histogram is the auto-analysis
             if self.__stoptrace:
-                self.__posttrace += line
-                line = line.strip()
-                fields = line.split()
-                if not line:
-                    continue
-                if line.startswith("##") and fields[1] == "CPU":
-                    self.stcpu = int(fields[2])
-                    self._log(Log.DEBUG, f"self.stcpu = {self.stcpu}")
-                    self.__stdata[self.stcpu] = {}
-                    continue
-                if self.stcpu == -1:
-                    self._log(Log.WARN, "Stop trace has been invoked, but a stop cpu has not been identified.")
-                    continue
-                if line.startswith('------------------'):
-                    blocking_thread_detected = False
-                    softirq_interference_detected = False
-                    irq_interference_detected = False
-                    continue
-
-                # work around rtla not printing ':' after all names
-                if line.startswith('Softirq interference'):
-                    name = 'Softirq_interference'
-                elif line.startswith('IRQ interference'):
-                    name = 'IRQ_interference'
-                else:
-                    name = ''.join(line.split(':')[0]).replace(' ', '_')
-                self._log(Log.DEBUG, f"name={name}")
-
-                if name in ['Thread_latency']:
-                    latency = fields[-3]
-                    percent = fields[-1].strip('()%')
-                    self._log(Log.DEBUG, f'{name} = ({latency}, {percent})')
-                    self.__stdata[self.stcpu][name] = (latency, percent)
-                    continue
-                if name in ['Timerlat_IRQ_duration', 'IRQ_handler_delay', 'Blocking_thread', 'IRQ_interference', 'Softirq_interference']:
-                    latency = fields[-4]
-                    percent = fields[-2].strip('(')
-                    if name == 'IRQ_handler_delay' and fields[3] == '(exit':
-                        name = 'IRQ_handler_delay_exit_from_idle'
-                    self._log(Log.DEBUG, f'{name} = ({latency}, {percent})')
-                    self.__stdata[self.stcpu][name] = (latency, percent)
-                    detected = {'Blocking_thread' : (True, False, False),
-                                'IRQ_interference' : (False, True, False),
-                                'Softirq_interference' : (False, False, True) }
-                    if name in ('Blocking_thread', 'IRQ_interference', 'Softirq_interference'):
-                        blocking_thread_detected, irq_interference_detected, softirq_interference_detected = detected.get(name)
-                    continue
-                if name in ["IRQ_latency", "Previous_IRQ_interference"]:
-                    latency = fields[-2]
-                    self._log(Log.DEBUG, f'{name} = {fields[-2]}')
-                    self.__stdata[self.stcpu][name] = fields[-2]
-                    continue
-                if blocking_thread_detected or softirq_interference_detected or irq_interference_detected:
-                    if blocking_thread_detected:
-                        field_name = "blocking_thread"
-                    elif softirq_interference_detected:
-                        field_name = "softirq_interference"
-                    elif irq_interference_detected:
-                        field_name = "irq_interference"
-                    thread = " ".join(fields[0:-2])
-                    latency = fields[-2]
-                    self._log(Log.DEBUG, f"{field_name} += [({thread}, {latency})]")
-                    self.__stdata[self.stcpu].setdefault(field_name, [])
-                    self.__stdata[self.stcpu][field_name] += [(thread, latency)]
-                    continue
-                if name == "Max_timerlat_IRQ_latency_from_idle":
-                    latency = fields[-5]
-                    max_timerlat_cpu = int(fields[-1])
-                    self._log(Log.DEBUG, f'self.__stdata[{max_timerlat_cpu}][{name}] = {latency}')
-                    self.__stdata.setdefault(max_timerlat_cpu, {})
-                    self.__stdata[max_timerlat_cpu][name] = latency
-                else:
-                    self._log(Log.DEBUG, f'line = {line}')
+                self.__analysis.feed(line)
                 continue
 
             if line.startswith('#'):
@@ -392,7 +416,7 @@ class Timerlat(rtevalModulePrototype):
                 continue
             elif line.startswith('rtla timerlat hit stop tracing'):
                 self.__stoptrace = True
-                self.__posttrace += line
+                self.__analysis.feed(line)
                 continue
             else:
                 #print(line)
@@ -421,13 +445,27 @@ class Timerlat(rtevalModulePrototype):
                     self.__timerlatdata['system'].bucket(index, int(vals[i*3+1]),
                                                  int(vals[i*3+2]),
                                                  int(vals[i*3+3]))
+                    histograms[core].add(index, sum(int(v) for v in vals[i*3+1:i*3+4]))
+
+        if self.__analysis.cpu is not None:
+            self.stcpu = self.__analysis.cpu
+        elif self.__stoptrace:
+            self._log(Log.WARN, "Stop trace has been invoked, but a stop cpu has not been identified.")
+        self.__timerlat_out.close()
+        self.__timerlat_out = None
+        self.__segments.append(HistogramSegment(self.__phase, self.__segment_start,
+                                                timestamp or time.time(), histograms))
+
+    def _WorkloadCleanup(self):
+        if not self.__started:
+            return
+        self.__stop_timerlat()
+        self.__close_segment()
 
         # Generate statistics for each RunData object
         for n in list(self.__timerlatdata.keys()):
             self.__timerlatdata[n].reduce()
 
-        self.__timerlat_out.close()
-
         self._setFinished()
         self.__started = False
 
@@ -442,53 +480,18 @@ class Timerlat(rtevalModulePrototype):
             stoptrace_invoked_n.newProp("invoked", "")
         rep_n.addChild(stoptrace_invoked_n)
 
+        # the histograms in binary, for rteval --merge
+        if self.__cfg.reportdir:
+            rep_n.addChild(MakeHistogramFile(self.__cfg.reportdir, 'timerlat', self.__segments,
+                                             command_line=' '.join(self.__cmd)))
+
         if self.stcpu != -1:
-            self._log(Log.DEBUG, f'self.__stdata = {self.__stdata}')
-            for cpu in self.__stdata:
-                # This is  Max timerlat IRQ latency from idle
-                # With no other data from that cpu, so don't create a
-                # stoptrace_report for this
-                if len(self.__stdata[cpu]) == 1:
-                    continue
-                stoptrace_n = libxml2.newNode('stoptrace_report')
-                stoptrace_n.newProp("CPU", str(cpu))
-                for k, v in self.__stdata[cpu].items():
-                    self._log(Log.DEBUG, f"cpu={cpu}, k={k}, v={v}")
-                    if isinstance(v, tuple):
-                        latency = str(v[0])
-                        percent = str(v[1])
-                        cpu_n = stoptrace_n.newTextChild(None, str(k), None)
-                        n = cpu_n.newTextChild(None, "latency", latency)
-                        n.newProp('unit', 'us')
-
-                        n = cpu_n.newTextChild(None, "latency_percent", percent)
-                        n.newProp('unit', '%')
-                    elif isinstance(v, list):
-                        if k in ("blocking_thread", "softirq_interference", "irq_interference"):
-                            for name, latency in v:
-                                cpu_n = stoptrace_n.newTextChild(None, k, None)
-                                n = cpu_n.newTextChild(None, "name", name)
-                                n = cpu_n.newTextChild(None, "latency", latency)
-                                n.newProp('unit', 'us')
-                    else:
-                        if k == "Max_timerlat_IRQ_latency_from_idle":
-                            continue
-                        cpu_n = stoptrace_n.newTextChild(None, str(k), str(v))
-                        cpu_n.newProp('unit', 'us')
-                rep_n.addChild(stoptrace_n)
-
-            self._log(Log.DEBUG, f'timerlat: posttrace = \n{self.__posttrace}')
+            self._log(Log.DEBUG, f'timerlat: posttrace = \n{self.__analysis.text()}')
             self._log(Log.DEBUG, 'timerlat: posttrace END')
-            for cpu in self.__stdata:
-                for k, v in self.__stdata[cpu].items():
-                    if isinstance(v, tuple):
-                        continue
-                    if k == "Max_timerlat_IRQ_latency_from_idle":
-                        max_timerlat_n = libxml2.newNode('max_timerlat_report')
-                        max_timerlat_n.newProp("CPU", str(cpu))
-                        cpu_n = max_timerlat_n.newTextChild(None, k, str(v))
-                        cpu_n.newProp('unit', 'us')
-                        rep_n.addChild(max_timerlat_n)
+            if self.__analysis.unparsed:
+                self._log(Log.DEBUG, f'timerlat: {self.__analysis.unparsed} auto-analysis lines not recognized')
+            for node in self.__analysis.MakeReport():
+                rep_n.addChild(node)
             return rep_n
 
         rep_n.addChild(self.__timerlatdata['system'].MakeReport())
@@ -497,6 +500,10 @@ class Timerlat(rtevalModulePrototype):
                 continue
             rep_n.addChild(self.__timerlatdata[str(thr)].MakeReport())
 
+        # the statistics above are of the merged segments
+        if len(self.__segments) > 1:
+            rep_n.addChild(MakeSegmentsReport(self.__segments))
+
         return rep_n
 
 
@@ -514,6 +521,9 @@ def ModuleParameters():
             "trace":    {"descr": "File to save trace to",
                          "default": None,
                          "metavar": "FILE" },
+            "segment":  {"descr": "Rotate the histogram every SECONDS (0: only at load phase changes)",
+                         "default": 0,
+                         "metavar": "SECONDS" },
            }
 
 def create(params, logger):
@@ -538,7 +548,7 @@ if __name__ == '__main__':
     cfg.AppendConfig('timerlat', prms)
 
     cfg_tl = cfg.GetSection('timerlat')
-    cfg_tl.cpulist = collapse_cpulist(SysTopology().online_cpus())
+    cfg_tl.cpulist = collapse_cpulist(get_systopology().online_cpus())
     cfg_tl.stoptrace=50
 
     RUNTIME = 10
@@ -0,0 +1,276 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   tracering.py - rteval measurement module keeping ftrace snapshots of outliers
+#
+""" tracering.py - record scheduler, irq and timer events of the
+measurement threads in a ftrace instance and save a compressed snapshot
+of it each time their wakeup latency crosses a threshold, without
+stopping the run """
+
+import os
+import gzip
+import time
+import shutil
+import libxml2
+from rteval.Log import Log
+from rteval.modules import rtevalModulePrototype
+from rteval.trace_analysis import TraceAnalysis
+
+INSTANCE = 'rteval'
+# synthetic event fired by the sched_switch to a woken measurement thread
+SYNTHETIC = 'rteval_wakeup_lat'
+
+
+def tracefs_mount():
+    """ return the tracefs mount point, None if there is none """
+    with open('/proc/mounts') as mounts:
+        for l in mounts:
+            field = l.split()
+            if field[2] == 'tracefs':
+                return field[1]
+            if field[2] == 'debugfs' and os.path.isdir(os.path.join(field[1], 'tracing', 'instances')):
+                return os.path.join(field[1], 'tracing')
+    return None
+
+
+class TraceRing(rtevalModulePrototype):
+    """ measurement module arming a ftrace snapshot trigger on the wakeup
+    latency of the measurement threads """
+    def __init__(self, config, logger=None):
+        rtevalModulePrototype.__init__(self, 'measurement', 'tracering', logger)
+        self.__cfg = config
+        self.__events = [e.strip() for e in str(self.__cfg.setdefault('events', ModuleParameters()['events']['default'])).split(',') if e.strip()]
+        self.__threshold = int(self.__cfg.setdefault('threshold', 100))
+        self.__bufsize = int(self.__cfg.setdefault('bufsize', 4096))
+        self.__max = int(self.__cfg.setdefault('snapshots', 5))
+        self.__threads = [c.strip() for c in str(self.__cfg.setdefault('threads', 'cyclictest,timerlat*')).split(',') if c.strip()]
+        self.__tracefs = None
+        self.__instance = None
+        self.__triggers = []
+        self.__armed = False
+        # (file, time, bytes) of the saved snapshots
+        self.__snapshots = []
+        # file -> TraceAnalysis of the outliers in it
+        self.__analyses = {}
+        self.__hits = {}
+        self.__collecting = True
+
+
+    def __write(self, path, value, append=False):
+        """ write value to a tracefs file, return False on errors """
+        try:
+            with open(path, 'a' if append else 'w') as f:
+                f.write(value)
+            return True
+        except OSError as err:
+            self._log(Log.DEBUG, f"writing '{value}' to {path}: {err}")
+            return False
+
+
+    def __filter(self, field):
+        return ' || '.join(f'{field} ~ "{c}"' for c in self.__threads)
+
+
+    def _WorkloadSetup(self):
+        self.__tracefs = self.__cfg.tracefs or tracefs_mount()
+        if not self.__tracefs or not os.path.isdir(os.path.join(self.__tracefs, 'instances')):
+            self._log(Log.WARN, "tracefs not available, not capturing traces")
+            self.__tracefs = None
+
+
+    def _WorkloadBuild(self):
+        self._setReady()
+
+
+    def _WorkloadPrepare(self):
+        if not self.__tracefs:
+            return
+        self.__instance = os.path.join(self.__tracefs, 'instances', INSTANCE)
+        if not os.path.isdir(self.__instance):
+            os.mkdir(self.__instance)
+        self.__write(os.path.join(self.__instance, 'buffer_size_kb'), str(self.__bufsize))
+
+        for event in self.__events:
+            path = os.path.join(self.__instance, 'events', *event.split(':'), 'enable')
+            if not self.__write(path, '1'):
+                self._log(Log.WARN, f"cannot enable trace event {event}")
+
+        # wakeup latency of the measurement threads, as a synthetic event
+        # snapshotting the instance once it is above the threshold
+        self.__write(os.path.join(self.__tracefs, 'synthetic_events'),
+                     f"{SYNTHETIC} u64 lat; pid_t pid\n", append=True)
+        events = os.path.join(self.__instance, 'events')
+        self.__triggers = [
+            (os.path.join(events, 'sched', 'sched_waking', 'trigger'),
+             f"hist:keys=pid:ts0=common_timestamp.usecs if {self.__filter('comm')}"),
+            (os.path.join(events, 'sched', 'sched_switch', 'trigger'),
+             f"hist:keys=next_pid:lat=common_timestamp.usecs-$ts0:"
+             f"onmatch(sched.sched_waking).{SYNTHETIC}($lat,next_pid) if {self.__filter('next_comm')}"),
+            (os.path.join(events, 'synthetic', SYNTHETIC, 'trigger'),
+             f"hist:keys=common_cpu if lat > {self.__threshold}"),
+            ]
+        for path, trigger in self.__triggers:
+            if not self.__write(path, trigger, append=True):
+                self._log(Log.WARN, "cannot set up the wakeup latency trigger, not capturing traces")
+                self.__teardown()
+                return
+        self.__write(os.path.join(events, 'synthetic', SYNTHETIC, 'enable'), '1')
+        self.__arm()
+        if not self.__collecting:
+            self.SetCollecting(False)
+        self._log(Log.DEBUG, f"tracing {', '.join(self.__events)} into {self.__bufsize}KB per cpu, "
+                  f"snapshot above {self.__threshold}us")
+
+
+    def __snapshot_trigger(self):
+        return (os.path.join(self.__instance, 'events', 'synthetic', SYNTHETIC, 'trigger'),
+                f"snapshot:1 if lat > {self.__threshold}")
+
+
+    def __arm(self):
+        path, trigger = self.__snapshot_trigger()
+        self.__armed = self.__write(path, trigger, append=True)
+
+
+    def __disarm(self):
+        path, trigger = self.__snapshot_trigger()
+        self.__write(path, f"!{trigger}", append=True)
+        self.__armed = False
+
+
+    def __fired(self):
+        """ return True when the snapshot trigger used its count """
+        path = self.__snapshot_trigger()[0]
+        with open(path) as f:
+            return any(l.startswith('snapshot:count=0') for l in f)
+
+
+    def __save(self):
+        """ compress the snapshot buffer into the report directory and clear it """
+        tracedir = os.path.join(self.__cfg.reportdir or os.getcwd(), 'traces')
+        if not os.path.isdir(tracedir):
+            os.makedirs(tracedir)
+        fname = os.path.join(tracedir, f"snapshot-{len(self.__snapshots):02d}.txt.gz")
+        snapshot = os.path.join(self.__instance, 'snapshot')
+        with open(snapshot, 'rb') as src, gzip.open(fname, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        self.__snapshots.append((fname, time.time(), os.path.getsize(fname)))
+        self.__write(snapshot, '2')
+        self._log(Log.INFO, f"latency above {self.__threshold}us, trace saved to {fname}")
+
+
+    def _WorkloadTask(self):
+        if not self.__armed or not self.__fired():
+            return
+        self.__disarm()
+        self.__save()
+        # stop capturing when the disk budget is used up
+        if len(self.__snapshots) < self.__max:
+            self.__arm()
+        else:
+            self._log(Log.INFO, f"kept {self.__max} trace snapshots, not capturing more")
+
+
+    def SetCollecting(self, active):
+        # the events still fire, but are not written to the ring buffer
+        self.__collecting = active
+        if self.__instance:
+            self.__write(os.path.join(self.__instance, 'tracing_on'), '1' if active else '0')
+        return True
+
+
+    def WorkloadAlive(self):
+        return True
+
+
+    def __read_hits(self):
+        path = os.path.join(self.__instance, 'events', 'synthetic', SYNTHETIC, 'hist')
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for l in f:
+                # { common_cpu:          3 } hitcount:          5
+                if l.startswith('{') and 'hitcount:' in l:
+                    cpu = l.split('}')[0].split(':')[1].strip()
+                    self.__hits[cpu] = int(l.split('hitcount:')[1].split()[0])
+
+
+    def __teardown(self):
+        if self.__armed:
+            self.__disarm()
+        for path, trigger in reversed(self.__triggers):
+            self.__write(path, f"!{trigger}", append=True)
+        self.__triggers = []
+        events = os.path.join(self.__instance, 'events')
+        self.__write(os.path.join(events, 'synthetic', SYNTHETIC, 'enable'), '0')
+        self.__write(os.path.join(self.__tracefs, 'synthetic_events'), f"!{SYNTHETIC}\n", append=True)
+        try:
+            os.rmdir(self.__instance)
+        except OSError as err:
+            self._log(Log.WARN, f"cannot remove trace instance {self.__instance}: {err}")
+        self.__instance = None
+
+
+    def _WorkloadCleanup(self):
+        if self.__instance:
+            # a snapshot taken after the last task call
+            if self.__armed and self.__fired() and len(self.__snapshots) < self.__max:
+                self.__save()
+            self.__read_hits()
+            self.__teardown()
+        # analyze after the run, to keep it from adding to the latencies
+        for fname, _, _ in self.__snapshots:
+            try:
+                self.__analyses[fname] = TraceAnalysis(fname, self.__threshold)
+            except (OSError, EOFError) as err:
+                self._log(Log.WARN, f"cannot analyze {fname}: {err}")
+        self._setFinished()
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode('tracering')
+        rep_n.newProp('available', 'true' if self.__tracefs else 'false')
+        rep_n.newProp('threshold', str(self.__threshold))
+        rep_n.newProp('events', ','.join(self.__events))
+        rep_n.newProp('bufsize', str(self.__bufsize))
+        rep_n.newProp('max_snapshots', str(self.__max))
+        for cpu in sorted(self.__hits, key=int):
+            n = rep_n.newChild(None, 'hits', str(self.__hits[cpu]))
+            n.newProp('cpu', cpu)
+        for index, (fname, stamp, size) in enumerate(self.__snapshots):
+            n = rep_n.newChild(None, 'snapshot', None)
+            n.newProp('index', str(index))
+            n.newProp('file', os.path.relpath(fname, self.__cfg.reportdir or os.getcwd()))
+            n.newProp('time', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)))
+            n.newProp('bytes', str(size))
+            if fname in self.__analyses:
+                n.addChild(self.__analyses[fname].MakeReport())
+        return rep_n
+
+
+
+def ModuleParameters():
+    return {"events": {"descr": "Comma separated trace events (subsystem or subsystem:event) to record",
+                       "default": "sched:sched_switch,sched:sched_wakeup,irq,timer,osnoise",
+                       "metavar": "EVENTS"},
+            "threshold": {"descr": "Save a snapshot when the wakeup latency of a measurement thread is above USEC",
+                          "default": 100,
+                          "metavar": "USEC"},
+            "bufsize": {"descr": "Size of the trace ring buffer of each cpu in KB",
+                        "default": 4096,
+                        "metavar": "KB"},
+            "snapshots": {"descr": "Maximum number of snapshots to save",
+                          "default": 5,
+                          "metavar": "NUM"},
+            "threads": {"descr": "Comma separated names (globs) of the measurement threads",
+                        "default": "cyclictest,timerlat*",
+                        "metavar": "NAMES"},
+            "tracefs": {"descr": "tracefs mount point (default: found in /proc/mounts)",
+                        "default": "",
+                        "metavar": "DIR"},
+            }
+
+
+
+def create(params, logger):
+    return TraceRing(params, logger)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Module choosing measurement and load cpus from the cache/SMT topology """
+
+from rteval.systopology import get_systopology
+import rteval.cpulist_utils as cpulist_utils
+
+# Placement policies, always applied in this order
+#   llc-one:  measure on only one cpu per last level cache
+#   llc-load: load only the non-measured cpus sharing a LLC with a measured cpu
+#   smt-idle: keep the SMT siblings of measured cpus free of loads
+POLICIES = ('llc-one', 'llc-load', 'smt-idle')
+
+
+def parse_policies(policies):
+    """ return the list of policies in a comma separated string """
+    if not policies:
+        return []
+    result = [p.strip().lower() for p in policies.split(',') if p.strip()]
+    for p in result:
+        if p not in POLICIES:
+            raise ValueError(f"unknown placement policy '{p}' (valid: {', '.join(POLICIES)})")
+    return result
+
+
+def plan_cpus(policies, measurecpus, loadcpus, systop=None):
+    """
+    Apply placement policies to a pair of cpulists
+    :param policies: List of policies or comma separated string
+    :param measurecpus: List of candidate measurement cpus
+    :param loadcpus: List of candidate load cpus
+    :param systop: Topology to plan on, defaults to the shared snapshot
+    :return: Tuple of sorted measurement and load cpu lists
+    """
+    if isinstance(policies, str):
+        policies = parse_policies(policies)
+    if systop is None:
+        systop = get_systopology()
+
+    online = set(systop.online_cpus())
+    measure = sorted(c for c in set(measurecpus) if c in online)
+    load = sorted(c for c in set(loadcpus) if c in online)
+
+    if 'llc-one' in policies:
+        seen = set()
+        chosen = []
+        for cpu in measure:
+            llc = tuple(systop.llc(cpu))
+            if llc in seen:
+                continue
+            seen.add(llc)
+            chosen.append(cpu)
+        # cpus dropped from measurement are free to run loads
+        load = sorted(set(load) | (set(measure) - set(chosen)))
+        measure = chosen
+
+    if 'llc-load' in policies:
+        shared = set()
+        for cpu in measure:
+            shared.update(systop.llc(cpu))
+        load = [c for c in load if c in shared]
+
+    if 'smt-idle' in policies:
+        siblings = set()
+        for cpu in measure:
+            siblings.update(systop.siblings(cpu))
+        load = [c for c in load if c not in siblings]
+
+    load = [c for c in load if c not in measure]
+    return measure, load
+
+
+def plan_cpulists(policies, measurecpus, loadcpus, systop=None):
+    """ plan_cpus() working on cpulist strings """
+    measure, load = plan_cpus(policies,
+                              cpulist_utils.expand_cpulist(measurecpus),
+                              cpulist_utils.expand_cpulist(loadcpus),
+                              systop)
+    return cpulist_utils.collapse_cpulist(measure), cpulist_utils.collapse_cpulist(load)
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/placement.py """
+
+    class FakeTopology:
+        """ 2 LLCs with 4 cores each, 2 SMT threads per core """
+        def online_cpus(self):
+            return list(range(16))
+
+        def siblings(self, cpu):
+            return [cpu & ~8, cpu | 8]
+
+        def llc(self, cpu):
+            base = (cpu & 4)
+            return sorted([base + i for i in range(4)] + [base + 8 + i for i in range(4)])
+
+    try:
+        top = FakeTopology()
+        allcpus = top.online_cpus()
+
+        m, l = plan_cpus('smt-idle', [0, 1], [c for c in allcpus if c > 1], top)
+        print(f"smt-idle: measure={m} load={l}")
+        assert m == [0, 1] and 8 not in l and 9 not in l and 2 in l
+
+        m, l = plan_cpus('llc-one', allcpus, [], top)
+        print(f"llc-one: measure={m} load={l}")
+        assert m == [0, 4] and len(l) == 14
+
+        m, l = plan_cpus('llc-load,smt-idle', [0], allcpus, top)
+        print(f"llc-load,smt-idle: measure={m} load={l}")
+        assert m == [0] and l == [1, 2, 3, 9, 10, 11]
+
+        try:
+            parse_policies('bogus')
+            return 1
+        except ValueError:
+            pass
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
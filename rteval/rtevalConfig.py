@@ -15,7 +15,7 @@ import os
 import sys
 import configparser
 from rteval.Log import Log
-from rteval.systopology import SysTopology
+from rteval.systopology import get_systopology
 
 def get_user_name():
     name = os.getenv('SUDO_USER')
@@ -78,6 +78,7 @@ default_config = {
         'report_interval': '600',
         'logging'    : False,
         'srcdownload': None,
+        'placement'  : None,
         }
     }
 
@@ -175,7 +176,7 @@ class rtevalConfig:
         self.__logger = logger
 
         # get our system topology info
-        self.__systopology = SysTopology()
+        self.__systopology = get_systopology()
         print(f"got system topology: {self.__systopology}")
 
         # Import the default config first
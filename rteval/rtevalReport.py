@@ -12,10 +12,12 @@ from . import xmlout
 
 
 class rtevalReport:
-    def __init__(self, rtev_version, installdir, annotate):
+    def __init__(self, rtev_version, installdir, annotate, simulated=None):
         self.__version = rtev_version
         self.__installdir = installdir
         self.__annotate = annotate
+        # (speedup, simulated duration) of --simulate runs
+        self.__simulated = simulated
         self.__start = datetime.now()
         self.__xmlreport = None
         self.__reportdir = None
@@ -51,6 +53,10 @@ class rtevalReport:
         self.__xmlreport.taggedvalue('time', self.__start.strftime('%H:%M:%S'))
         if self.__annotate:
             self.__xmlreport.taggedvalue('annotate', self.__annotate)
+        if self.__simulated:
+            self.__xmlreport.taggedvalue('simulation', 'stand-in tools',
+                                         {'speedup': f"{self.__simulated[0]:g}",
+                                          'duration': f"{self.__simulated[1]:g}"})
         self.__xmlreport.closeblock()
 
         # Collect and add info about the system
@@ -35,6 +35,13 @@
     <xsl:value-of select="run_info/@minutes"/><xsl:text>m </xsl:text>
     <xsl:value-of select="run_info/@seconds"/><xsl:text>s</xsl:text>
     <xsl:text>&#10;</xsl:text>
+    <xsl:if test="run_info/simulation">
+      <xsl:text>   Simulated:    </xsl:text>
+      <xsl:value-of select="run_info/simulation/@duration"/>
+      <xsl:text>s at </xsl:text>
+      <xsl:value-of select="run_info/simulation/@speedup"/>
+      <xsl:text>x speed with stand-in tools&#10;</xsl:text>
+    </xsl:if>
     <xsl:if test="run_info/annotate">
       <xsl:text>   Remarks:      </xsl:text>
       <xsl:value-of select="run_info/annotate"/>
@@ -171,6 +178,28 @@
       <xsl:text>       Executed loads:&#10;</xsl:text>
       <xsl:apply-templates select="loads/command_line"/>
     </xsl:if>
+    <xsl:if test="loads/cgroups/cgroup">
+      <xsl:text>&#10;</xsl:text>
+      <xsl:text>       Load cgroups:&#10;</xsl:text>
+      <xsl:apply-templates select="loads/cgroups/cgroup"/>
+    </xsl:if>
+    <xsl:if test="loads/schedule/phase">
+      <xsl:text>&#10;</xsl:text>
+      <xsl:text>       Load phases (</xsl:text>
+      <xsl:value-of select="loads/schedule/@spec"/>
+      <xsl:text>):&#10;</xsl:text>
+      <xsl:for-each select="loads/schedule/phase">
+        <xsl:text>         </xsl:text>
+        <xsl:value-of select="@index"/>
+        <xsl:text>: </xsl:text>
+        <xsl:value-of select="@name"/>
+        <xsl:text> at +</xsl:text>
+        <xsl:value-of select="@offset"/>
+        <xsl:text>s for </xsl:text>
+        <xsl:value-of select="@duration"/>
+        <xsl:text>s&#10;</xsl:text>
+      </xsl:for-each>
+    </xsl:if>
     <xsl:text>&#10;</xsl:text>
 
     <xsl:text> Cmdline:        </xsl:text>
@@ -186,6 +215,49 @@
   <!--                              -->
 
 
+  <!--  Formats the accounting of a load cgroup  -->
+  <xsl:template match="cgroup">
+    <xsl:text>         - </xsl:text>
+    <xsl:value-of select="@load"/>
+    <xsl:text>: cpus </xsl:text>
+    <xsl:value-of select="@cpus"/>
+    <xsl:if test="cpu">
+      <xsl:text>, cpu time </xsl:text>
+      <xsl:value-of select="format-number(cpu/@usage div 1000000, '0.0')"/>
+      <xsl:text>s</xsl:text>
+    </xsl:if>
+    <xsl:if test="throttling/@throttled &gt; 0">
+      <xsl:text>, throttled </xsl:text>
+      <xsl:value-of select="throttling/@throttled"/>
+      <xsl:text>/</xsl:text>
+      <xsl:value-of select="throttling/@periods"/>
+      <xsl:text> periods</xsl:text>
+    </xsl:if>
+    <xsl:if test="memory/@peak">
+      <xsl:text>, memory peak </xsl:text>
+      <xsl:value-of select="format-number(memory/@peak div 1048576, '0')"/>
+      <xsl:text>MB</xsl:text>
+    </xsl:if>
+    <xsl:if test="memory/@events_oom_kill &gt; 0">
+      <xsl:text>, </xsl:text>
+      <xsl:value-of select="memory/@events_oom_kill"/>
+      <xsl:text> OOM kills</xsl:text>
+    </xsl:if>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:if test="pressure[@type='some']">
+      <xsl:text>           stalled (some):</xsl:text>
+      <xsl:for-each select="pressure[@type='some']">
+        <xsl:text> </xsl:text>
+        <xsl:value-of select="@resource"/>
+        <xsl:text> </xsl:text>
+        <xsl:value-of select="@percent"/>
+        <xsl:text>%</xsl:text>
+      </xsl:for-each>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:if>
+  </xsl:template>
+
+
   <!--  Formats and lists all used commands lines  -->
   <xsl:template match="command_line">
     <xsl:text>         - </xsl:text>
@@ -198,6 +270,49 @@
       <xsl:otherwise>(Not run)</xsl:otherwise>
     </xsl:choose>
     <xsl:text>&#10;</xsl:text>
+    <xsl:for-each select="throughput[@runs &gt; 0]">
+      <xsl:text>           node </xsl:text>
+      <xsl:value-of select="@node"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="@runs"/>
+      <xsl:text> runs, </xsl:text>
+      <xsl:value-of select="@loops_per_sec"/>
+      <xsl:text> loops/s, </xsl:text>
+      <xsl:value-of select="@messages_per_sec"/>
+      <xsl:text> msgs/s&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:for-each select="throughput[@workers]">
+      <xsl:text>           node </xsl:text>
+      <xsl:value-of select="@node"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="@workers"/>
+      <xsl:text> </xsl:text>
+      <xsl:value-of select="@type"/>
+      <xsl:text> workers</xsl:text>
+      <xsl:for-each select="@*[contains(name(), '_per_sec')]">
+        <xsl:text>, </xsl:text>
+        <xsl:value-of select="."/>
+        <xsl:text> </xsl:text>
+        <xsl:value-of select="substring-before(name(), '_per_sec')"/>
+        <xsl:text>/s</xsl:text>
+      </xsl:for-each>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:for-each select="stressor[@bogo_ops]">
+      <xsl:text>           node </xsl:text>
+      <xsl:value-of select="@node"/>
+      <xsl:text> </xsl:text>
+      <xsl:value-of select="@name"/>
+      <xsl:if test="@instances">
+        <xsl:text> x</xsl:text>
+        <xsl:value-of select="@instances"/>
+      </xsl:if>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="@bogo_ops"/>
+      <xsl:text> bogo ops, </xsl:text>
+      <xsl:value-of select="@bogo_ops_per_sec"/>
+      <xsl:text> bogo ops/s&#10;</xsl:text>
+    </xsl:for-each>
   </xsl:template>
 
 
@@ -211,7 +326,7 @@
     <!--                                                                        -->
     <!--       select="cyclictest|new_foo_section|another_section"              -->
     <!--                                                                        -->
-    <xsl:apply-templates select="cyclictest|timerlat|hwlatdetect[@format='1.0']|sysstat"/>
+    <xsl:apply-templates select="cyclictest|timerlat|hwlatdetect[@format='1.0']|sysstat|cpustate|psi|tracering|perf|calibration"/>
     <xsl:text>&#10;</xsl:text>
   </xsl:template>
 
@@ -244,6 +359,7 @@
     <xsl:apply-templates select="core">
       <xsl:sort select="@id" data-type="number"/>
     </xsl:apply-templates>
+    <xsl:apply-templates select="segments"/>
   </xsl:template>
 
 
@@ -306,6 +422,15 @@
       <xsl:value-of select="standard_deviation"/>
       <xsl:value-of select="standard_deviation/@unit"/>
       <xsl:text>&#10;</xsl:text>
+
+      <xsl:if test="overflows">
+        <xsl:text>            Overflows:         </xsl:text>
+        <xsl:value-of select="overflows"/>
+        <xsl:text> above </xsl:text>
+        <xsl:value-of select="overflows/@above"/>
+        <xsl:value-of select="overflows/@unit"/>
+        <xsl:text> (statistics are lower bounds)&#10;</xsl:text>
+      </xsl:if>
     </xsl:if>
     <xsl:text>&#10;</xsl:text>
   </xsl:template>
@@ -332,6 +457,7 @@
 </xsl:text>
     <xsl:apply-templates select="stoptrace_report"/>
     <xsl:apply-templates select="max_timerlat_report"/>
+    <xsl:apply-templates select="stoptrace_summary"/>
     </xsl:if>
 
     <!-- Make sure the description is available before printing System: -->
@@ -351,6 +477,7 @@
     <xsl:apply-templates select="core">
       <xsl:sort select="@id" data-type="number"/>
     </xsl:apply-templates>
+    <xsl:apply-templates select="segments"/>
   </xsl:template>
 
 
@@ -413,10 +540,40 @@
       <xsl:value-of select="standard_deviation"/>
       <xsl:value-of select="standard_deviation/@unit"/>
       <xsl:text>&#10;</xsl:text>
+
+      <xsl:if test="percentile">
+        <xsl:text>            Percentiles:      </xsl:text>
+        <xsl:apply-templates select="percentile"/>
+        <xsl:text>&#10;</xsl:text>
+      </xsl:if>
+      <xsl:apply-templates select="../latency"/>
     </xsl:if>
     <xsl:text>&#10;</xsl:text>
   </xsl:template>
 
+  <!-- IRQ, thread and user latency of a timerlat core or the system -->
+  <xsl:template match="/rteval/Measurements/timerlat/*/latency">
+    <xsl:text>            </xsl:text>
+    <xsl:value-of select="substring(concat(@type, ':                  '), 1, 19)"/>
+    <xsl:text>max </xsl:text>
+    <xsl:value-of select="statistics/maximum"/>
+    <xsl:value-of select="statistics/maximum/@unit"/>
+    <xsl:text>, mean </xsl:text>
+    <xsl:value-of select="statistics/mean"/>
+    <xsl:value-of select="statistics/mean/@unit"/>
+    <xsl:text>,</xsl:text>
+    <xsl:apply-templates select="statistics/percentile"/>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="/rteval/Measurements/timerlat//statistics/percentile">
+    <xsl:text> p</xsl:text>
+    <xsl:value-of select="@value"/>
+    <xsl:text> </xsl:text>
+    <xsl:value-of select="."/>
+    <xsl:value-of select="@unit"/>
+  </xsl:template>
+
 
   <!-- Format the hwlatdetect test section of the report -->
   <xsl:template match="/rteval/Measurements/hwlatdetect[@format='1.0' and not(@aborted)]">
@@ -474,6 +631,248 @@
     <xsl:text>&#10;</xsl:text>
   </xsl:template>
 
+  <!-- Format the cpu idle/frequency state section of the report -->
+  <xsl:template match="/rteval/Measurements/cpustate">
+    <xsl:text>       CPU idle and frequency state&#10;</xsl:text>
+
+    <xsl:text>          Samples: </xsl:text>
+    <xsl:value-of select="@samples"/>
+    <xsl:text> (every </xsl:text>
+    <xsl:value-of select="@interval"/>
+    <xsl:text>s)&#10;</xsl:text>
+
+    <xsl:for-each select="cpu">
+      <xsl:sort select="@id" data-type="number"/>
+      <xsl:text>          CPU </xsl:text>
+      <xsl:value-of select="@id"/>
+      <xsl:if test="frequency">
+        <xsl:text>  frequency: </xsl:text>
+        <xsl:value-of select="frequency/@minimum"/>
+        <xsl:text>/</xsl:text>
+        <xsl:value-of select="frequency/@mean"/>
+        <xsl:text>/</xsl:text>
+        <xsl:value-of select="frequency/@maximum"/>
+        <xsl:text> </xsl:text>
+        <xsl:value-of select="frequency/@unit"/>
+        <xsl:text> (min/mean/max)</xsl:text>
+      </xsl:if>
+      <xsl:text>&#10;</xsl:text>
+      <xsl:for-each select="idlestate">
+        <xsl:text>            </xsl:text>
+        <xsl:value-of select="@name"/>
+        <xsl:text>: </xsl:text>
+        <xsl:value-of select="usage"/>
+        <xsl:text> entries, </xsl:text>
+        <xsl:value-of select="residency"/>
+        <xsl:value-of select="residency/@unit"/>
+        <xsl:if test="residency_percent">
+          <xsl:text> (</xsl:text>
+          <xsl:value-of select="residency_percent"/>
+          <xsl:text>%)</xsl:text>
+        </xsl:if>
+        <xsl:text>&#10;</xsl:text>
+      </xsl:for-each>
+    </xsl:for-each>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- Format the histogram segments of a latency test -->
+  <xsl:template match="segments">
+    <xsl:text>          Histogram segments:&#10;</xsl:text>
+    <xsl:for-each select="segment">
+      <xsl:text>            </xsl:text>
+      <xsl:value-of select="@index"/>
+      <xsl:if test="@name">
+        <xsl:text> (</xsl:text>
+        <xsl:value-of select="@name"/>
+        <xsl:text>)</xsl:text>
+      </xsl:if>
+      <xsl:text> </xsl:text>
+      <xsl:value-of select="@duration"/>
+      <xsl:text>s: </xsl:text>
+      <xsl:value-of select="@samples"/>
+      <xsl:text> samples</xsl:text>
+      <xsl:if test="@max">
+        <xsl:text>, max </xsl:text>
+        <xsl:value-of select="@max"/>
+        <xsl:text>us (cpu </xsl:text>
+        <xsl:value-of select="@max_cpu"/>
+        <xsl:text>), mean </xsl:text>
+        <xsl:value-of select="@mean"/>
+        <xsl:text>us</xsl:text>
+      </xsl:if>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- Format the latency the collectors added in calibration mode -->
+  <xsl:template match="/rteval/Measurements/calibration">
+    <xsl:text>       Calibration (</xsl:text>
+    <xsl:value-of select="@steps"/>
+    <xsl:text> steps of </xsl:text>
+    <xsl:value-of select="@step"/>
+    <xsl:text>s)&#10;</xsl:text>
+    <xsl:for-each select="collector">
+      <xsl:text>          </xsl:text>
+      <xsl:value-of select="@name"/>
+      <xsl:text> (</xsl:text>
+      <xsl:value-of select="@measurement"/>
+      <xsl:text>): p99 </xsl:text>
+      <xsl:value-of select="@p99"/>
+      <xsl:text>us (</xsl:text>
+      <xsl:if test="@delta_p99 >= 0">+</xsl:if>
+      <xsl:value-of select="@delta_p99"/>
+      <xsl:text>), max </xsl:text>
+      <xsl:value-of select="@max"/>
+      <xsl:text>us (</xsl:text>
+      <xsl:if test="@delta_max >= 0">+</xsl:if>
+      <xsl:value-of select="@delta_max"/>
+      <xsl:text>)&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:if test="@not_paused">
+      <xsl:text>          not paused: </xsl:text>
+      <xsl:value-of select="@not_paused"/>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:if>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- Format the perf section of the report -->
+  <xsl:template match="/rteval/Measurements/perf">
+    <xsl:text>       perf </xsl:text>
+    <xsl:value-of select="@mode"/>
+    <xsl:text> on cpus </xsl:text>
+    <xsl:value-of select="@cpulist"/>
+    <xsl:if test="@datafile">
+      <xsl:text> (</xsl:text>
+      <xsl:value-of select="@datafile"/>
+      <xsl:text>)</xsl:text>
+    </xsl:if>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:for-each select="symbol[@rank &lt;= 10]">
+      <xsl:text>          </xsl:text>
+      <xsl:value-of select="@percent"/>
+      <xsl:text>%  </xsl:text>
+      <xsl:value-of select="@comm"/>
+      <xsl:text>  </xsl:text>
+      <xsl:value-of select="."/>
+      <xsl:text> [</xsl:text>
+      <xsl:value-of select="@dso"/>
+      <xsl:text>]&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:for-each select="counter">
+      <xsl:text>          </xsl:text>
+      <xsl:value-of select="@event"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="."/>
+      <xsl:value-of select="@unit"/>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="/rteval/Measurements/tracering">
+    <xsl:text>       Trace capture&#10;</xsl:text>
+    <xsl:choose>
+      <xsl:when test="@available = 'true'">
+        <xsl:text>          Threshold: </xsl:text>
+        <xsl:value-of select="@threshold"/>
+        <xsl:text>us, events: </xsl:text>
+        <xsl:value-of select="@events"/>
+        <xsl:text>&#10;</xsl:text>
+        <xsl:for-each select="hits">
+          <xsl:text>          CPU </xsl:text>
+          <xsl:value-of select="@cpu"/>
+          <xsl:text>: </xsl:text>
+          <xsl:value-of select="."/>
+          <xsl:text> wakeups above threshold&#10;</xsl:text>
+        </xsl:for-each>
+        <xsl:text>          Snapshots: </xsl:text>
+        <xsl:value-of select="count(snapshot)"/>
+        <xsl:text> (at most </xsl:text>
+        <xsl:value-of select="@max_snapshots"/>
+        <xsl:text>)&#10;</xsl:text>
+        <xsl:for-each select="snapshot">
+          <xsl:text>            </xsl:text>
+          <xsl:value-of select="@time"/>
+          <xsl:text>  </xsl:text>
+          <xsl:value-of select="@file"/>
+          <xsl:text>&#10;</xsl:text>
+          <xsl:for-each select="analysis/outlier[position() &lt;= 3]">
+            <xsl:text>              CPU </xsl:text>
+            <xsl:value-of select="@cpu"/>
+            <xsl:text> </xsl:text>
+            <xsl:value-of select="@latency"/>
+            <xsl:value-of select="@unit"/>
+            <xsl:text>:</xsl:text>
+            <xsl:for-each select="cause[position() &lt;= 3]">
+              <xsl:text> </xsl:text>
+              <xsl:value-of select="@kind"/>
+              <xsl:text> </xsl:text>
+              <xsl:value-of select="@name"/>
+              <xsl:text> </xsl:text>
+              <xsl:value-of select="@duration"/>
+              <xsl:value-of select="@unit"/>
+              <xsl:if test="position() != last()">
+                <xsl:text>,</xsl:text>
+              </xsl:if>
+            </xsl:for-each>
+            <xsl:text>&#10;</xsl:text>
+          </xsl:for-each>
+        </xsl:for-each>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:text>          tracefs not available&#10;</xsl:text>
+      </xsl:otherwise>
+    </xsl:choose>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- Format the pressure stall information section of the report -->
+  <xsl:template match="/rteval/Measurements/psi">
+    <xsl:text>       Pressure stall information&#10;</xsl:text>
+
+    <xsl:text>          Samples: </xsl:text>
+    <xsl:value-of select="@samples"/>
+    <xsl:text> (every </xsl:text>
+    <xsl:value-of select="@interval"/>
+    <xsl:text>s)&#10;</xsl:text>
+
+    <xsl:for-each select="pressure[@type='some' and total]">
+      <xsl:text>          </xsl:text>
+      <xsl:value-of select="@source"/>
+      <xsl:text> </xsl:text>
+      <xsl:value-of select="@resource"/>
+      <xsl:text>: stalled </xsl:text>
+      <xsl:value-of select="percent"/>
+      <xsl:text>% (avg10 max </xsl:text>
+      <xsl:value-of select="avg10/@max"/>
+      <xsl:text>%, avg60 max </xsl:text>
+      <xsl:value-of select="avg60/@max"/>
+      <xsl:text>%)</xsl:text>
+      <xsl:variable name="src" select="@source"/>
+      <xsl:variable name="res" select="@resource"/>
+      <xsl:variable name="full" select="../pressure[@type='full' and @source=$src and @resource=$res]"/>
+      <xsl:if test="$full/percent &gt; 0">
+        <xsl:text>, fully stalled </xsl:text>
+        <xsl:value-of select="$full/percent"/>
+        <xsl:text>%</xsl:text>
+      </xsl:if>
+      <xsl:text>&#10;</xsl:text>
+      <xsl:for-each select="phase">
+        <xsl:text>            phase </xsl:text>
+        <xsl:value-of select="@index"/>
+        <xsl:text> (</xsl:text>
+        <xsl:value-of select="@name"/>
+        <xsl:text>): </xsl:text>
+        <xsl:value-of select="."/>
+        <xsl:text>%&#10;</xsl:text>
+      </xsl:for-each>
+    </xsl:for-each>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
   <!-- Format information about aborts - if present -->
   <xsl:template match="abort_report">
       <xsl:text>      Run aborted: </xsl:text>
@@ -646,6 +1045,33 @@
 </xsl:text>
   </xsl:template>
 
+  <!-- Interference of all the cpus analyzed, largest first -->
+  <xsl:template match="stoptrace_summary">
+     <xsl:if test="interferer">
+     <xsl:text>
+Top interferers:
+</xsl:text>
+     <xsl:for-each select="interferer[@rank &lt;= 10]">
+	     <xsl:text>  </xsl:text>
+	     <xsl:value-of select="@rank"/>
+	     <xsl:text>. </xsl:text>
+	     <xsl:value-of select="@name"/>
+	     <xsl:text> (</xsl:text>
+	     <xsl:value-of select="translate(@kind, '_', ' ')"/>
+	     <xsl:text>)	total </xsl:text>
+	     <xsl:value-of select="@total"/>
+	     <xsl:value-of select="@unit"/>
+	     <xsl:text>, max </xsl:text>
+	     <xsl:value-of select="@max"/>
+	     <xsl:value-of select="@unit"/>
+	     <xsl:text> on cpu </xsl:text>
+	     <xsl:value-of select="@cpus"/>
+             <xsl:text>
+</xsl:text>
+     </xsl:for-each>
+     </xsl:if>
+  </xsl:template>
+
   <xsl:template match="max_timerlat_report">
      <xsl:text>
 </xsl:text>
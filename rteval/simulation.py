@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Simulated runs with stand-in measurement and load tools
+
+With --simulate rteval runs its normal module lifecycle, but cyclictest,
+rtla, hackbench, stress-ng, make and tar are stand-ins written to a
+temporary directory put first in PATH.  kcompile builds an empty kernel
+tree from a placeholder tarball, so no kernel source is needed.  Time is compressed by a speedup factor:
+the run, calibration steps, histogram segments and load phases last
+1/speedup of their configured length, and the stand-ins report what the
+real tools would have measured in the configured time.  A 24h run with
+the default speedup of 3600 takes 24 seconds.
+
+The latency tools print synthetic histograms, or the recorded output in
+TOOL.out of the --simulate-replay directory.  The generators of the
+synthetic output are shared with unit-tests/benchmark.py.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import atexit
+import random
+import shutil
+import signal
+import tempfile
+from rteval.Log import Log
+from rteval.cpulist_utils import expand_cpulist
+
+STANDINS = ('cyclictest', 'rtla', 'hackbench', 'stress-ng', 'make', 'tar')
+DEFAULT_SPEEDUP = 3600.0
+
+# passed to the stand-ins
+SPEEDUP_ENV = 'RTEVAL_SIMULATE_SPEEDUP'
+REPLAY_ENV = 'RTEVAL_SIMULATE_REPLAY'
+
+# bogo ops per second and instance of the simulated stress-ng stressors
+BOGO_OPS_RATE = 500.0
+
+
+def latency_counts(rng, samples, buckets, outliers):
+    """ return {latency: count} of one cpu, an exponential tail after a
+    mode of a few us plus outliers of a single sample each """
+    mode = rng.randint(2, 8)
+    scale = rng.uniform(1.0, 4.0)
+    counts = {}
+    remaining = samples
+    lat = mode
+    while remaining > 0 and lat < buckets:
+        count = max(int(remaining * (1 - math.exp(-1 / scale))), 1)
+        counts[lat] = min(count, remaining)
+        remaining -= counts[lat]
+        lat += 1
+    for _ in range(outliers):
+        lat = rng.randint(min(mode * 10, buckets - 1), buckets - 1)
+        counts[lat] = counts.get(lat, 0) + 1
+    return counts
+
+
+def cyclictest_output(rng, cpus, buckets, samples, outliers=0, overflows=0):
+    """ return the output of 'cyclictest -qmu -h buckets' """
+    hists = [latency_counts(rng, samples, buckets, outliers) for _ in range(cpus)]
+    lines = ["# Histogram\n"]
+    for index in range(buckets):
+        lines.append(f"{index:06d}" + ''.join(f"\t{h.get(index, 0):06d}" for h in hists) + "\n")
+    lines.append("# Total:" + ''.join(f" {sum(h.values()):09d}" for h in hists) + "\n")
+    lines.append("# Min Latencies:" + ''.join(f" {min(h):05d}" for h in hists) + "\n")
+    lines.append("# Avg Latencies:" + ''.join(f" {min(h) + 1:05d}" for h in hists) + "\n")
+    # overflows are above the histogram, up to ten times its range
+    maxima = [rng.randint(buckets, buckets * 10) if overflows else max(h) for h in hists]
+    lines.append("# Max Latencies:" + ''.join(f" {m:05d}" for m in maxima) + "\n")
+    lines.append("# Histogram Overflows:" + ''.join(f" {overflows:05d}" for _ in hists) + "\n")
+    lines.append("# Histogram Overflow at cycle number:\n")
+    for i in range(cpus):
+        lines.append(f"# Thread {i}:" + ''.join(f" {rng.randint(0, 10**6):05d}" for _ in range(min(overflows, 10)))
+                     + (" # 00000 others" if overflows > 10 else "") + "\n")
+    return ''.join(lines)
+
+
+def stoptrace_output(rng, cpus, interferers=5):
+    """ return the auto-analysis rtla prints after stopping the trace """
+    lines = ["rtla timerlat hit stop tracing\n"]
+    for cpu in range(cpus):
+        irq = rng.uniform(1, 20)
+        lines.append(f"## CPU {cpu} hit stop tracing, analyzing it ##\n")
+        lines.append(f"  IRQ handler delay:\t\t\t\t{rng.uniform(0, 5):8.2f} us ({rng.uniform(0, 10):.2f} %)\n")
+        lines.append(f"  IRQ latency:\t\t\t\t\t{irq:8.2f} us\n")
+        lines.append(f"  Timerlat IRQ duration:\t\t\t{rng.uniform(1, 8):8.2f} us ({rng.uniform(0, 10):.2f} %)\n")
+        lines.append(f"  Blocking thread:\t\t\t\t{rng.uniform(1, 40):8.2f} us ({rng.uniform(0, 50):.2f} %)\n")
+        lines.append(f"\t\t\tstress-ng:{rng.randint(1000, 9999)}\t\t\t{rng.uniform(1, 40):8.2f} us\n")
+        lines.append("    Blocking thread stack trace\n")
+        for func in ('timerlat_irq', '__hrtimer_run_queues', 'hrtimer_interrupt'):
+            lines.append(f"\t\t-> {func}\n")
+        lines.append(f"  IRQ interference\t\t\t\t{rng.uniform(1, 40):8.2f} us ({rng.uniform(0, 50):.2f} %)\n")
+        for _ in range(interferers):
+            lines.append(f"\t\t      irq{rng.randint(0, 64)}:{rng.randint(0, 300)}\t\t\t{rng.uniform(0, 10):8.2f} us\n")
+        lines.append(f"  Softirq interference\t\t\t\t{rng.uniform(1, 10):8.2f} us ({rng.uniform(0, 10):.2f} %)\n")
+        lines.append(f"\t\t\t      SCHED:7\t\t\t{rng.uniform(1, 10):8.2f} us\n")
+        lines.append("-" * 72 + "\n")
+        lines.append(f"  Thread latency:\t\t\t\t{irq + 30:8.2f} us (100%)\n\n")
+    lines.append(f"  Max timerlat IRQ latency from idle: {rng.uniform(5, 30):.2f} us in cpu 0\n")
+    return ''.join(lines)
+
+
+def timerlat_output(rng, cpus, buckets, samples, outliers=0, stoptrace=0, interferers=5):
+    """ return the output of 'rtla timerlat hist', followed by the
+    auto-analysis of stoptrace cpus """
+    # irq, thread and user latencies of every cpu
+    hists = [[latency_counts(rng, samples, buckets, outliers) for _ in range(3)] for _ in range(cpus)]
+    lines = ["# RTLA timerlat histogram\n", "# Time unit is microseconds (us)\n",
+             "# Duration:   0 00:10:00\n"]
+    lines.append("Index" + ''.join(f"   IRQ-{c:03d}   Thr-{c:03d}   Usr-{c:03d}" for c in range(cpus)) + "\n")
+    # rtla leaves out the buckets without samples
+    for index in sorted(set().union(*(h for c in hists for h in c))):
+        lines.append(f"{index:<5d}" + ''.join(f"{h.get(index, 0):9d}" for c in hists for h in c) + "\n")
+    for label in ('over:', 'count:', 'min:', 'avg:', 'max:'):
+        lines.append(f"{label:<5s}" + ''.join(f"{0:9d}" for c in hists for h in c) + "\n")
+    if stoptrace:
+        lines.append(stoptrace_output(rng, stoptrace, interferers))
+    return ''.join(lines)
+
+
+def scale_schedule(spec, speedup):
+    """ return a load schedule with the phases speedup times shorter """
+    # imported here, the stand-ins don't need the load modules
+    from rteval.modules.loads import parse_schedule
+    return ', '.join(f"{seconds / speedup:g}s {name}" for name, seconds, _ in parse_schedule(spec))
+
+
+def setup(config, logger=None):
+    """ install the stand-ins for the run and compress its durations.
+    Returns the directory of the stand-ins, removed when rteval exits """
+    rtevcfg = config.GetSection('rteval')
+    speedup = float(rtevcfg.simulate)
+    if speedup <= 0:
+        raise RuntimeError(f"invalid simulation speedup {speedup}")
+    if rtevcfg.simulate_replay and not os.path.isdir(rtevcfg.simulate_replay):
+        raise RuntimeError(f"simulation replay directory {rtevcfg.simulate_replay} does not exist")
+
+    bindir = tempfile.mkdtemp(prefix='rteval-simulate-')
+    atexit.register(shutil.rmtree, bindir, True)
+    srcroot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in STANDINS:
+        path = os.path.join(bindir, name)
+        with open(path, 'w') as f:
+            f.write(f"#!{sys.executable}\n"
+                    "import sys\n"
+                    f"sys.path.insert(0, {srcroot!r})\n"
+                    "from rteval.simulation import standin\n"
+                    f"sys.exit(standin({name!r}, sys.argv[1:]))\n")
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = f"{bindir}:{os.environ.get('PATH', '')}"
+
+    # placeholder kernel tarballs, unpacked by the tar stand-in
+    from rteval.modules.loads.kcompile import ModuleParameters as kcompile_parameters
+    srcdir = os.path.join(bindir, 'loadsource')
+    os.mkdir(srcdir)
+    sources = {kcompile_parameters()['source']['default']}
+    if config.HasSection('kcompile') and config.GetSection('kcompile').source:
+        sources.add(os.path.basename(str(config.GetSection('kcompile').source)))
+    for source in sources:
+        open(os.path.join(srcdir, source), 'w').close()
+    rtevcfg.srcdir = srcdir
+    os.environ[SPEEDUP_ENV] = str(speedup)
+    if rtevcfg.simulate_replay:
+        os.environ[REPLAY_ENV] = os.path.abspath(rtevcfg.simulate_replay)
+
+    # everything timed follows the compressed clock
+    rtevcfg.simulated_duration = float(rtevcfg.duration)
+    rtevcfg.duration = float(rtevcfg.duration) / speedup
+    msrcfg = config.GetSection('measurement')
+    if msrcfg.calibrate:
+        msrcfg.calibrate = float(msrcfg.calibrate) / speedup
+    for section in ('cyclictest', 'timerlat'):
+        if config.HasSection(section) and config.GetSection(section).segment:
+            config.GetSection(section).segment = float(config.GetSection(section).segment) / speedup
+    ldcfg = config.GetSection('loads')
+    if ldcfg.schedule:
+        ldcfg.schedule = scale_schedule(str(ldcfg.schedule), speedup)
+    if logger:
+        logger.log(Log.INFO, f"simulating {rtevcfg.simulated_duration:g}s in "
+                   f"{rtevcfg.duration:g}s with the stand-ins in {bindir}")
+    return bindir
+
+
+class _Stopwatch:
+    """ the simulated time a stand-in ran until it was stopped.  Time the
+    stand-in was frozen by a load schedule doesn't count, it shows up as
+    a sleep taking much longer than asked for """
+    TICK = 0.05
+
+    def __init__(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        self.speedup = float(os.environ.get(SPEEDUP_ENV, DEFAULT_SPEEDUP))
+        self.stopped = False
+        # real seconds the stand-in was frozen
+        self.frozen = 0.0
+        self.__start = time.time()
+        for sig in signals:
+            signal.signal(sig, self.__stop)
+
+    def __stop(self, signum, frame):
+        self.stopped = True
+
+    def wait(self, timeout=None):
+        """ wait to be stopped, or timeout simulated seconds """
+        while not self.stopped and (timeout is None or self.elapsed() < timeout):
+            before = time.time()
+            time.sleep(self.TICK)
+            late = time.time() - before - self.TICK
+            if late > self.TICK:
+                self.frozen += late
+
+    def elapsed(self):
+        """ the simulated time the stand-in was running """
+        return (time.time() - self.__start - self.frozen) * self.speedup
+
+    def wall(self):
+        """ the wall clock time a real tool reports, frozen time included """
+        return self.elapsed() + self.frozen * self.speedup
+
+
+def _replay(name):
+    """ print the recorded output of a tool, return False if there is none """
+    replay = os.environ.get(REPLAY_ENV)
+    path = os.path.join(replay, f"{name}.out") if replay else None
+    if not path or not os.path.exists(path):
+        return False
+    with open(path) as f:
+        shutil.copyfileobj(f, sys.stdout)
+    return True
+
+
+def _option(args, flag, default=None):
+    """ return the value of a '-xVALUE', '-x VALUE' or '-x' 'VALUE' option """
+    for i, arg in enumerate(args):
+        if arg.startswith(flag):
+            value = arg[len(flag):].strip()
+            if not value and i + 1 < len(args):
+                value = args[i + 1]
+            return value
+    return default
+
+
+def _cyclictest(args, clock, rng):
+    clock.wait()
+    if _replay('cyclictest'):
+        return 0
+    interval = int(next((a[2:] for a in args if a.startswith('-i') and a[2:].isdigit()), 1000))
+    buckets = int(_option(args, '-h', 0) or 0) or 1000
+    # the last -t wins, as with cyclictest
+    threads = [a[2:] for a in args if a.startswith('-t') and a[2:].isdigit()]
+    cpus = int(threads[-1]) if threads else len(expand_cpulist(_option(args, '-a', '0')))
+    samples = int(clock.elapsed() * 1e6 / interval)
+    sys.stdout.write(cyclictest_output(rng, cpus, buckets, samples, outliers=rng.randint(0, 3)))
+    return 0
+
+
+def _rtla(args, clock, rng):
+    clock.wait()
+    if _replay('rtla'):
+        return 0
+    cpus = len(expand_cpulist(_option(args, '-c', '0')))
+    buckets = int(_option(args, '-E', 0) or 0) or 256
+    # the default period of timerlat is 1ms
+    samples = int(clock.elapsed() * 1e3)
+    sys.stdout.write(timerlat_output(rng, cpus, buckets, samples, outliers=rng.randint(0, 3)))
+    return 0
+
+
+def _hackbench(args, clock, rng):
+    groups = int(_option(args, '-g', 10))
+    fds = int(_option(args, '-f', 20))
+    print(f"Running in {'threaded' if '-T' in args else 'process'} mode with {groups} groups "
+          f"using {fds * 2} file descriptors each (== {groups * fds * 2} tasks)")
+    print(f"Each sender will pass {_option(args, '-l', 100)} messages of {_option(args, '-s', 100)} bytes")
+    # a real run takes about a second
+    seconds = rng.uniform(0.8, 1.2)
+    clock.wait(seconds)
+    if clock.stopped:
+        return 1
+    print(f"Time: {seconds + clock.frozen * clock.speedup:.3f}")
+    return 0
+
+
+def _stressng(args, clock, rng):
+    options = {'--yaml': None, '--timeout': None}
+    stressors = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        value = args[i + 1] if i + 1 < len(args) else None
+        if arg in options:
+            options[arg] = value
+            i += 2
+        elif arg.startswith('--') and '-' not in arg[2:] and value is not None and value.isdigit():
+            stressors.append((arg[2:], int(value)))
+            i += 2
+        else:
+            i += 1
+    timeout = None
+    if options['--timeout']:
+        from rteval.modules.loads import parse_duration
+        timeout = parse_duration(options['--timeout'])
+    clock.wait(timeout)
+    running = clock.elapsed()
+    wall = clock.wall()
+    if options['--yaml']:
+        with open(options['--yaml'], 'w') as f:
+            f.write("---\nsystem-info:\n      stress-ng-version: simulated\nmetrics:\n")
+            for name, count in stressors:
+                rate = BOGO_OPS_RATE * max(count, 1) * rng.uniform(0.9, 1.1)
+                ops = int(rate * running)
+                f.write(f"    - stressor: {name}\n"
+                        f"      bogo-ops: {ops}\n"
+                        f"      bogo-ops-per-second-usr-sys-time: {rate:.6f}\n"
+                        f"      bogo-ops-per-second-real-time: {ops / wall if wall > 0 else 0:.6f}\n"
+                        f"      wall-clock-time: {wall:.6f}\n")
+    return 0
+
+
+def _make(args, clock, rng):
+    # configuring and cleaning is immediate, builds run until stopped
+    if any(t in args for t in ('mrproper', 'clean', 'olddefconfig', 'allmodconfig')):
+        return 0
+    clock.wait()
+    return 0
+
+
+def _tar(args, clock, rng):
+    archive = _option(args, '-f')
+    if archive and os.path.exists(archive) and not os.path.getsize(archive):
+        # a placeholder kernel tarball: the tree kcompile looks for, with
+        # the one script it runs
+        tree = os.path.join(_option(args, '-C', '.'), re.sub(r'\.tar(\.\w+)?$', '', os.path.basename(archive)))
+        os.makedirs(os.path.join(tree, 'scripts'), exist_ok=True)
+        with open(os.path.join(tree, 'scripts', 'config'), 'w') as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(os.path.join(tree, 'scripts', 'config'), 0o755)
+        return 0
+    # anything else is unpacked by the real tar
+    bindir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    path = os.pathsep.join(p for p in os.environ.get('PATH', '').split(os.pathsep) if p != bindir)
+    tar = shutil.which('tar', path=path)
+    if not tar:
+        print("tar: not found", file=sys.stderr)
+        return 127
+    os.execv(tar, ['tar'] + args)
+    return 0
+
+
+def standin(name, args):
+    """ run the stand-in of tool name with its command line args """
+    rng = random.Random()
+    clock = _Stopwatch()
+    return {'cyclictest': _cyclictest,
+            'rtla': _rtla,
+            'hackbench': _hackbench,
+            'stress-ng': _stressng,
+            'make': _make,
+            'tar': _tar}[name](args, clock, rng)
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/simulation.py """
+    try:
+        rng = random.Random(1)
+        counts = latency_counts(rng, 10**6, 100, 2)
+        assert sum(counts.values()) == 10**6 + 2 and max(counts) < 100
+
+        out = cyclictest_output(rng, 2, 50, 1000, overflows=3)
+        lines = out.splitlines()
+        print(f"cyclictest: {len(lines)} lines, {lines[-4]}")
+        assert len([l for l in lines if not l.startswith('#')]) == 50
+        assert lines[-4] == "# Histogram Overflows: 00003 00003"
+        assert sum(int(l.split()[1]) for l in lines if not l.startswith('#')) == 1000
+
+        out = timerlat_output(rng, 3, 50, 1000, stoptrace=1)
+        assert out.splitlines()[3].split()[1:4] == ['IRQ-000', 'Thr-000', 'Usr-000']
+        assert "## CPU 0 hit stop tracing" in out
+
+        assert _option(['-P', '-g', '4'], '-g') == '4' and _option(['-h 3500'], '-h') == '3500'
+        assert _option(['-c0-3'], '-c') == '0-3' and _option([], '-E', 7) == 7
+        assert scale_schedule('10m idle, 1h hackbench+stressng', 60) == '10s idle, 60s hackbench+stressng'
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(unit_test(None))
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Module to start load processes with cpu affinity, NUMA memory policy,
+scheduling and cgroup placement applied without numactl/taskset wrappers
+
+Affinity, memory policy, scheduling policy and nice value are per-thread
+attributes on Linux which a child inherits from the thread creating it.
+SpawnAttrs.spawn() sets them on the calling thread, starts the process
+with subprocess.Popen (posix_spawn or the C fork/exec path, no preexec_fn)
+and restores the thread afterwards, so other rteval threads are never
+affected.  For cgroup placement the process is started through a /bin/sh
+wrapper which writes its own pid to cgroup.procs before exec'ing the
+load, so nothing the load forks can escape the group.  spawn() returns
+once the process shows up in the group.
+"""
+
+import os
+import time
+import ctypes
+import shutil
+import threading
+import subprocess
+import rteval.cpulist_utils as cpulist_utils
+from rteval.Log import Log
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+SCHED_POLICIES = {'other': os.SCHED_OTHER,
+                  'batch': os.SCHED_BATCH,
+                  'idle': os.SCHED_IDLE,
+                  'fifo': os.SCHED_FIFO,
+                  'rr': os.SCHED_RR}
+
+# Memory policy modes, from linux/mempolicy.h
+MEMPOLICIES = {'default': 0,
+               'preferred': 1,
+               'bind': 2,
+               'interleave': 3}
+
+# set_mempolicy(2) is not wrapped by glibc, call it by number
+_SYS_SET_MEMPOLICY = {'x86_64': 238,
+                      'i686': 276,
+                      'aarch64': 237,
+                      'riscv64': 237,
+                      'ppc64': 261,
+                      'ppc64le': 261,
+                      's390x': 270}
+
+# joins the cgroup whose cgroup.procs is $0 and becomes the load,
+# exiting with _CGROUP_FAILED if the cgroup can't be joined
+_CGROUP_FAILED = 125
+_CGROUP_EXEC = f'echo $$ > "$0" || exit {_CGROUP_FAILED}; exec "$@"'
+
+# how long spawn() waits for a process to join its cgroup
+CGROUP_JOIN_TIMEOUT = 5.0
+
+_libc = None
+
+
+def _set_mempolicy(mode, nodes):
+    """ set the memory policy of the calling thread """
+    global _libc
+    nr = _SYS_SET_MEMPOLICY.get(os.uname().machine)
+    if nr is None:
+        raise OSError(f"set_mempolicy not supported on {os.uname().machine}")
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+
+    maxnode = max(nodes) + 1 if nodes else 0
+    longbits = ctypes.sizeof(ctypes.c_ulong) * 8
+    mask = (ctypes.c_ulong * (maxnode // longbits + 1))()
+    for n in nodes:
+        mask[n // longbits] |= 1 << (n % longbits)
+    # the kernel expects maxnode to be one more than the highest bit used
+    if _libc.syscall(nr, mode, mask if nodes else None, maxnode + 1 if nodes else 0) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"set_mempolicy: {os.strerror(err)}")
+
+
+def _in_cgroup(procs, pid):
+    """ return True if pid is listed in the cgroup.procs file procs """
+    try:
+        with open(procs, 'r', encoding='utf-8') as f:
+            return str(pid) in f.read().split()
+    except OSError:
+        return False
+
+
+class SpawnAttrs:
+    """ Placement and scheduling attributes for processes started by a load """
+    def __init__(self, cpus=None, mems=None, mempolicy='bind', policy=None,
+                 priority=0, nice=None, cgroup=None, log=None):
+        """
+        :param cpus: List of cpus the process may run on, None to inherit
+        :param mems: List of NUMA nodes for the memory policy, None to inherit
+        :param mempolicy: Memory policy mode used with mems (default, bind, preferred, interleave)
+        :param policy: Scheduling policy name (other, batch, idle, fifo, rr)
+        :param priority: Realtime priority for the fifo and rr policies
+        :param nice: Nice value
+        :param cgroup: cgroup v2 directory, absolute or relative to /sys/fs/cgroup
+        :param log: Function called as log(logtype, msg) for problems not worth failing on
+        """
+        if mempolicy not in MEMPOLICIES:
+            raise ValueError(f"unknown memory policy '{mempolicy}' (valid: {', '.join(MEMPOLICIES)})")
+        self.cpus = sorted(set(cpus)) if cpus else None
+        # the default policy (local allocation) doesn't take nodes
+        self.mems = sorted(set(mems)) if mems and mempolicy != 'default' else None
+        self.mempolicy = mempolicy
+        if policy is not None and policy not in SCHED_POLICIES:
+            raise ValueError(f"unknown scheduling policy '{policy}' (valid: {', '.join(SCHED_POLICIES)})")
+        self.policy = policy
+        self.priority = int(priority)
+        self.nice = int(nice) if nice is not None else None
+        if cgroup and not os.path.isabs(cgroup):
+            cgroup = os.path.join(CGROUP_ROOT, cgroup)
+        self.cgroup = cgroup
+        self.__log = log
+
+    def __str__(self):
+        desc = []
+        if self.cpus:
+            desc.append(f"cpus {cpulist_utils.collapse_cpulist(self.cpus)}")
+        if self.mems:
+            desc.append(f"mems {cpulist_utils.collapse_cpulist(self.mems)} ({self.mempolicy})")
+        if self.policy:
+            desc.append(f"policy {self.policy}/{self.priority}")
+        if self.nice is not None:
+            desc.append(f"nice {self.nice}")
+        if self.cgroup:
+            desc.append(f"cgroup {self.cgroup}")
+        return ", ".join(desc) or "inherited"
+
+    def __apply(self, tid):
+        """ set the attributes on thread tid, returning a function undoing it """
+        undo = []
+
+        def restore():
+            # a failure leaves the thread with the attributes of the child,
+            # which is no reason to lose the process already started
+            for u in reversed(undo):
+                try:
+                    u()
+                except OSError as err:
+                    if self.__log:
+                        self.__log(Log.WARN, f"failed to restore thread attributes ({self}): {err}")
+
+        try:
+            if self.cpus:
+                old_cpus = os.sched_getaffinity(tid)
+                os.sched_setaffinity(tid, self.cpus)
+                undo.append(lambda: os.sched_setaffinity(tid, old_cpus))
+            if self.mems:
+                _set_mempolicy(MEMPOLICIES[self.mempolicy], self.mems)
+                undo.append(lambda: _set_mempolicy(MEMPOLICIES['default'], []))
+            if self.nice is not None:
+                old_nice = os.getpriority(os.PRIO_PROCESS, tid)
+                os.setpriority(os.PRIO_PROCESS, tid, self.nice)
+                undo.append(lambda: os.setpriority(os.PRIO_PROCESS, tid, old_nice))
+            if self.policy:
+                old_policy = os.sched_getscheduler(tid)
+                old_param = os.sched_getparam(tid)
+                os.sched_setscheduler(tid, SCHED_POLICIES[self.policy],
+                                      os.sched_param(self.priority))
+                undo.append(lambda: os.sched_setscheduler(tid, old_policy, old_param))
+        except OSError:
+            restore()
+            raise
+        return restore
+
+    def spawn(self, args, **kwargs):
+        """ start args with subprocess.Popen, returning the Popen object """
+        if kwargs.get('preexec_fn') is not None:
+            raise ValueError("spawn() doesn't support preexec_fn")
+        if not self.cgroup:
+            return self.__popen(args, kwargs)
+
+        if isinstance(args, str):
+            args = [args]
+        # the wrapper would only fail to exec after we returned
+        env = kwargs.get('env')
+        cmd = args[0]
+        if os.sep in cmd and kwargs.get('cwd'):
+            cmd = os.path.join(kwargs['cwd'], cmd)
+        if shutil.which(cmd, path=env.get('PATH') if env is not None else None) is None:
+            raise FileNotFoundError(2, f"No such file or directory: '{args[0]}'")
+
+        procs = os.path.join(self.cgroup, 'cgroup.procs')
+        proc = self.__popen(['/bin/sh', '-c', _CGROUP_EXEC, procs] + list(args), kwargs)
+        end = time.monotonic() + CGROUP_JOIN_TIMEOUT
+        while not _in_cgroup(procs, proc.pid):
+            # a short lived load may already be gone from the group again
+            ret = proc.poll()
+            if ret is not None and ret != _CGROUP_FAILED:
+                break
+            if ret is not None or time.monotonic() > end:
+                proc.kill()
+                proc.wait()
+                raise OSError(f"failed to move {args[0]} into cgroup {self.cgroup}")
+            time.sleep(0.001)
+        return proc
+
+    def __popen(self, args, kwargs):
+        """ start the process with the attributes applied to this thread """
+        restore = self.__apply(threading.get_native_id())
+        try:
+            return subprocess.Popen(args, **kwargs)
+        finally:
+            restore()
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/spawn.py """
+    import sys
+    try:
+        tid = threading.get_native_id()
+        before = (os.sched_getaffinity(tid), os.getpriority(os.PRIO_PROCESS, tid))
+        cpu = min(before[0])
+
+        prog = ('import os; print(sorted(os.sched_getaffinity(0)), '
+                'os.getpriority(os.PRIO_PROCESS, 0))')
+        attrs = SpawnAttrs(cpus=[cpu], nice=before[1] + 5)
+        print(f"spawning with {attrs}")
+        proc = attrs.spawn([sys.executable, '-c', prog], stdout=subprocess.PIPE, text=True)
+        out = proc.communicate()[0].split()
+        print(f"child: {out}")
+        assert out == [f"[{cpu}]", str(before[1] + 5)]
+
+        after = (os.sched_getaffinity(tid), os.getpriority(os.PRIO_PROCESS, tid))
+        assert after == before, f"thread attributes not restored: {after} != {before}"
+
+        # a thread attribute which can't be restored (lowering the nice
+        # value needs CAP_SYS_NICE) is logged, the child is still returned
+        setpriority = os.setpriority
+        calls = []
+
+        def failing_setpriority(which, who, prio):
+            calls.append(prio)
+            if len(calls) > 1:
+                raise PermissionError(1, "Operation not permitted")
+            setpriority(which, who, prio)
+
+        logged = []
+        os.setpriority = failing_setpriority
+        try:
+            attrs = SpawnAttrs(nice=before[1] + 1, log=lambda t, m: logged.append(m))
+            proc = attrs.spawn([sys.executable, '-c', 'pass'])
+        finally:
+            os.setpriority = setpriority
+            os.setpriority(os.PRIO_PROCESS, tid, before[1])
+        assert proc.wait() == 0
+        assert len(logged) == 1, f"restore failure not logged: {logged}"
+
+        # what the load forks must start in its cgroup too
+        from rteval.cgroup import Cgroup, cgroup2_mount
+        mount = cgroup2_mount()
+        group = Cgroup(os.path.join(mount, f'rteval-spawntest-{os.getpid()}')) if mount else None
+        try:
+            group.create()
+        except (AttributeError, OSError) as err:
+            print(f"skipping cgroup test: {err}")
+            group = None
+        if group:
+            try:
+                attrs = SpawnAttrs(cgroup=group.path)
+                proc = attrs.spawn(['/bin/sh', '-c', 'cat /proc/self/cgroup; true'],
+                                   stdout=subprocess.PIPE, text=True)
+                out = proc.communicate()[0].split()
+                print(f"grandchild: {out}")
+                assert f"0::/{os.path.relpath(group.path, mount)}" in out
+            finally:
+                group.remove()
+
+        try:
+            SpawnAttrs(cgroup='/nonexistent/rteval').spawn([sys.executable, '-c', 'pass'],
+                                                           stderr=subprocess.DEVNULL)
+            return 1
+        except OSError:
+            pass
+
+        try:
+            SpawnAttrs(policy='bogus')
+            return 1
+        except ValueError:
+            pass
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
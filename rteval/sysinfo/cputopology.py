@@ -6,7 +6,7 @@
 
 import os
 import libxml2
-from rteval.systopology import SysTopology
+from rteval.systopology import get_systopology
 
 class CPUtopology:
     "Retrieves an overview over the installed CPU cores and the system topology"
@@ -34,8 +34,8 @@ class CPUtopology:
 
         self.__cputop_n = libxml2.newNode('CPUtopology')
 
-        # Get list of isolated CPUs from SysTopology
-        systopology = SysTopology()
+        # Get list of isolated CPUs from the shared topology snapshot
+        systopology = get_systopology()
         isolated_cpus = {'cpu' + n for n in systopology.isolated_cpus_str()}
 
         cpusockets = []
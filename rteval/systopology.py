@@ -9,6 +9,7 @@
 import os
 import os.path
 import glob
+import threading
 import rteval.cpulist_utils as cpulist_utils
 from rteval.cpulist_utils import sysread
 
@@ -52,6 +53,68 @@ def cpuinfo():
     return info
 
 
+def _filter_online(cpulist, online):
+    """ return the sorted online cpus of cpulist, reading the per-cpu
+    online files only if no online list is given
+    """
+    if online is None:
+        return sorted(cpulist_utils.online_cpulist(cpulist))
+    return sorted(c for c in cpulist if c in online)
+
+
+def _sysread_default(path, obj, default):
+    """ read a /sys file, returning default if it is not available """
+    try:
+        return sysread(path, obj)
+    except OSError:
+        return default
+
+
+#
+# class to abstract access to a single cpu in /sys filesystem
+#
+
+class Cpu:
+    "class representing an online cpu, its SMT siblings and its caches"
+
+    def __init__(self, cpuid, nodeid, isolated=False):
+        self.cpuid = cpuid
+        self.nodeid = nodeid
+        self.isolated = isolated
+        self.path = os.path.join(cpulist_utils.cpupath, f"cpu{cpuid}")
+
+        topo = os.path.join(self.path, "topology")
+        self.core_id = int(_sysread_default(topo, "core_id", cpuid))
+        self.package_id = int(_sysread_default(topo, "physical_package_id", 0))
+        siblings = _sysread_default(topo, "thread_siblings_list", str(cpuid))
+        self.siblings = tuple(sorted(cpulist_utils.expand_cpulist(siblings)))
+
+        # data and unified caches keyed by level, the value is the
+        # list of cpus sharing that cache with this cpu
+        self.caches = {}
+        for idx in glob.glob(os.path.join(self.path, "cache", "index[0-9]*")):
+            if _sysread_default(idx, "type", "") == "Instruction":
+                continue
+            try:
+                level = int(sysread(idx, "level"))
+                shared = cpulist_utils.expand_cpulist(sysread(idx, "shared_cpu_list"))
+            except (OSError, ValueError):
+                continue
+            self.caches[level] = tuple(sorted(shared))
+
+    def __int__(self):
+        return self.cpuid
+
+    def __str__(self):
+        return str(self.cpuid)
+
+    def llc(self):
+        """ return the cpus sharing the last level cache with this cpu """
+        if not self.caches:
+            return (self.cpuid,)
+        return self.caches[max(self.caches)]
+
+
 #
 # class to abstract access to NUMA nodes in /sys filesystem
 #
@@ -59,14 +122,16 @@ def cpuinfo():
 class NumaNode:
     "class representing a system NUMA node"
 
-    def __init__(self, path):
+    def __init__(self, path, online=None):
         """ constructor argument is the full path to the /sys node file
         e.g. /sys/devices/system/node/node0
+        online is an optional list of online cpus, which saves
+        reading the online file of every cpu in the node
         """
         self.path = path
         self.nodeid = int(os.path.basename(path)[4:].strip())
         self.cpus = cpulist_utils.expand_cpulist(sysread(self.path, "cpulist"))
-        self.cpus = cpulist_utils.online_cpulist(self.cpus)
+        self.cpus = _filter_online(self.cpus, online)
         self.getmeminfo()
 
     def __contains__(self, cpu):
@@ -102,7 +167,7 @@ class NumaNode:
 
     def getcpulist(self):
         """ return list of cpus for this node """
-        return self.cpus
+        return list(self.cpus)
 
 class SimNumaNode(NumaNode):
     """class representing a simulated NUMA node.
@@ -113,10 +178,10 @@ class SimNumaNode(NumaNode):
     cpupath = '/sys/devices/system/cpu'
     mempath = '/proc/meminfo'
 
-    def __init__(self):
+    def __init__(self, online=None):
         self.nodeid = 0
         self.cpus = cpulist_utils.expand_cpulist(sysread(SimNumaNode.cpupath, "possible"))
-        self.cpus = cpulist_utils.online_cpulist(self.cpus)
+        self.cpus = _filter_online(self.cpus, online)
         self.getmeminfo()
 
     def getmeminfo(self):
@@ -134,15 +199,21 @@ class SimNumaNode(NumaNode):
 # Class to abstract the system topology of numa nodes and cpus
 #
 class SysTopology:
-    "Object that represents the system's NUMA-node/cpu topology"
+    """Object that represents the system's NUMA-node/cpu topology
+
+    The object is a snapshot taken when it is created; use
+    get_systopology() to share one snapshot between all modules
+    """
 
     cpupath = '/sys/devices/system/cpu'
     nodepath = '/sys/devices/system/node'
 
     def __init__(self):
         self.nodes = {}
+        self.cpus = {}
+        self.__online_str = _sysread_default(SysTopology.cpupath, "online", None)
+        self.__cpuinfo = None
         self.getinfo()
-        self.current = 0
 
     def __len__(self):
         return len(list(self.nodes.keys()))
@@ -164,27 +235,46 @@ class SysTopology:
         return self.nodes[key]
 
     def __iter__(self):
-        """ allow iteration over the cpus for the node """
-        return self
-
-    def __next__(self):
-        """ iterator function """
-        if self.current >= len(self.nodes):
-            raise StopIteration
-        n = self.nodes[self.current]
-        self.current += 1
-        return n
+        """ allow iteration over the nodes """
+        return iter([self.nodes[n] for n in sorted(self.nodes)])
 
     def getinfo(self):
         """ Initialize class Systopology """
+        online = None
+        if self.__online_str is not None:
+            online = set(cpulist_utils.expand_cpulist(self.__online_str))
+
         nodes = glob.glob(os.path.join(SysTopology.nodepath, 'node[0-9]*'))
         if nodes:
             nodes.sort()
             for n in nodes:
                 node = int(os.path.basename(n)[4:])
-                self.nodes[node] = NumaNode(n)
+                self.nodes[node] = NumaNode(n, online)
         else:
-            self.nodes[0] = SimNumaNode()
+            self.nodes[0] = SimNumaNode(online)
+
+        # read the isolated cpus once for the whole system
+        allcpus = []
+        for n in self.nodes:
+            allcpus += self.nodes[n].cpus
+        isolated = set(cpulist_utils.isolated_cpulist(allcpus))
+        self.__online = sorted(allcpus)
+        self.__isolated = sorted(isolated)
+        self.__default = sorted(cpulist_utils.nonisolated_cpulist(allcpus))
+
+        for n, node in self.nodes.items():
+            for c in node.cpus:
+                self.cpus[c] = Cpu(c, n, c in isolated)
+
+    def stale(self):
+        """ return True if cpus were hotplugged since the snapshot was taken """
+        return _sysread_default(SysTopology.cpupath, "online", None) != self.__online_str
+
+    def cpuinfo(self):
+        """ return the /proc/cpuinfo dictionary, parsed once per snapshot """
+        if self.__cpuinfo is None:
+            self.__cpuinfo = cpuinfo()
+        return self.__cpuinfo
 
     def getnodes(self):
         """ return a list of nodes """
@@ -194,29 +284,29 @@ class SysTopology:
         """ return a dictionary of cpus keyed with the node """
         return self.nodes[node].getcpulist()
 
+    def getcpu(self, cpu):
+        """ return the Cpu object of an online cpu """
+        return self.cpus[int(cpu)]
+
+    def siblings(self, cpu):
+        """ return the SMT siblings of cpu, including cpu itself """
+        return list(self.cpus[int(cpu)].siblings)
+
+    def llc(self, cpu):
+        """ return the online cpus sharing the last level cache with cpu """
+        return [c for c in self.cpus[int(cpu)].llc() if c in self.cpus]
+
     def online_cpus(self):
         """ return a list of integers of all online cpus """
-        cpulist = []
-        for n in self.nodes:
-            cpulist += cpulist_utils.online_cpulist(self.getcpus(n))
-        cpulist.sort()
-        return cpulist
+        return list(self.__online)
 
     def isolated_cpus(self):
         """ return a list of integers of all isolated cpus """
-        cpulist = []
-        for n in self.nodes:
-            cpulist += cpulist_utils.isolated_cpulist(self.getcpus(n))
-        cpulist.sort()
-        return cpulist
+        return list(self.__isolated)
 
     def default_cpus(self):
         """ return a list of integers of all default schedulable cpus, i.e. online non-isolated cpus """
-        cpulist = []
-        for n in self.nodes:
-            cpulist += cpulist_utils.nonisolated_cpulist(self.getcpus(n))
-        cpulist.sort()
-        return cpulist
+        return list(self.__default)
 
     def online_cpus_str(self):
         """ return a list of strings of numbers of all online cpus """
@@ -241,6 +331,26 @@ class SysTopology:
         """ return a list of online cpus in cpulist """
         return [c for c in self.online_cpus() if c in cpulist]
 
+    def default_cpulist(self, cpulist):
+        """ return a list of default schedulable cpus in cpulist """
+        return [c for c in self.default_cpus() if c in cpulist]
+
+
+_systopology = None
+_systopology_lock = threading.Lock()
+
+def get_systopology(refresh=False):
+    """
+    Return the topology snapshot shared by all of rteval, creating it on
+    first use. Pass refresh=True to take a new snapshot, e.g. after a
+    cpu hotplug event (see SysTopology.stale())
+    """
+    global _systopology
+    with _systopology_lock:
+        if refresh or _systopology is None:
+            _systopology = SysTopology()
+        return _systopology
+
 
 def parse_cpulist_from_config(cpulist, run_on_isolcpus=False):
     """
@@ -249,16 +359,17 @@ def parse_cpulist_from_config(cpulist, run_on_isolcpus=False):
     :param run_on_isolcpus: Value of --*-run-on-isolcpus argument
     :return: Sorted list of CPUs as integers
     """
+    systop = get_systopology()
     if cpulist and not cpulist_utils.is_relative(cpulist):
         result = cpulist_utils.expand_cpulist(cpulist)
         # Only include online cpus
-        result = cpulist_utils.online_cpulist(result)
+        result = systop.online_cpulist(result)
     else:
-        result = SysTopology().online_cpus()
+        result = systop.online_cpus()
         # Get the cpuset from the environment
         cpuset = os.sched_getaffinity(0)
         # Get isolated CPU list
-        isolcpus = SysTopology().isolated_cpus()
+        isolcpus = systop.isolated_cpus()
         if cpulist and cpulist_utils.is_relative(cpulist):
             # Include cpus that are not removed in relative cpuset and are either in cpuset from affinity,
             # isolcpus (with run_on_isolcpus enabled, or added by relative cpuset
@@ -278,7 +389,7 @@ if __name__ == "__main__":
 
     def unit_test():
         """ unit test, run python rteval/systopology.py """
-        s = SysTopology()
+        s = get_systopology()
         print(s)
         print(f"number of nodes: {len(s)}")
         for n in s:
@@ -303,4 +414,8 @@ if __name__ == "__main__":
 
         cpulist = [ 2, 4, 5 ]
         print(f"invert of {cpulist} = {s.invert_cpulist(cpulist)}")
+
+        for cpu in s.online_cpus():
+            print(f"cpu{cpu}: siblings = {s.siblings(cpu)}, llc = {s.llc(cpu)}")
+        print(f"snapshot shared: {get_systopology() is s}, stale: {s.stale()}")
     unit_test()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Parser of the rtla timerlat auto-analysis
+
+When rtla timerlat stops tracing (-T) it prints, for each cpu that hit
+the threshold, a breakdown of the thread latency followed by the
+threads, IRQs and softirqs that delayed it.  TimerlatAnalysis is fed
+that text a line at a time and keeps structured records of it.  Lines
+are recognized by their label rather than by field positions, as the
+spacing and the number of fields differ between rtla versions.
+"""
+
+import re
+import libxml2
+
+# labels of the latency breakdown, they are reported with spaces replaced by '_'
+BREAKDOWN = ('Previous IRQ interference', 'IRQ handler delay', 'IRQ latency',
+             'Timerlat IRQ duration', 'Blocking thread', 'IRQ interference',
+             'Softirq interference', 'Thread latency')
+
+# breakdown lines followed by a list of the tasks or interrupts involved
+INTERFERENCE = {'Blocking thread': 'blocking_thread',
+                'IRQ interference': 'irq_interference',
+                'Softirq interference': 'softirq_interference'}
+
+_CPU = re.compile(r'^##\s*CPU\s+(\d+)\s+hit stop tracing')
+_LABEL = re.compile(r'^([A-Za-z][A-Za-z ]*[A-Za-z])\s*:?\s*(.*)$')
+_LATENCY = re.compile(r'(\(exit from idle\)\s*)?(?:up to\s+)?([\d.]+)\s*us'
+                      r'(?:\s*\(\s*([\d.]+)\s*%\s*\))?(?:\s+in cpu\s+(\d+))?$')
+_ENTRY = re.compile(r'^(.*\S)\s+([\d.]+)\s*us$')
+
+
+class StopTraceCPU:
+    """ the auto-analysis of one cpu """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # name -> (latency, percent or None)
+        self.breakdown = {}
+        # 'blocking_thread' etc. -> [(name, latency)]
+        self.interference = {kind: [] for kind in INTERFERENCE.values()}
+        # the stack of the blocking thread, outermost call last
+        self.stack = []
+
+    def ranked(self, kind):
+        """ return the entries of an interference kind, largest first """
+        return sorted(self.interference[kind], key=lambda e: e[1], reverse=True)
+
+    def MakeReport(self):
+        stoptrace_n = libxml2.newNode('stoptrace_report')
+        stoptrace_n.newProp('CPU', str(self.cpu))
+        for name, (latency, percent) in self.breakdown.items():
+            if percent is None:
+                n = stoptrace_n.newTextChild(None, name, f"{latency:.2f}")
+                n.newProp('unit', 'us')
+                continue
+            cpu_n = stoptrace_n.newChild(None, name, None)
+            n = cpu_n.newTextChild(None, 'latency', f"{latency:.2f}")
+            n.newProp('unit', 'us')
+            n = cpu_n.newTextChild(None, 'latency_percent', f"{percent:.2f}")
+            n.newProp('unit', '%')
+        for kind in self.interference:
+            for name, latency in self.ranked(kind):
+                cpu_n = stoptrace_n.newChild(None, kind, None)
+                cpu_n.newTextChild(None, 'name', name)
+                n = cpu_n.newTextChild(None, 'latency', f"{latency:.2f}")
+                n.newProp('unit', 'us')
+        if self.stack:
+            stack_n = stoptrace_n.newChild(None, 'stack', None)
+            for func in self.stack:
+                stack_n.newTextChild(None, 'frame', func)
+        return stoptrace_n
+
+
+class TimerlatAnalysis:
+    """ incremental parser of the rtla timerlat auto-analysis """
+    def __init__(self):
+        # cpu -> StopTraceCPU, in the order rtla printed them
+        self.cpus = {}
+        # cpu -> the max timerlat IRQ latency from idle
+        self.idle_max = {}
+        self.__cpu = None
+        self.__section = None
+        self.__chunks = []
+        self.unparsed = 0
+
+    @property
+    def cpu(self):
+        """ the cpu analyzed last, None before the first """
+        return self.__cpu.cpu if self.__cpu else None
+
+    def text(self):
+        """ return the text fed so far """
+        return ''.join(self.__chunks)
+
+    def feed(self, line):
+        """ parse one line of rtla output """
+        self.__chunks.append(line)
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith('---'):
+            self.__section = None
+            return
+        if line.startswith('##'):
+            match = _CPU.match(line)
+            if match:
+                self.__cpu = self.cpus.setdefault(int(match.group(1)), StopTraceCPU(int(match.group(1))))
+                self.__section = None
+            return
+        if line.startswith('->'):
+            if self.__cpu and self.__section == 'stack':
+                self.__cpu.stack.append(line[2:].strip())
+            return
+
+        match = _LABEL.match(line)
+        if match and (match.group(1) in BREAKDOWN or match.group(1).startswith('Max timerlat IRQ latency')):
+            self.__label(match.group(1), match.group(2))
+            return
+        if match and match.group(1).endswith('stack trace'):
+            self.__section = 'stack'
+            return
+
+        # an entry of the current interference list
+        match = _ENTRY.match(line)
+        if match and self.__cpu and self.__section in self.__cpu.interference:
+            self.__cpu.interference[self.__section].append((match.group(1), float(match.group(2))))
+            return
+        self.unparsed += 1
+
+    def __label(self, label, rest):
+        match = _LATENCY.search(rest)
+        if not match:
+            self.unparsed += 1
+            return
+        exit_idle, latency, percent, cpu = match.groups()
+        if label.startswith('Max timerlat IRQ latency'):
+            if cpu is not None:
+                self.idle_max[int(cpu)] = float(latency)
+            return
+        if self.__cpu is None:
+            self.unparsed += 1
+            return
+        name = label.replace(' ', '_')
+        if exit_idle:
+            name += '_exit_from_idle'
+        self.__cpu.breakdown[name] = (float(latency), float(percent) if percent is not None else None)
+        self.__section = INTERFERENCE.get(label)
+
+    def feed_lines(self, lines):
+        """ parse an iterable of lines """
+        for line in lines:
+            self.feed(line)
+
+    def aggregate(self):
+        """ return the interference of all cpus as a list of
+        (kind, name, cpus, count, total, max), largest total first """
+        found = {}
+        for rec in self.cpus.values():
+            for kind, entries in rec.interference.items():
+                for name, latency in entries:
+                    agg = found.setdefault((kind, name), [set(), 0, 0.0, 0.0])
+                    agg[0].add(rec.cpu)
+                    agg[1] += 1
+                    agg[2] += latency
+                    agg[3] = max(agg[3], latency)
+        ranked = [(kind, name, sorted(cpus), count, total, maximum)
+                  for (kind, name), (cpus, count, total, maximum) in found.items()]
+        return sorted(ranked, key=lambda r: (r[4], r[5]), reverse=True)
+
+    def MakeReport(self):
+        """ return the stoptrace_report, max_timerlat_report and
+        stoptrace_summary nodes """
+        nodes = [rec.MakeReport() for rec in self.cpus.values()]
+        for cpu, latency in self.idle_max.items():
+            max_timerlat_n = libxml2.newNode('max_timerlat_report')
+            max_timerlat_n.newProp('CPU', str(cpu))
+            n = max_timerlat_n.newTextChild(None, 'Max_timerlat_IRQ_latency_from_idle', f"{latency:.2f}")
+            n.newProp('unit', 'us')
+            nodes.append(max_timerlat_n)
+
+        summary_n = libxml2.newNode('stoptrace_summary')
+        summary_n.newProp('cpus', str(len(self.cpus)))
+        for rank, (kind, name, cpus, count, total, maximum) in enumerate(self.aggregate(), 1):
+            n = summary_n.newChild(None, 'interferer', None)
+            n.newProp('rank', str(rank))
+            n.newProp('kind', kind)
+            n.newProp('name', name)
+            n.newProp('cpus', ','.join(str(c) for c in cpus))
+            n.newProp('count', str(count))
+            n.newProp('total', f"{total:.2f}")
+            n.newProp('max', f"{maximum:.2f}")
+            n.newProp('unit', 'us')
+        nodes.append(summary_n)
+        return nodes
+
+
+SAMPLE = """rtla timerlat hit stop tracing
+## CPU 3 hit stop tracing, analyzing it ##
+  Previous IRQ interference:			up to      2.49 us
+  IRQ handler delay:		(exit from idle)	    12.44 us (21.57 %)
+  IRQ latency:						    15.40 us
+  Timerlat IRQ duration:				     5.95 us (10.32 %)
+  Blocking thread:					    20.41 us (35.40 %)
+			stress-ng:2342				    20.41 us
+    Blocking thread stack trace
+		-> timerlat_irq
+		-> __hrtimer_run_queues
+		-> hrtimer_interrupt
+  IRQ interference				     3.21 us (5.57 %)
+		      local_timer:236				     1.21 us
+		         nvme0q3:97				     2.00 us
+  Softirq interference				     8.10 us (14.05 %)
+			      SCHED:7				     8.10 us
+------------------------------------------------------------------------
+  Thread latency:					    57.65 us (100%)
+
+## CPU 5 hit stop tracing, analyzing it ##
+  IRQ handler delay:					     0.50 us (1.00 %)
+  IRQ latency:						     1.40 us
+  Timerlat IRQ duration:				     2.00 us (4.00 %)
+  IRQ interference				    40.00 us (80.00 %)
+		      local_timer:236				    40.00 us
+------------------------------------------------------------------------
+  Thread latency:					    50.00 us (100%)
+
+  Max timerlat IRQ latency from idle: 17.02 us in cpu 3
+  Saving trace to timerlat_trace.txt
+"""
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/timerlat_analysis.py """
+    try:
+        ana = TimerlatAnalysis()
+        ana.feed_lines(SAMPLE.splitlines(keepends=True))
+        print(f"cpus: {list(ana.cpus)}, idle max: {ana.idle_max}, unparsed: {ana.unparsed}")
+        assert list(ana.cpus) == [3, 5] and ana.cpu == 5
+        assert ana.text() == SAMPLE
+        rec = ana.cpus[3]
+        assert rec.breakdown['Previous_IRQ_interference'] == (2.49, None)
+        assert rec.breakdown['IRQ_handler_delay_exit_from_idle'] == (12.44, 21.57)
+        assert rec.breakdown['IRQ_latency'] == (15.40, None)
+        assert rec.breakdown['Thread_latency'] == (57.65, 100.0)
+        assert rec.interference['blocking_thread'] == [('stress-ng:2342', 20.41)]
+        assert rec.ranked('irq_interference') == [('nvme0q3:97', 2.0), ('local_timer:236', 1.21)]
+        assert rec.interference['softirq_interference'] == [('SCHED:7', 8.10)]
+        assert rec.stack == ['timerlat_irq', '__hrtimer_run_queues', 'hrtimer_interrupt']
+        assert ana.idle_max == {3: 17.02}
+        # the 'rtla timerlat hit stop tracing' header and 'Saving trace to'
+        # are not recognized, every other line is
+        assert ana.unparsed == 2
+        known = TimerlatAnalysis()
+        known.feed_lines(l for l in SAMPLE.splitlines(keepends=True)
+                         if not l.startswith(('rtla timerlat hit', '  Saving trace to')))
+        assert known.unparsed == 0, f"{known.unparsed} lines unparsed"
+
+        agg = ana.aggregate()
+        print(f"aggregate: {agg}")
+        assert agg[0] == ('irq_interference', 'local_timer:236', [3, 5], 2, 41.21, 40.0)
+        assert agg[1][1] == 'stress-ng:2342'
+
+        nodes = ana.MakeReport()
+        assert [n.name for n in nodes] == ['stoptrace_report', 'stoptrace_report',
+                                           'max_timerlat_report', 'stoptrace_summary']
+        assert nodes[0].prop('CPU') == '3' and nodes[-1].prop('cpus') == '2'
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unit_test(None))
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+""" Attribution of latency outliers in saved traces
+
+A trace is read as a pipeline of generators, so a trace of hundreds of
+megabytes is never held in memory:
+
+  read_lines()     lines of a text trace, gzip compressed or not, or of
+                   'trace-cmd report' for a trace.dat
+  parse_events()   TraceEvent tuples
+  find_outliers()  the events of the outlier cpu during each outlier,
+                   only the last 'horizon' seconds of every cpu are kept
+  attribute()      the time the tasks, IRQs and softirqs ran in a window
+
+Outliers are the rteval_wakeup_lat events of the tracering module and
+the trace marks of cyclictest --tracemark above a threshold.
+"""
+
+import re
+import gzip
+import heapq
+import subprocess
+from collections import deque, namedtuple
+import libxml2
+
+TraceEvent = namedtuple('TraceEvent', 'task pid cpu ts event data')
+Outlier = namedtuple('Outlier', 'cpu ts latency pid events')
+
+#      cyclictest-1234    [003] d.h1.  1234.567890: irq_handler_entry: irq=27 name=eth0
+_LINE = re.compile(r'^\s*(.+)-(\d+)\s+(?:\(\s*[\d-]+\)\s+)?\[(\d+)\]\s+(?:\S+\s+)?'
+                   r'(\d+\.\d+):\s+(\w+):\s?(.*)$')
+_TRACEMARK = re.compile(r'hit latency threshold \((\d+) > (\d+)\)')
+
+
+def read_lines(path):
+    """ yield the lines of a trace file """
+    if path.endswith('.dat'):
+        with subprocess.Popen(['trace-cmd', 'report', '-i', path], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True) as proc:
+            yield from proc.stdout
+        return
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', errors='replace') as f:
+        yield from f
+
+
+def parse_events(lines):
+    """ yield a TraceEvent for every event line """
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        match = _LINE.match(line)
+        if match:
+            task, pid, cpu, ts, event, data = match.groups()
+            yield TraceEvent(task.strip(), int(pid), int(cpu), float(ts), event, data.rstrip())
+
+
+def fields(event):
+    """ return the key=value fields of an event as a dict """
+    ret = {}
+    for field in event.data.split():
+        key, sep, value = field.strip('[]').partition('=')
+        if sep:
+            ret[key] = value
+    return ret
+
+
+def outlier_latency(event, threshold):
+    """ return (latency in us, pid) if event is an outlier, else None """
+    if event.event == 'rteval_wakeup_lat':
+        f = fields(event)
+        lat = int(f.get('lat', 0))
+        return (lat, int(f.get('pid', event.pid))) if lat > threshold else None
+    if event.event in ('print', 'tracing_mark_write'):
+        match = _TRACEMARK.search(event.data)
+        if match and int(match.group(1)) > threshold:
+            return int(match.group(1)), event.pid
+    return None
+
+
+def find_outliers(events, threshold=0, horizon=0.01):
+    """ yield an Outlier, with the events of its cpu during the latency,
+    for every outlier above threshold us.  Events older than horizon
+    seconds are dropped, which bounds memory and the window length """
+    recent = {}
+    for event in events:
+        window = recent.setdefault(event.cpu, deque())
+        window.append(event)
+        while event.ts - window[0].ts > horizon:
+            window.popleft()
+        found = outlier_latency(event, threshold)
+        if found:
+            latency, pid = found
+            start = event.ts - latency / 1e6
+            # from the sched_switch before the window on, to know what ran at its start
+            inside = [e for e in window if e.ts >= start]
+            before = [e for e in window if e.ts < start and e.event == 'sched_switch']
+            yield Outlier(event.cpu, event.ts, latency, pid, before[-1:] + inside)
+
+
+def attribute(outlier):
+    """ return {(kind, name): [count, us]} of the time tasks, irqs and
+    softirqs ran on the cpu during the outlier.  Task times include the
+    interrupts taking place while they ran """
+    end = outlier.ts
+    start = end - outlier.latency / 1e6
+    causes = {}
+
+    def add(kind, name, t0, t1):
+        overlap = min(t1, end) - max(t0, start)
+        if overlap > 0:
+            cause = causes.setdefault((kind, name), [0, 0.0])
+            cause[0] += 1
+            cause[1] += overlap * 1e6
+
+    irqs = {}
+    softirqs = {}
+    task = None
+    since = start
+    for event in outlier.events:
+        if task is None and event.event != 'sched_switch':
+            # no switch before the window, the task of the first event ran
+            task = f"{event.task}:{event.pid}"
+        if event.event == 'irq_handler_entry':
+            f = fields(event)
+            irqs[f.get('irq')] = (f"{f.get('name', '')}:{f.get('irq')}", event.ts)
+        elif event.event == 'irq_handler_exit':
+            name, t0 = irqs.pop(fields(event).get('irq'), (None, None))
+            if name:
+                add('irq', name, t0, event.ts)
+        elif event.event == 'softirq_entry':
+            f = fields(event)
+            softirqs[f.get('vec')] = (f.get('action', f.get('vec')), event.ts)
+        elif event.event == 'softirq_exit':
+            name, t0 = softirqs.pop(fields(event).get('vec'), (None, None))
+            if name:
+                add('softirq', name, t0, event.ts)
+        elif event.event == 'sched_switch':
+            if task:
+                add('task', task, since, event.ts)
+            f = fields(event)
+            task = f"{f.get('next_comm')}:{f.get('next_pid')}"
+            since = event.ts
+    # what was still running when the outlier was recorded
+    if task:
+        add('task', task, since, end)
+    for name, t0 in irqs.values():
+        add('irq', name, t0, end)
+    for name, t0 in softirqs.values():
+        add('softirq', name, t0, end)
+    # the woken thread itself did not delay anything
+    return {k: v for k, v in causes.items() if not (k[0] == 'task' and k[1].endswith(f":{outlier.pid}"))}
+
+
+class TraceAnalysis:
+    """ the worst outliers of a trace and their causes """
+    def __init__(self, path, threshold=0, horizon=0.01, keep=10):
+        self.path = path
+        self.threshold = threshold
+        self.outliers = 0
+        self.events = 0
+        # (latency, index, outlier, causes) of the worst outliers
+        self.worst = []
+
+        def counted(events):
+            for event in events:
+                self.events += 1
+                yield event
+
+        for outlier in find_outliers(counted(parse_events(read_lines(path))), threshold, horizon):
+            self.outliers += 1
+            entry = (outlier.latency, -self.outliers, outlier._replace(events=None), attribute(outlier))
+            if len(self.worst) < keep:
+                heapq.heappush(self.worst, entry)
+            else:
+                heapq.heappushpop(self.worst, entry)
+        self.worst.sort(reverse=True)
+
+    def MakeReport(self, top=10):
+        rep_n = libxml2.newNode('analysis')
+        rep_n.newProp('events', str(self.events))
+        rep_n.newProp('outliers', str(self.outliers))
+        for latency, _, outlier, causes in self.worst:
+            out_n = rep_n.newChild(None, 'outlier', None)
+            out_n.newProp('cpu', str(outlier.cpu))
+            out_n.newProp('timestamp', f"{outlier.ts:.6f}")
+            out_n.newProp('latency', str(latency))
+            out_n.newProp('pid', str(outlier.pid))
+            out_n.newProp('unit', 'us')
+            ranked = sorted(causes.items(), key=lambda c: c[1][1], reverse=True)
+            for (kind, name), (count, duration) in ranked[:top]:
+                n = out_n.newChild(None, 'cause', None)
+                n.newProp('kind', kind)
+                n.newProp('name', name)
+                n.newProp('count', str(count))
+                n.newProp('duration', f"{duration:.1f}")
+                n.newProp('unit', 'us')
+        return rep_n
+
+
+SAMPLE = """# tracer: nop
+#
+            bash-800     [001] d.h1.  100.000000: irq_handler_entry: irq=30 name=eth0
+          <idle>-0       [002] d.h1.  100.000010: irq_handler_entry: irq=27 name=nvme0q2
+          <idle>-0       [002] d.h1.  100.000030: irq_handler_exit: irq=27 ret=handled
+          <idle>-0       [002] d..2.  100.000040: sched_switch: prev_comm=swapper/2 prev_pid=0 prev_prio=120 prev_state=R ==> next_comm=stress-ng next_pid=4321 next_prio=120
+       stress-ng-4321    [002] d.h1.  100.000100: sched_waking: comm=cyclictest pid=1234 prio=4 target_cpu=002
+       stress-ng-4321    [002] d.h1.  100.000120: irq_handler_entry: irq=0 name=timer
+       stress-ng-4321    [002] d.h1.  100.000130: irq_handler_exit: irq=0 ret=handled
+       stress-ng-4321    [002] ..s1.  100.000140: softirq_entry: vec=7 [action=SCHED]
+       stress-ng-4321    [002] ..s1.  100.000180: softirq_exit: vec=7 [action=SCHED]
+       stress-ng-4321    [002] d..2.  100.000250: sched_switch: prev_comm=stress-ng prev_pid=4321 prev_prio=120 prev_state=R ==> next_comm=cyclictest next_pid=1234 next_prio=4
+       stress-ng-4321    [002] d..2.  100.000250: rteval_wakeup_lat: lat=150 pid=1234
+            bash-800     [001] d.h1.  100.000300: irq_handler_exit: irq=30 ret=handled
+      cyclictest-1234    [002] .....  100.000300: tracing_mark_write: hit latency threshold (20 > 10)
+      cyclictest-1234    [002] d..2.  100.000400: rteval_wakeup_lat: lat=5 pid=1234
+"""
+
+
+def unit_test(rootdir):
+    """ unit test, run python rteval/trace_analysis.py """
+    import os
+    import tempfile
+    try:
+        events = list(parse_events(SAMPLE.splitlines()))
+        assert len(events) == 14 and events[0] == TraceEvent('bash', 800, 1, 100.0, 'irq_handler_entry', 'irq=30 name=eth0')
+        assert fields(events[7]) == {'vec': '7', 'action': 'SCHED'}
+
+        outliers = list(find_outliers(iter(events), threshold=10))
+        print(f"outliers: {[(o.cpu, o.latency) for o in outliers]}")
+        assert [(o.cpu, o.latency, o.pid) for o in outliers] == [(2, 150, 1234), (2, 20, 1234)]
+
+        causes = attribute(outliers[0])
+        print(f"causes: {causes}")
+        assert causes[('task', 'stress-ng:4321')][0] == 1
+        assert abs(causes[('task', 'stress-ng:4321')][1] - 150) < 0.01
+        assert abs(causes[('irq', 'timer:0')][1] - 10) < 0.01
+        assert abs(causes[('softirq', 'SCHED')][1] - 40) < 0.01
+        # nvme0q2 ended before the window and eth0 is on another cpu
+        assert ('irq', 'nvme0q2:27') not in causes and ('irq', 'eth0:30') not in causes
+
+        # short horizons cut the window
+        assert list(find_outliers(iter(events), threshold=10, horizon=0.00005))[0].events[0].ts >= 100.0002
+
+        with tempfile.NamedTemporaryFile('wb', suffix='.txt.gz', delete=False) as f:
+            f.write(gzip.compress(SAMPLE.encode()))
+        try:
+            ana = TraceAnalysis(f.name, threshold=10, keep=1)
+        finally:
+            os.unlink(f.name)
+        assert ana.events == 14 and ana.outliers == 2 and len(ana.worst) == 1
+        rep_n = ana.MakeReport()
+        assert rep_n.prop('outliers') == '2'
+        return 0
+    except AssertionError as e:
+        print(f"** ASSERTION FAILED {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        # python rteval/trace_analysis.py TRACE [THRESHOLD]
+        doc = libxml2.newDoc('1.0')
+        doc.setRootElement(TraceAnalysis(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0).MakeReport())
+        doc.saveFormatFileEnc('-', 'UTF-8', 1)
+        sys.exit(0)
+    sys.exit(unit_test(None))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#   benchmark.py - time the post-processing paths of rteval on synthetic data
+#
+""" Benchmark of the rteval post-processing paths
+
+Generates synthetic cyclictest and rtla timerlat output for a configurable
+host, with the generators of rteval/simulation.py, and runs it through
+the real measurement modules, with stand-in cyclictest and rtla
+executables printing the synthetic output.  No RT kernel, root
+privileges or RT tools are needed.  The stages timed are:
+
+  <module>.parse      parsing the output into histograms (_WorkloadCleanup
+                      without the reduction)
+  <module>.reduce     computing the statistics of every cpu
+  <module>.report     MakeReport()
+  report.xml_write    writing summary.xml
+  report.xslt         the text report of rteval_text.xsl
+  report.archive      the .tar.bz2 of the report directory
+
+Results are printed as a table, --json writes them machine readable and
+--compare checks them against an earlier --json file.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+from datetime import datetime
+
+import libxml2
+
+# run from the source tree
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rteval import RTEVAL_VERSION
+from rteval import xmlout
+from rteval.rtevalConfig import rtevalCfgSection
+from rteval.modules.measurement import cyclictest, timerlat
+from rteval.simulation import cyclictest_output, timerlat_output
+
+XSLT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rteval', 'rteval_text.xsl'))
+
+# stages faster than this are noise when comparing results
+NOISE_FLOOR = 0.001
+
+
+class Timings:
+    """ the durations of every stage of all repetitions """
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage, func, *args):
+        """ call func, add its duration to stage and return its result """
+        start = time.perf_counter()
+        ret = func(*args)
+        self.add(stage, time.perf_counter() - start)
+        return ret
+
+    def results(self):
+        return {stage: {'median': statistics.median(t), 'min': min(t), 'max': max(t), 'runs': len(t)}
+                for stage, t in self.stages.items()}
+
+
+class ReduceTimer:
+    """ sum up the time the reduce() of a run data class takes """
+    def __init__(self, cls):
+        self.__cls = cls
+        self.__reduce = cls.reduce
+        self.seconds = 0.0
+
+    def __enter__(self):
+        reduce = self.__reduce
+
+        def timed_reduce(rundata):
+            start = time.perf_counter()
+            reduce(rundata)
+            self.seconds += time.perf_counter() - start
+        self.__cls.reduce = timed_reduce
+        return self
+
+    def __exit__(self, *exc):
+        self.__cls.reduce = self.__reduce
+
+
+def fake_tool(bindir, name, output):
+    """ write an executable called name printing the file output """
+    path = os.path.join(bindir, name)
+    with open(path, 'w') as f:
+        f.write(f"#!/bin/sh\nexec cat '{output}'\n")
+    os.chmod(path, 0o755)
+
+
+def run_module(timings, modname, create, rundata, cfg):
+    """ run a measurement module through its lifecycle against the fake
+    tool, timing the post-processing.  Returns the report node """
+    mod = create(rtevalCfgSection(dict(cfg)), None)
+    mod._WorkloadSetup()
+    mod._WorkloadBuild()
+    mod._WorkloadPrepare()
+    mod._WorkloadTask()
+    while mod.WorkloadAlive():
+        time.sleep(0.005)
+    with ReduceTimer(rundata) as reduce:
+        start = time.perf_counter()
+        mod._WorkloadCleanup()
+        elapsed = time.perf_counter() - start
+    timings.add(f"{modname}.parse", elapsed - reduce.seconds)
+    timings.add(f"{modname}.reduce", reduce.seconds)
+    return timings.timed(f"{modname}.report", mod.MakeReport)
+
+
+def run_once(timings, sizes, workdir, args):
+    """ one repetition of all stages """
+    cpulist = f"0-{args.cpus - 1}"
+    nodes = [run_module(timings, 'cyclictest', cyclictest.create, cyclictest.RunData,
+                        {'cpulist': cpulist, 'buckets': args.buckets}),
+             run_module(timings, 'timerlat', timerlat.create, timerlat.TLRunData,
+                        {'cpulist': cpulist, 'buckets': args.buckets,
+                         'stoptrace': 1 if args.stoptrace else 0})]
+
+    reportdir = os.path.join(workdir, 'rteval-benchmark')
+    if os.path.exists(reportdir):
+        shutil.rmtree(reportdir)
+    os.mkdir(reportdir)
+
+    report = xmlout.XMLOut('rteval', RTEVAL_VERSION)
+    report.NewReport()
+    meas_n = libxml2.newNode('Measurements')
+    meas_n.newProp('measurecpus', cpulist)
+    for node in nodes:
+        meas_n.addChild(node)
+    report.AppendXMLnodes(meas_n)
+    report.close()
+    xmlfile = os.path.join(reportdir, 'summary.xml')
+    timings.timed('report.xml_write', report.Write, xmlfile, None)
+    textfile = os.path.join(reportdir, 'summary.txt')
+    timings.timed('report.xslt', report.Write, textfile, XSLT)
+
+    def archive():
+        with tarfile.open(reportdir + '.tar.bz2', 'w:bz2') as tar:
+            tar.add(reportdir, arcname=os.path.basename(reportdir))
+    timings.timed('report.archive', archive)
+
+    sizes['summary.xml'] = os.path.getsize(xmlfile)
+    sizes['summary.txt'] = os.path.getsize(textfile)
+    sizes['archive'] = os.path.getsize(reportdir + '.tar.bz2')
+
+
+def compare(results, baseline, tolerance):
+    """ return the stages whose median is more than tolerance percent
+    slower than in baseline """
+    slower = []
+    for stage, res in results.items():
+        base = baseline.get('results', {}).get(stage)
+        if not base or res['median'] - base['median'] < NOISE_FLOOR:
+            continue
+        change = (res['median'] / base['median'] - 1) * 100 if base['median'] else float('inf')
+        if change > tolerance:
+            slower.append((stage, base['median'], res['median'], change))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rteval post-processing on synthetic data")
+    parser.add_argument('--cpus', type=int, default=16, help="measured cpus (default: %(default)s)")
+    parser.add_argument('--buckets', type=int, default=3500, help="histogram buckets (default: %(default)s)")
+    parser.add_argument('--samples', type=int, default=10**7, help="samples per cpu (default: %(default)s)")
+    parser.add_argument('--outliers', type=int, default=20,
+                        help="single sample outliers per cpu (default: %(default)s)")
+    parser.add_argument('--overflows', type=int, default=0,
+                        help="cyclictest samples above the histogram per cpu (default: %(default)s)")
+    parser.add_argument('--stoptrace', type=int, default=0, metavar='CPUS',
+                        help="cpus with a timerlat stop trace analysis (default: %(default)s)")
+    parser.add_argument('--interferers', type=int, default=5,
+                        help="IRQs in each stop trace analysis (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="repetitions (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed (default: %(default)s)")
+    parser.add_argument('--json', metavar='FILE', help="write the results to FILE, '-' for stdout")
+    parser.add_argument('--compare', metavar='FILE', help="compare with the results of an earlier --json")
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help="percent a stage may be slower than in --compare (default: %(default)s)")
+    parser.add_argument('--keep', action='store_true', help="keep the synthetic data and reports")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rteval-benchmark-')
+    rng = random.Random(args.seed)
+    timings = Timings()
+    sizes = {}
+    path = os.environ.get('PATH', '')
+    try:
+        bindir = os.path.join(workdir, 'bin')
+        os.mkdir(bindir)
+        generators = (('cyclictest', cyclictest_output,
+                       (rng, args.cpus, args.buckets, args.samples, args.outliers, args.overflows)),
+                      ('rtla', timerlat_output,
+                       (rng, args.cpus, args.buckets, args.samples, args.outliers,
+                        args.stoptrace, args.interferers)))
+        for name, generate, genargs in generators:
+            output = os.path.join(workdir, f'{name}.out')
+            with open(output, 'w') as f:
+                f.write(timings.timed(f'{name}.generate', generate, *genargs))
+            sizes[f'{name}.out'] = os.path.getsize(output)
+            fake_tool(bindir, name, output)
+        os.environ['PATH'] = f"{bindir}:{path}"
+
+        for _ in range(args.repeat):
+            run_once(timings, sizes, workdir, args)
+    finally:
+        os.environ['PATH'] = path
+        if args.keep:
+            print(f"synthetic data and reports kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir)
+
+    results = timings.results()
+    doc = {'rteval_version': RTEVAL_VERSION,
+           'date': datetime.now().isoformat(timespec='seconds'),
+           'host': platform.node(),
+           'python': platform.python_version(),
+           'parameters': {k: v for k, v in vars(args).items() if k not in ('json', 'compare', 'keep')},
+           'results': results,
+           'bytes': sizes,
+           'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    out = sys.stderr if args.json == '-' else sys.stdout
+    print(f"{'stage':<22} {'median':>10} {'min':>10} {'max':>10}", file=out)
+    for stage, res in results.items():
+        print(f"{stage:<22} {res['median']:10.4f} {res['min']:10.4f} {res['max']:10.4f}", file=out)
+    print(f"max RSS {doc['maxrss_kb']} KB, " + ', '.join(f"{k} {v} bytes" for k, v in sizes.items()), file=out)
+
+    if args.json == '-':
+        json.dump(doc, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(doc, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for stage, before, after, change in slower:
+            print(f"REGRESSION {stage}: {before:.4f}s -> {after:.4f}s (+{change:.0f}%)", file=out)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -113,6 +113,16 @@ if __name__ == '__main__':
             ('rteval/sysinfo','dmi'),
             ('rteval','rtevalConfig'),
             ('rteval','xmlout'),
+            ('rteval','placement'),
+            ('rteval','spawn'),
+            ('rteval','cgroup'),
+            ('rteval/modules/loads','stressng'),
+            ('rteval','histogram'),
+            ('rteval','timerlat_analysis'),
+            ('rteval','trace_analysis'),
+            ('rteval','simulation'),
+            ('rteval','histfile'),
+            ('rteval','fleet'),
             ))
     # Run all tests
     tests.RunTests()